@@ -1,8 +1,20 @@
 import { VarianceManager } from '../services/variance_manager';
 import alertService from '../services/alerts';
+import { metrics } from '../services/metrics';
 import { spawn } from 'child_process';
 import path from 'path';
 
+// predict.py output; the quantiles are only present for models with leaf quantiles
+interface MLPrediction {
+    mean: number;
+    variance: number;
+    tail_risk: number;
+    p5?: number;
+    p50?: number;
+    p90?: number;
+    p95?: number;
+}
+
 class BookingController {
     private varianceManager: VarianceManager;
 
@@ -64,9 +76,11 @@ class BookingController {
         }
         
         const risk = mlResult.mean > 0 ? (mlResult.variance / mlResult.mean) * 100 : 0; // Risk as percentage
+        // Models with leaf quantiles give their 90% range (p5-p95); mean/variance models and the
+        // fallback estimate keep the mean ± 1.96 std range shown before quantiles existed
         const std_dev = Math.sqrt(mlResult.variance);
-        const lower_bound = Math.max(0, mlResult.mean - 1.96 * std_dev);
-        const upper_bound = mlResult.mean + 1.96 * std_dev;
+        const lower_bound = mlResult.p5 !== undefined ? mlResult.p5 : Math.max(0, mlResult.mean - 1.96 * std_dev);
+        const upper_bound = mlResult.p95 !== undefined ? mlResult.p95 : mlResult.mean + 1.96 * std_dev;
         const expected_range = `${lower_bound.toFixed(1)} - ${upper_bound.toFixed(1)} minutes`;
         
         // Calculate recommended arrival time
@@ -82,6 +96,7 @@ class BookingController {
             prediction: mlResult.mean, 
             variance: mlResult.variance, 
             tail_risk: mlResult.tail_risk, 
+            quantiles: mlResult.p50 !== undefined ? { p50: mlResult.p50, p90: mlResult.p90, p95: mlResult.p95 } : null,
             risk, 
             expected_range,
             recommended_arrival: recommended_arrival.toISOString(),
@@ -113,7 +128,7 @@ class BookingController {
         return await this.database.getAvailableSlots(doctorId);
     }
 
-    private async getMLPrediction(total_queue_length: number, patients_at_current_stage: number, staff_at_current_stage: number, hospital_occupancy: number, patient_age: number, traffic_level: number, doctor_experience: number, slot_time: string): Promise<{mean: number, variance: number, tail_risk: number}> {
+    private async getMLPrediction(total_queue_length: number, patients_at_current_stage: number, staff_at_current_stage: number, hospital_occupancy: number, patient_age: number, traffic_level: number, doctor_experience: number, slot_time: string): Promise<MLPrediction> {
         // Call Python ML script
         const pythonProcess = spawn('python', [
             path.join(__dirname, '../../../ml/scripts/predict.py'),
@@ -127,6 +142,17 @@ class BookingController {
             slot_time
         ]);
 
+        metrics.increment('ml_prediction_requests_total');
+        const started = Date.now();
+        const elapsedSeconds = () => (Date.now() - started) / 1000;
+        // 'close' can follow 'error'; count each request once
+        let counted = false;
+        const fallback = (reason: string) => {
+            if (!counted) metrics.increment('ml_fallback_total', { reason });
+            counted = true;
+            return this.getFallbackPrediction(total_queue_length);
+        };
+
         return new Promise((resolve) => {
             let data = '';
             let errorData = '';
@@ -137,28 +163,29 @@ class BookingController {
             pythonProcess.on('error', () => {
                 // Python not available or script error - use fallback
                 console.log('ML prediction unavailable, using fallback estimation');
-                resolve(this.getFallbackPrediction(total_queue_length));
+                resolve(fallback('spawn_error'));
             });
             
             pythonProcess.on('close', (code) => {
+                metrics.observe('ml_prediction_seconds', elapsedSeconds());
                 if (code === 0 && data.trim()) {
                     try {
                         const result = JSON.parse(data.trim());
                         resolve(result);
                     } catch (e) {
                         console.log('Failed to parse ML output, using fallback');
-                        resolve(this.getFallbackPrediction(total_queue_length));
+                        resolve(fallback('invalid_output'));
                     }
                 } else {
                     console.log('ML script failed, using fallback estimation');
-                    resolve(this.getFallbackPrediction(total_queue_length));
+                    resolve(fallback('script_failed'));
                 }
             });
         });
     }
 
     // Fallback prediction when ML service is unavailable
-    private getFallbackPrediction(queueLength: number): { mean: number; variance: number; tail_risk: number } {
+    private getFallbackPrediction(queueLength: number): MLPrediction {
         // Realistic wait time estimation based on queue length
         // Empty queue: ~5 min (just check-in time)
         // Each patient adds ~8-12 minutes
@@ -1,4 +1,6 @@
 import { Request, Response } from 'express';
+import { spawn } from 'child_process';
+import path from 'path';
 import { VarianceManager } from '../services/variance_manager';
 
 export class QueueController {
@@ -63,12 +65,21 @@ export class QueueController {
         const { patientId, actualDuration } = req.body;
         try {
             await this.database.saveActualTime(doctorId, patientId, actualDuration);
+            this.refreshDurationStats();
             res.status(200).json({ message: 'Slot time updated' });
         } catch (error: any) {
             res.status(500).json({ error: error.message });
         }
     }
 
+    private refreshDurationStats(): void {
+        // Fold the new completion into the per-doctor duration stats; predictions read them without SQL
+        const statsProcess = spawn('python3', [path.join(__dirname, '../../../ml/scripts/duration_stats.py')], {
+            cwd: path.join(__dirname, '../../../ml/scripts')
+        });
+        statsProcess.on('error', (error) => console.error('Duration stats update failed:', error.message));
+    }
+
     private async recalculateQueueWaitTimes(doctorId: string): Promise<void> {
         // Logic to update wait times for patients in queue based on actual durations
         const queue = await this.database.getQueueStatus(doctorId);
@@ -6,6 +6,7 @@ import BookingController from '../controllers/booking';
 import QueueController from '../controllers/queue';
 import * as database from '../utils/database';
 import authController from '../controllers/auth';
+import { metrics, fetchPredictorMetrics } from '../services/metrics';
 
 const router = express.Router();
 const upload = multer({ dest: 'uploads/' });
@@ -522,17 +523,33 @@ router.post('/notifications/:id/read', authenticate, async (req, res) => {
 // ML Prediction Routes
 // ==========================================
 
+// Backend ML counters (fallbacks, latency) plus the prediction server's own metrics when it is running
+router.get('/metrics', async (req, res) => {
+    try {
+        if (req.query.format === 'json') {
+            const predictor = await fetchPredictorMetrics('json');
+            return res.json({ backend: metrics.toJSON(), predictor });
+        }
+        const predictor = await fetchPredictorMetrics('prometheus');
+        res.type('text/plain; version=0.0.4').send(metrics.toPrometheus() + (predictor || ''));
+    } catch (e: any) {
+        res.status(500).json({ error: e.message });
+    }
+});
+
 // Predict wait time for a patient
 router.post('/predict/wait-time', async (req, res) => {
-    const { queueLength, specialty, appointmentTime, doctorAvgTime } = req.body;
+    const { queueLength, specialty, appointmentTime, doctorAvgTime, doctorId } = req.body;
     try {
+        // Without doctorAvgTime the service uses the doctor's tracked consultation times
         const pythonProcess = spawn('python3', [
             path.join(__dirname, '../services/ml_predictions.py'),
             'predict_wait',
             String(queueLength || 0),
             specialty || 'General',
             appointmentTime || '',
-            String(doctorAvgTime || 0)
+            String(doctorAvgTime || 0),
+            doctorId ? String(doctorId) : ''
         ]);
         
         let result = '';
@@ -587,7 +604,50 @@ router.post('/predict/slot-availability', async (req, res) => {
     }
 });
 
-// Get current queue with ML predictions
+// Rank the best open slots for a doctor or a whole specialty
+router.get('/recommend-slots', async (req, res) => {
+    const { doctorId, specialty, start, end, days, k } = req.query;
+    if (!doctorId && !specialty) {
+        return res.status(400).json({ error: 'Missing required query parameter: doctorId or specialty' });
+    }
+    try {
+        const args = {
+            doctor_id: doctorId ? parseInt(doctorId as string) : undefined,
+            specialty: specialty || undefined,
+            start: start || undefined,
+            end: end || undefined,
+            days: days ? parseInt(days as string) : 7,
+            top_k: k ? parseInt(k as string) : 5
+        };
+        const pythonProcess = spawn('python3', [
+            path.join(__dirname, '../services/ml_predictions.py'),
+            'recommend_slots'
+        ]);
+        
+        let result = '';
+        pythonProcess.stdout.on('data', (data) => { result += data.toString(); });
+        pythonProcess.stderr.on('data', (data) => { console.error('ML Error:', data.toString()); });
+        
+        pythonProcess.on('close', (code) => {
+            if (code === 0) {
+                try {
+                    res.json(JSON.parse(result));
+                } catch (e) {
+                    res.status(500).json({ error: 'Invalid ML response' });
+                }
+            } else {
+                res.status(500).json({ error: 'Slot recommendation failed' });
+            }
+        });
+        
+        pythonProcess.stdin.write(JSON.stringify(args));
+        pythonProcess.stdin.end();
+    } catch (e: any) {
+        res.status(500).json({ error: e.message });
+    }
+});
+
+// Get current queue with ML predictions (computed per request; displays read /queue/:doctorId/waits)
 router.get('/queue/:doctorId/predictions', authenticate, async (req, res) => {
     try {
         const doctorId = parseInt(req.params.doctorId);
@@ -602,31 +662,41 @@ router.get('/queue/:doctorId/predictions', authenticate, async (req, res) => {
             [doctorId]
         );
         
-        // Add ML predictions for each patient
-        const queueWithPredictions = await Promise.all(queue.map(async (patient: any, index: number) => {
-            return new Promise((resolve) => {
-                const pythonProcess = spawn('python3', [
-                    path.join(__dirname, '../services/ml_predictions.py'),
-                    'predict_wait',
-                    String(index),
-                    'General',
-                    patient.slot_time || '',
-                    '15'
-                ]);
-                
-                let result = '';
-                pythonProcess.stdout.on('data', (data) => { result += data.toString(); });
-                
-                pythonProcess.on('close', (code) => {
-                    let prediction = null;
-                    if (code === 0) {
-                        try {
-                            prediction = JSON.parse(result);
-                        } catch (e) {}
-                    }
-                    resolve({ ...patient, prediction });
-                });
+        // Predict the whole queue with a single ML process
+        const entries = queue.map((patient: any, index: number) => ({
+            queue_length: index,
+            specialty: 'General',
+            appointment_time: patient.slot_time || '',
+            doctor_id: doctorId
+        }));
+        const predictions: any[] = await new Promise((resolve) => {
+            const pythonProcess = spawn('python3', [
+                path.join(__dirname, '../services/ml_predictions.py'),
+                'predict_wait_batch'
+            ]);
+            
+            let result = '';
+            pythonProcess.stdout.on('data', (data) => { result += data.toString(); });
+            pythonProcess.stderr.on('data', (data) => { console.error('ML Error:', data.toString()); });
+            pythonProcess.on('error', () => resolve([]));
+            
+            pythonProcess.on('close', (code) => {
+                let parsed: any[] = [];
+                if (code === 0) {
+                    try {
+                        parsed = JSON.parse(result);
+                    } catch (e) {}
+                }
+                resolve(Array.isArray(parsed) ? parsed : []);
             });
+            
+            pythonProcess.stdin.write(JSON.stringify(entries));
+            pythonProcess.stdin.end();
+        });
+        
+        const queueWithPredictions = queue.map((patient: any, index: number) => ({
+            ...patient,
+            prediction: predictions[index] || null
         }));
         
         res.json(queueWithPredictions);
@@ -635,6 +705,75 @@ router.get('/queue/:doctorId/predictions', authenticate, async (req, res) => {
     }
 });
 
+// Forecast every position of a doctor's live queue from the services ahead of it
+router.get('/queue/:doctorId/forecast', authenticate, async (req, res) => {
+    try {
+        const doctorId = parseInt(req.params.doctorId);
+        const rows = await database.query(
+            `SELECT id, position, stage, estimated_duration, stage_start_time
+             FROM queue
+             WHERE doctor_id = ?
+             ORDER BY position`,
+            [doctorId]
+        );
+        
+        const pythonProcess = spawn('python3', [
+            path.join(__dirname, '../services/ml_predictions.py'),
+            'forecast_queue'
+        ]);
+        
+        let result = '';
+        pythonProcess.stdout.on('data', (data) => { result += data.toString(); });
+        pythonProcess.stderr.on('data', (data) => { console.error('ML Error:', data.toString()); });
+        
+        pythonProcess.on('close', (code) => {
+            if (code === 0) {
+                try {
+                    res.json(JSON.parse(result));
+                } catch (e) {
+                    res.status(500).json({ error: 'Invalid ML response' });
+                }
+            } else {
+                res.status(500).json({ error: 'ML forecast failed' });
+            }
+        });
+        
+        pythonProcess.stdin.write(JSON.stringify(rows));
+        pythonProcess.stdin.end();
+    } catch (e: any) {
+        res.status(500).json({ error: e.message });
+    }
+});
+
+// Precomputed waits of a doctor's live queues, for display
+router.get('/queue/:doctorId/waits', authenticate, async (req, res) => {
+    try {
+        const doctorId = parseInt(req.params.doctorId);
+        // Waits are precomputed in bulk by ml/scripts/queue_forecast.py, so this is a plain lookup
+        const queue = await database.query(
+            `SELECT q.*, qt.name as queue_type_name, qf.projected_wait_minutes, qf.updated_at as forecast_updated_at
+             FROM queue q
+             LEFT JOIN queue_types qt ON q.queue_type_id = qt.id
+             LEFT JOIN queue_forecasts qf ON qf.queue_type_id = q.queue_type_id AND qf.doctor_id = q.doctor_id
+             WHERE q.doctor_id = ?
+             ORDER BY q.queue_type_id, q.position`,
+            [doctorId]
+        );
+        
+        res.json(queue.map((patient: any) => ({
+            ...patient,
+            // null until the forecast job has seen the row
+            prediction: patient.estimated_wait === null ? null : {
+                predicted_wait_minutes: Math.round(patient.estimated_wait),
+                projected_queue_wait_minutes: patient.projected_wait_minutes,
+                updated_at: patient.forecast_updated_at
+            }
+        })));
+    } catch (e: any) {
+        res.status(500).json({ error: e.message });
+    }
+});
+
 // ==========================================
 // Multi-Queue System Routes
 // ==========================================
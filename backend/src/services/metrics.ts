@@ -0,0 +1,91 @@
+import net from 'net';
+
+// Socket of ml/scripts/prediction_server.py, same default as predict.py
+const PREDICTOR_SOCKET = process.env.MEDIQUEUE_PREDICTOR_SOCKET || '/tmp/mediqueue_predictor.sock';
+
+type Labels = Record<string, string>;
+
+export class MetricsRegistry {
+    private counters = new Map<string, Map<string, number>>();
+    private durations = new Map<string, Map<string, { count: number; sum: number }>>();
+
+    private static labelKey(labels: Labels = {}): string {
+        const entries = Object.entries(labels);
+        if (entries.length === 0) return '';
+        return '{' + entries.map(([key, value]) => `${key}="${value}"`).join(',') + '}';
+    }
+
+    increment(name: string, labels?: Labels, amount: number = 1): void {
+        const series = this.counters.get(name) || new Map<string, number>();
+        const key = MetricsRegistry.labelKey(labels);
+        series.set(key, (series.get(key) || 0) + amount);
+        this.counters.set(name, series);
+    }
+
+    observe(name: string, seconds: number, labels?: Labels): void {
+        const series = this.durations.get(name) || new Map<string, { count: number; sum: number }>();
+        const key = MetricsRegistry.labelKey(labels);
+        const summary = series.get(key) || { count: 0, sum: 0 };
+        summary.count += 1;
+        summary.sum += seconds;
+        series.set(key, summary);
+        this.durations.set(name, series);
+    }
+
+    toJSON(): any {
+        const result: any = { counters: {}, durations: {} };
+        this.counters.forEach((series, name) => {
+            result.counters[name] = {};
+            series.forEach((value, key) => { result.counters[name][key] = value; });
+        });
+        this.durations.forEach((series, name) => {
+            result.durations[name] = {};
+            series.forEach((summary, key) => { result.durations[name][key] = summary; });
+        });
+        return result;
+    }
+
+    toPrometheus(): string {
+        const lines: string[] = [];
+        this.counters.forEach((series, name) => {
+            lines.push(`# TYPE mediqueue_${name} counter`);
+            series.forEach((value, key) => lines.push(`mediqueue_${name}${key} ${value}`));
+        });
+        this.durations.forEach((series, name) => {
+            lines.push(`# TYPE mediqueue_${name} summary`);
+            series.forEach((summary, key) => {
+                lines.push(`mediqueue_${name}_sum${key} ${summary.sum}`);
+                lines.push(`mediqueue_${name}_count${key} ${summary.count}`);
+            });
+        });
+        return lines.join('\n') + '\n';
+    }
+}
+
+export const metrics = new MetricsRegistry();
+
+// Ask the long-lived prediction server for its own metrics; resolves null when it is not running
+export const fetchPredictorMetrics = (format: 'json' | 'prometheus', timeoutMs: number = 1000): Promise<any> => {
+    return new Promise((resolve) => {
+        const socket = net.createConnection(PREDICTOR_SOCKET);
+        let buffer = '';
+        const finish = (value: any) => {
+            socket.destroy();
+            resolve(value);
+        };
+        socket.setTimeout(timeoutMs, () => finish(null));
+        socket.on('error', () => finish(null));
+        socket.on('connect', () => socket.write(JSON.stringify({ op: 'metrics', format }) + '\n'));
+        socket.on('data', (chunk) => {
+            buffer += chunk.toString();
+            const newline = buffer.indexOf('\n');
+            if (newline === -1) return;
+            try {
+                const response = JSON.parse(buffer.slice(0, newline));
+                finish(format === 'prometheus' ? response.prometheus : response);
+            } catch (e) {
+                finish(null);
+            }
+        });
+    });
+};
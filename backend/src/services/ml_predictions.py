@@ -9,11 +9,27 @@ Uses a simple ML model to predict patient wait times based on:
 - Doctor's workload
 """
 
+import hashlib
 import json
+import sqlite3
 import sys
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import random
+from contextlib import closing
+
+import numpy as np
+
+# Shared helpers live with the ML scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../ml/scripts'))
+from atomic_file import atomic_open
+from duration_stats import DurationStatsStore
+from instrumentation import METRICS, enable_profiling
+from prediction_cache import PredictionCache, quantize
+from queue_stages import DEFAULT_DURATION, IN_SERVICE_STAGE, remaining_minutes
+
+DB_PATH = os.environ.get('DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../database/queue.db')
+SLOT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../ml/models/slot_load_index.npz')
 
 # Simple feature-based prediction model
 # In production, this would use a trained sklearn/tensorflow model
@@ -51,9 +67,81 @@ class WaitTimePredictor:
         6: 0.0,   # Sunday (closed)
     }
     
-    def __init__(self):
+    # Hour boundaries matching _get_time_factor, used by the batch path
+    TIME_FACTOR_BINS = [8, 10, 12, 14, 16]
+    
+    # Expected wait cut-offs (minutes) between the availability levels below
+    AVAILABILITY_BINS = [20, 40]
+    AVAILABILITY_LEVELS = [
+        ('HIGH', 'Excellent choice! Low expected wait time.'),
+        ('MEDIUM', 'Good availability. Moderate wait expected.'),
+        ('LOW', 'Consider an earlier time for shorter wait.'),
+    ]
+    
+    # Simulated model uncertainty: predictions are scaled by a factor in this band
+    NOISE_BAND = (0.9, 1.1)
+    
+    # 'random': fresh jitter per call (legacy)
+    # 'seeded': jitter derived from the inputs, identical inputs give identical output
+    # 'analytic': no jitter, the band is folded into min/max instead
+    NOISE_MODES = ('random', 'seeded', 'analytic')
+    
+    def __init__(self, cache: PredictionCache = None, noise_mode: str = 'seeded', duration_stats: DurationStatsStore = None):
+        if noise_mode not in self.NOISE_MODES:
+            raise ValueError(f'Unknown noise mode: {noise_mode}')
         self.historical_data = []
+        self.cache = cache
+        self.noise_mode = noise_mode
+        self.duration_stats = duration_stats
+    
+    def _doctor_avg_time(self, doctor_avg_time: float, doctor_id: int, specialty: str) -> float:
+        """Caller's average if given, else the doctor's (or specialty's) recent mean from the stats store"""
+        if doctor_avg_time or self.duration_stats is None or (doctor_id is None and not specialty):
+            return doctor_avg_time
+        return self.duration_stats.average_duration(doctor_id, specialty)
         
+    def _input_key(self, queue_length: int, specialty: str, when: datetime, doctor_avg_time: float = None) -> tuple:
+        """Everything predict() depends on; only the hour and weekday of the time matter"""
+        return quantize(
+            [queue_length, specialty, when.hour, when.weekday(), doctor_avg_time or 0],
+            [None, None, None, None, 0.1])
+    
+    def _noise_factor(self, key: tuple) -> float:
+        """Multiplier within NOISE_BAND according to noise_mode"""
+        low, high = self.NOISE_BAND
+        if self.noise_mode == 'analytic':
+            return 1.0
+        if self.noise_mode == 'seeded':
+            digest = hashlib.sha256(repr(key).encode()).digest()
+            return low + (high - low) * int.from_bytes(digest[:8], 'big') / 2**64
+        return random.uniform(low, high)
+    
+    def _wait_range(self, predicted_wait, confidence):
+        """min/max wait around a prediction; works on scalars and arrays"""
+        if self.noise_mode == 'analytic':
+            # Envelope of every outcome the noisy modes could produce
+            low, high = self.NOISE_BAND
+            return predicted_wait * low * confidence, predicted_wait * high * (2 - confidence)
+        margin = predicted_wait * (1 - confidence)
+        return np.maximum(0, predicted_wait - margin), predicted_wait + margin
+        
+    def _get_time_factors(self, hours: np.ndarray) -> np.ndarray:
+        """Vectorized _get_time_factor over an array of hours"""
+        factors = np.array([
+            self.TIME_FACTORS['late_afternoon'],  # before 8 AM
+            self.TIME_FACTORS['early_morning'],
+            self.TIME_FACTORS['mid_morning'],
+            self.TIME_FACTORS['lunch'],
+            self.TIME_FACTORS['afternoon'],
+            self.TIME_FACTORS['late_afternoon'],  # 4 PM onwards
+        ])
+        return factors[np.digitize(hours, self.TIME_FACTOR_BINS)]
+    
+    def _get_day_factors(self, weekdays: np.ndarray) -> np.ndarray:
+        """Vectorized DAY_FACTORS lookup over an array of weekdays"""
+        factors = np.array([self.DAY_FACTORS[day] for day in range(7)])
+        return factors[weekdays]
+    
     def _get_time_factor(self, hour: int) -> float:
         """Get time of day multiplier"""
         if 8 <= hour < 10:
@@ -71,7 +159,8 @@ class WaitTimePredictor:
                 queue_length: int, 
                 specialty: str = 'General',
                 appointment_time: str = None,
-                doctor_avg_time: float = None) -> dict:
+                doctor_avg_time: float = None,
+                doctor_id: int = None) -> dict:
         """
         Predict wait time for a patient
         
@@ -80,10 +169,40 @@ class WaitTimePredictor:
             specialty: Doctor's specialty
             appointment_time: ISO format datetime string
             doctor_avg_time: Doctor's historical average consultation time
+            doctor_id: Looks up doctor_avg_time in the stats store when it is not given
         
         Returns:
             dict with predicted_wait_minutes, confidence, and range
         """
+        METRICS.increment('predictions_total')
+        with METRICS.stage('duration_stats_lookup'):
+            doctor_avg_time = self._doctor_avg_time(doctor_avg_time, doctor_id, specialty)
+        if self.cache is None:
+            return self._predict(queue_length, specialty, appointment_time, doctor_avg_time)
+        
+        now = self._parse_time(appointment_time)
+        key = ('wait', self.noise_mode) + self._input_key(queue_length, specialty, now, doctor_avg_time)
+        return self.cache.get_or_compute(
+            key, lambda: self._predict(queue_length, specialty, appointment_time, doctor_avg_time))
+    
+    def _parse_time(self, appointment_time: str = None) -> datetime:
+        if appointment_time:
+            try:
+                return datetime.fromisoformat(appointment_time.replace('Z', '+00:00'))
+            except:
+                pass
+        return datetime.now()
+    
+    def _predict(self, 
+                 queue_length: int, 
+                 specialty: str = 'General',
+                 appointment_time: str = None,
+                 doctor_avg_time: float = None) -> dict:
+        """Uncached body of predict()"""
+        with METRICS.stage('heuristic_predict'):
+            return self._compute(queue_length, specialty, appointment_time, doctor_avg_time)
+    
+    def _compute(self, queue_length, specialty, appointment_time, doctor_avg_time) -> dict:
         # Base consultation time
         base_time = self.SPECIALTY_TIMES.get(specialty, self.SPECIALTY_TIMES['default'])
         
@@ -92,12 +211,7 @@ class WaitTimePredictor:
             base_time = (base_time + doctor_avg_time) / 2
         
         # Get current time factors
-        now = datetime.now()
-        if appointment_time:
-            try:
-                now = datetime.fromisoformat(appointment_time.replace('Z', '+00:00'))
-            except:
-                pass
+        now = self._parse_time(appointment_time)
         
         time_factor = self._get_time_factor(now.hour)
         day_factor = self.DAY_FACTORS.get(now.weekday(), 1.0)
@@ -109,21 +223,19 @@ class WaitTimePredictor:
         adjusted_wait = base_wait * time_factor * day_factor
         
         # Add some variance (simulating ML uncertainty)
-        variance = random.uniform(0.9, 1.1)
+        variance = self._noise_factor(self._input_key(queue_length, specialty, now, doctor_avg_time))
         predicted_wait = adjusted_wait * variance
         
         # Calculate confidence (decreases with queue length)
         confidence = max(0.6, 1.0 - (queue_length * 0.03))
         
         # Calculate range
-        margin = predicted_wait * (1 - confidence)
-        min_wait = max(0, predicted_wait - margin)
-        max_wait = predicted_wait + margin
+        min_wait, max_wait = self._wait_range(predicted_wait, confidence)
         
         return {
             'predicted_wait_minutes': round(predicted_wait),
-            'min_wait_minutes': round(min_wait),
-            'max_wait_minutes': round(max_wait),
+            'min_wait_minutes': round(float(min_wait)),
+            'max_wait_minutes': round(float(max_wait)),
             'confidence': round(confidence, 2),
             'factors': {
                 'base_consultation_time': base_time,
@@ -133,6 +245,84 @@ class WaitTimePredictor:
             }
         }
     
+    def predict_many(self, entries: list) -> list:
+        """
+        Predict wait times for a whole queue in one pass
+        
+        Args:
+            entries: list of dicts with the same keys as predict()'s arguments
+                     (queue_length, specialty, appointment_time, doctor_avg_time, doctor_id)
+        
+        Returns:
+            list of dicts shaped like predict()'s result, in input order
+        """
+        n = len(entries)
+        if n == 0:
+            return []
+        METRICS.increment('batch_rows_total', n)
+        with METRICS.stage('heuristic_predict_batch'):
+            return self._predict_many(entries)
+    
+    def _predict_many(self, entries: list) -> list:
+        n = len(entries)
+        
+        queue_length = np.array([int(e.get('queue_length') or 0) for e in entries])
+        doctor_avg_time = np.array([
+            float(self._doctor_avg_time(e.get('doctor_avg_time'), e.get('doctor_id'), e.get('specialty')) or 0)
+            for e in entries
+        ])
+        
+        # Specialty lookup once per distinct specialty
+        specialties = np.array([e.get('specialty') or 'General' for e in entries])
+        unique_specialties, inverse = np.unique(specialties, return_inverse=True)
+        specialty_times = np.array([
+            self.SPECIALTY_TIMES.get(name, self.SPECIALTY_TIMES['default']) for name in unique_specialties
+        ], dtype=float)
+        base_time = specialty_times[inverse]
+        has_avg = doctor_avg_time > 0
+        base_time = np.where(has_avg, (base_time + doctor_avg_time) / 2, base_time)
+        
+        # Parsing stays per row; the factor lookups below are vectorized
+        hours = np.empty(n, dtype=int)
+        weekdays = np.empty(n, dtype=int)
+        noise = np.empty(n)
+        for i, entry in enumerate(entries):
+            dt = self._parse_time(entry.get('appointment_time'))
+            hours[i] = dt.hour
+            weekdays[i] = dt.weekday()
+            if self.noise_mode == 'seeded':
+                noise[i] = self._noise_factor(self._input_key(
+                    int(queue_length[i]), str(specialties[i]), dt, float(doctor_avg_time[i])))
+        if self.noise_mode == 'random':
+            noise = np.random.uniform(*self.NOISE_BAND, n)
+        elif self.noise_mode == 'analytic':
+            noise = np.ones(n)
+        
+        time_factor = self._get_time_factors(hours)
+        day_factor = self._get_day_factors(weekdays)
+        
+        adjusted_wait = queue_length * base_time * time_factor * day_factor
+        predicted_wait = adjusted_wait * noise
+        
+        confidence = np.maximum(0.6, 1.0 - (queue_length * 0.03))
+        min_wait, max_wait = self._wait_range(predicted_wait, confidence)
+        
+        return [
+            {
+                'predicted_wait_minutes': int(np.rint(predicted_wait[i])),
+                'min_wait_minutes': int(np.rint(min_wait[i])),
+                'max_wait_minutes': int(np.rint(max_wait[i])),
+                'confidence': round(float(confidence[i]), 2),
+                'factors': {
+                    'base_consultation_time': float(base_time[i]) if has_avg[i] else int(base_time[i]),
+                    'time_of_day_factor': float(time_factor[i]),
+                    'day_of_week_factor': float(day_factor[i]),
+                    'queue_length': int(queue_length[i])
+                }
+            }
+            for i in range(n)
+        ]
+    
     def predict_slot_availability(self, 
                                   doctor_id: int,
                                   slot_time: str,
@@ -160,15 +350,8 @@ class WaitTimePredictor:
         expected_wait = current_bookings * 15 * time_factor * day_factor
         
         # Determine availability status
-        if expected_wait < 20:
-            status = 'HIGH'
-            recommendation = 'Excellent choice! Low expected wait time.'
-        elif expected_wait < 40:
-            status = 'MEDIUM'
-            recommendation = 'Good availability. Moderate wait expected.'
-        else:
-            status = 'LOW'
-            recommendation = 'Consider an earlier time for shorter wait.'
+        level = int(np.digitize(expected_wait, self.AVAILABILITY_BINS))
+        status, recommendation = self.AVAILABILITY_LEVELS[level]
         
         return {
             'slot_time': slot_time,
@@ -183,6 +366,389 @@ class WaitTimePredictor:
         }
 
 
+class QueueForecaster:
+    """
+    Wait time for every position of one doctor's queue from the services ahead
+
+    Patient k waits for the remaining service of everyone ahead of them, so
+    the wait mean and variance at k are prefix sums of per-patient service
+    mean and variance (durations treated as independent). forecast() builds
+    them for the whole queue in one pass. Between forecasts the queue can be
+    kept current without rebuilding: advance() drops the head in O(1) and
+    remove() / update_remaining() touch one patient in O(log n), with the
+    prefix sums kept in Fenwick trees.
+    """
+    
+    # Coefficient of variation of a consultation's length
+    DURATION_CV = 0.35
+    
+    # z-score of the min/max band (80% interval)
+    RANGE_Z = 1.2816
+    
+    def __init__(self, rows: list = None, now: datetime = None, default_duration: float = DEFAULT_DURATION):
+        self.default_duration = default_duration
+        self.load(rows or [], now)
+    
+    @staticmethod
+    def _parse_utc(value) -> datetime:
+        """SQLite datetime('now') text or ISO 8601 as naive UTC; None when missing or invalid"""
+        if not value:
+            return None
+        try:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    
+    def _service_moments(self, rows: list, now: datetime) -> tuple:
+        """Mean and variance of the service each row still needs, as arrays"""
+        durations = [float(r.get('estimated_duration') or self.default_duration) for r in rows]
+        stages = [r.get('stage') or 'waiting' for r in rows]
+        elapsed = np.full(len(rows), np.nan)
+        for i, (row, stage) in enumerate(zip(rows, stages)):
+            if stage == IN_SERVICE_STAGE:
+                started = self._parse_utc(row.get('stage_start_time'))
+                if started is not None:
+                    elapsed[i] = (now - started).total_seconds() / 60
+        
+        # Same remaining-time rules as the bulk forecast in ml/scripts/queue_forecast.py
+        remaining = remaining_minutes(durations, stages, elapsed)
+        variance = (self.DURATION_CV * remaining) ** 2
+        return remaining, variance
+    
+    def load(self, rows: list, now: datetime = None):
+        """Replace the queue with `rows`, ordered by position"""
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        self.ids = [r.get('id') for r in rows]
+        self.index = {queue_id: i for i, queue_id in enumerate(self.ids) if queue_id is not None}
+        self.mean, self.variance = self._service_moments(rows, now)
+        self.head = 0
+        self.head_mean = 0.0
+        self.head_variance = 0.0
+        self._tree_mean = self._build_tree(self.mean)
+        self._tree_variance = self._build_tree(self.variance)
+    
+    @staticmethod
+    def _build_tree(values: np.ndarray) -> np.ndarray:
+        """Fenwick tree over `values` in O(n)"""
+        n = len(values)
+        tree = np.zeros(n + 1)
+        tree[1:] = values
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        return tree
+    
+    @staticmethod
+    def _tree_add(tree: np.ndarray, i: int, delta: float):
+        i += 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+    
+    @staticmethod
+    def _tree_prefix(tree: np.ndarray, i: int) -> float:
+        """Sum of the first i values"""
+        total = 0.0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+    
+    def _set(self, i: int, mean: float, variance: float):
+        self._tree_add(self._tree_mean, i, mean - self.mean[i])
+        self._tree_add(self._tree_variance, i, variance - self.variance[i])
+        self.mean[i] = mean
+        self.variance[i] = variance
+    
+    def advance(self):
+        """The patient at the head is done; everyone behind moves up"""
+        if self.head >= len(self.mean):
+            return
+        self.index.pop(self.ids[self.head], None)
+        # Later prefix sums still include the head, so subtract it as an offset
+        self.head_mean += self.mean[self.head]
+        self.head_variance += self.variance[self.head]
+        self.head += 1
+    
+    def remove(self, queue_id):
+        """A patient left the queue (cancelled, transferred, no-show)"""
+        i = self.index[queue_id]
+        if i == self.head:
+            self.advance()
+        else:
+            self._set(i, 0.0, 0.0)
+            del self.index[queue_id]
+    
+    def update_remaining(self, queue_id, remaining_minutes: float):
+        """Re-estimate the service one patient still needs"""
+        i = self.index[queue_id]
+        if i >= self.head:
+            remaining = max(float(remaining_minutes), 0.0)
+            self._set(i, remaining, (self.DURATION_CV * remaining) ** 2)
+    
+    def wait(self, queue_id) -> tuple:
+        """(mean, variance) of one patient's wait in O(log n)"""
+        i = self.index[queue_id]
+        mean = self._tree_prefix(self._tree_mean, i) - self.head_mean
+        variance = self._tree_prefix(self._tree_variance, i) - self.head_variance
+        return max(float(mean), 0.0), max(float(variance), 0.0)
+    
+    def forecast(self) -> list:
+        """Wait distribution of every patient still in the queue, in one pass"""
+        mean = self.mean[self.head:]
+        variance = self.variance[self.head:]
+        # Exclusive prefix sums: the wait is what is ahead, not the patient's own service
+        wait_mean = np.concatenate([[0.0], np.cumsum(mean)[:-1]])
+        wait_std = np.sqrt(np.concatenate([[0.0], np.cumsum(variance)[:-1]]))
+        
+        min_wait = np.maximum(0.0, wait_mean - self.RANGE_Z * wait_std)
+        max_wait = wait_mean + self.RANGE_Z * wait_std
+        confidence = np.where(wait_mean > 0, np.maximum(0.6, 1.0 - wait_std / np.maximum(wait_mean, 1e-9)), 1.0)
+        
+        # Removed patients stay in the arrays with zero service; skip them here
+        ids = self.ids[self.head:]
+        present = [k for k, queue_id in enumerate(ids) if queue_id is None or queue_id in self.index]
+        return [
+            {
+                'id': ids[k],
+                'position': position,
+                'predicted_wait_minutes': int(np.rint(wait_mean[k])),
+                'min_wait_minutes': int(np.rint(min_wait[k])),
+                'max_wait_minutes': int(np.rint(max_wait[k])),
+                'wait_std_minutes': round(float(wait_std[k]), 1),
+                'confidence': round(float(confidence[k]), 2),
+                'remaining_service_minutes': round(float(mean[k]), 1),
+            }
+            for position, k in enumerate(present)
+        ]
+
+
+class SlotRecommender:
+    """
+    Rank every open slot of a doctor (or a whole specialty) over a date range
+    
+    Candidate slots come from doctors.available_slots and bookings for the
+    range are counted per doctor and hour in one query. Each slot's expected
+    load is the larger of what is already booked in that hour and what that
+    doctor's weekday/hour usually ends up with, taken from a load index
+    precomputed from appointment history. Scoring uses the same formula as
+    predict_slot_availability, applied to all candidates at once.
+    """
+    
+    ACTIVE_STATUSES = ('booked', 'in_queue', 'checked_in', 'waiting')
+    
+    # Score penalty (minutes of expected wait) per day a slot lies further out
+    DAYS_AHEAD_PENALTY = 2.0
+    
+    def __init__(self, predictor: WaitTimePredictor = None, db_path: str = DB_PATH, index_path: str = SLOT_INDEX_PATH):
+        self.predictor = predictor or WaitTimePredictor()
+        self.db_path = db_path
+        self.index_path = index_path
+        self.doctor_ids = np.zeros(0, dtype=np.int64)
+        self.load_index = np.zeros((0, 7, 24))
+        if os.path.exists(index_path):
+            with np.load(index_path) as index:
+                self.doctor_ids = index['doctor_ids']
+                self.load_index = index['load']
+    
+    def _connect(self):
+        return sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+    
+    def build_index(self) -> dict:
+        """
+        Mean bookings per doctor, weekday and hour over the appointment history
+        
+        Counts are divided by the number of distinct weeks each doctor has
+        appointments in, so a slot's value is its typical load in one week.
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute("""
+                SELECT doctor_id,
+                       (CAST(strftime('%w', appointment_time) AS INTEGER) + 6) % 7 AS weekday,
+                       CAST(strftime('%H', appointment_time) AS INTEGER) AS hour,
+                       COUNT(*)
+                FROM appointments
+                WHERE doctor_id IS NOT NULL AND strftime('%H', appointment_time) IS NOT NULL
+                GROUP BY 1, 2, 3
+            """).fetchall()
+            weeks = dict(conn.execute("""
+                SELECT doctor_id, COUNT(DISTINCT strftime('%Y-%W', appointment_time))
+                FROM appointments
+                WHERE doctor_id IS NOT NULL
+                GROUP BY 1
+            """).fetchall())
+        
+        data = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        doctor_ids = np.unique(data[:, 0]).astype(np.int64)
+        load = np.zeros((len(doctor_ids), 7, 24))
+        row = np.searchsorted(doctor_ids, data[:, 0].astype(np.int64))
+        n_weeks = np.array([weeks.get(int(d), 1) for d in doctor_ids], dtype=np.float64)
+        load[row, data[:, 1].astype(int), data[:, 2].astype(int)] = data[:, 3] / n_weeks[row]
+        
+        self.doctor_ids, self.load_index = doctor_ids, load
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        with atomic_open(self.index_path, 'wb') as f:
+            np.savez(f, doctor_ids=doctor_ids, load=load)
+        return {'doctors': len(doctor_ids), 'path': os.path.abspath(self.index_path)}
+    
+    def _candidates(self, conn, doctor_id, specialty, start: datetime, end: datetime) -> tuple:
+        """(doctor ids, slot datetimes, slot strings, doctor specialties) inside [start, end)"""
+        if doctor_id is not None:
+            doctors = conn.execute('SELECT id, specialty, available_slots FROM doctors WHERE id = ?', (int(doctor_id),)).fetchall()
+        else:
+            doctors = conn.execute(
+                'SELECT id, specialty, available_slots FROM doctors WHERE specialty = ? AND is_active = 1', (specialty,)).fetchall()
+        
+        ids, times, labels, specialties = [], [], [], []
+        for doc_id, doc_specialty, available in doctors:
+            for slot in json.loads(available or '[]'):
+                when = QueueForecaster._parse_utc(slot)
+                if when is not None and start <= when < end:
+                    ids.append(doc_id)
+                    times.append(when)
+                    labels.append(slot)
+                    specialties.append(doc_specialty or 'default')
+        return ids, times, labels, specialties
+    
+    def _bookings_per_hour(self, conn, doctor_ids: list, start: datetime, end: datetime) -> dict:
+        """Active bookings per (doctor_id, 'YYYY-MM-DD HH') in one grouped query"""
+        placeholders = ','.join('?' * len(doctor_ids))
+        statuses = ','.join('?' * len(self.ACTIVE_STATUSES))
+        rows = conn.execute(f"""
+            SELECT doctor_id, strftime('%Y-%m-%d %H', appointment_time), COUNT(*)
+            FROM appointments
+            WHERE doctor_id IN ({placeholders})
+              AND status IN ({statuses})
+              AND datetime(appointment_time) >= datetime(?) AND datetime(appointment_time) < datetime(?)
+            GROUP BY 1, 2
+        """, (*doctor_ids, *self.ACTIVE_STATUSES, start.isoformat(sep=' '), end.isoformat(sep=' '))).fetchall()
+        return {(doc_id, hour): count for doc_id, hour, count in rows}
+    
+    def recommend(self, doctor_id: int = None, specialty: str = None, start: str = None, end: str = None,
+                  days: int = 7, top_k: int = 5) -> dict:
+        """
+        Best `top_k` slots between `start` (default now) and `end` (default `days` later)
+        
+        Returns:
+            dict with the ranked slots (shaped like predict_slot_availability's
+            result plus doctor_id and score) and the number of candidates scored
+        """
+        if doctor_id is None and not specialty:
+            raise ValueError('doctor_id or specialty is required')
+        start_dt = QueueForecaster._parse_utc(start) or datetime.now(timezone.utc).replace(tzinfo=None)
+        end_dt = QueueForecaster._parse_utc(end) or start_dt + timedelta(days=days)
+        
+        with closing(self._connect()) as conn:
+            ids, times, labels, specialties = self._candidates(conn, doctor_id, specialty, start_dt, end_dt)
+            if not ids:
+                return {'slots': [], 'candidates': 0}
+            booked = self._bookings_per_hour(conn, sorted(set(ids)), start_dt, end_dt)
+        
+        n = len(ids)
+        ids = np.array(ids, dtype=np.int64)
+        hours = np.array([t.hour for t in times])
+        weekdays = np.array([t.weekday() for t in times])
+        days_ahead = np.array([(t - start_dt).total_seconds() / 86400 for t in times])
+        current = np.array([booked.get((int(ids[i]), times[i].strftime('%Y-%m-%d %H')), 0) for i in range(n)])
+        
+        # Typical load from the index; doctors without history fall back to current bookings only
+        typical = np.zeros(n)
+        if len(self.doctor_ids):
+            row = np.minimum(np.searchsorted(self.doctor_ids, ids), len(self.doctor_ids) - 1)
+            known = self.doctor_ids[row] == ids
+            typical[known] = self.load_index[row[known], weekdays[known], hours[known]]
+        expected_load = np.maximum(current, typical)
+        
+        predictor = self.predictor
+        base_time = np.array([predictor.SPECIALTY_TIMES.get(name, predictor.SPECIALTY_TIMES['default']) for name in specialties],
+                             dtype=float)
+        time_factor = predictor._get_time_factors(hours)
+        day_factor = predictor._get_day_factors(weekdays)
+        expected_wait = expected_load * base_time * time_factor * day_factor
+        score = expected_wait + self.DAYS_AHEAD_PENALTY * days_ahead
+        
+        # Closed days (day factor 0) are never recommended
+        score[day_factor == 0] = np.inf
+        k = min(top_k, int(np.isfinite(score).sum()))
+        best = np.argpartition(score, k - 1)[:k] if 0 < k < n else np.arange(n)[:k]
+        best = best[np.lexsort((days_ahead[best], score[best]))]
+        levels = np.digitize(expected_wait, predictor.AVAILABILITY_BINS)
+        
+        return {
+            'slots': [
+                {
+                    'doctor_id': int(ids[i]),
+                    'slot_time': labels[i],
+                    'availability': predictor.AVAILABILITY_LEVELS[levels[i]][0],
+                    'expected_wait_minutes': int(np.rint(expected_wait[i])),
+                    'recommendation': predictor.AVAILABILITY_LEVELS[levels[i]][1],
+                    'score': round(float(score[i]), 2),
+                    'factors': {
+                        'time_factor': float(time_factor[i]),
+                        'day_factor': float(day_factor[i]),
+                        'current_bookings': int(current[i]),
+                        'typical_bookings': round(float(typical[i]), 2)
+                    }
+                }
+                for i in best
+            ],
+            'candidates': n
+        }
+
+
+def serve(predictor: WaitTimePredictor, stdin=sys.stdin, stdout=sys.stdout, recommender: SlotRecommender = None):
+    """
+    Answer JSON-lines requests until stdin closes, keeping the cache warm
+    
+    Request:  {"id": 1, "command": "predict_wait", "args": {"queue_length": 3, ...}}
+    Commands: predict_wait, predict_wait_batch (args: {"entries": [...]}), predict_slot,
+              forecast_queue (args: {"rows": [...], "now": ...}),
+              recommend_slots (args: SlotRecommender.recommend's), stats,
+              metrics (args: {"format": "json" | "prometheus"})
+    """
+    for raw in stdin:
+        line = raw.strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            command = request.get('command')
+            args = request.get('args') or {}
+            if command == 'predict_wait':
+                result = predictor.predict(**args)
+            elif command == 'predict_wait_batch':
+                result = predictor.predict_many(args.get('entries', []))
+            elif command == 'predict_slot':
+                result = predictor.predict_slot_availability(**args)
+            elif command == 'forecast_queue':
+                now = QueueForecaster._parse_utc(args.get('now'))
+                result = QueueForecaster(args.get('rows', []), now).forecast()
+            elif command == 'recommend_slots':
+                recommender = recommender or SlotRecommender(predictor)
+                result = recommender.recommend(**args)
+            elif command == 'stats':
+                result = predictor.cache.stats() if predictor.cache else None
+            elif command == 'metrics':
+                if args.get('format') == 'prometheus':
+                    result = METRICS.to_prometheus()
+                else:
+                    result = METRICS.to_dict()
+            else:
+                raise ValueError(f'Unknown command: {command}')
+            response = {'id': request_id, 'result': result}
+        except Exception as e:
+            METRICS.increment('request_errors_total')
+            response = {'id': request_id, 'error': str(e)}
+        stdout.write(json.dumps(response) + '\n')
+        stdout.flush()
+
+
 def main():
     """CLI interface for the prediction service"""
     if len(sys.argv) < 2:
@@ -190,18 +756,59 @@ def main():
         sys.exit(1)
     
     command = sys.argv[1]
-    predictor = WaitTimePredictor()
+    METRICS.labels['predictor'] = 'heuristic'
+    # MEDIQUEUE_PROFILE=cprofile|sample dumps a profile of this run (see instrumentation)
+    enable_profiling()
+    noise_mode = os.environ.get('ML_PREDICTION_NOISE_MODE', 'seeded')
+    duration_stats = DurationStatsStore()
+    predictor = WaitTimePredictor(noise_mode=noise_mode, duration_stats=duration_stats)
     
     if command == 'predict_wait':
-        # Args: queue_length, specialty, appointment_time, doctor_avg_time
+        # Args: queue_length, specialty, appointment_time, doctor_avg_time, doctor_id
         queue_length = int(sys.argv[2]) if len(sys.argv) > 2 else 0
         specialty = sys.argv[3] if len(sys.argv) > 3 else 'General'
         appointment_time = sys.argv[4] if len(sys.argv) > 4 else None
         doctor_avg_time = float(sys.argv[5]) if len(sys.argv) > 5 else None
+        doctor_id = int(sys.argv[6]) if len(sys.argv) > 6 and sys.argv[6] else None
         
-        result = predictor.predict(queue_length, specialty, appointment_time, doctor_avg_time)
+        result = predictor.predict(queue_length, specialty, appointment_time, doctor_avg_time, doctor_id)
         print(json.dumps(result))
         
+    elif command == 'predict_wait_batch':
+        # Stdin: JSON array of {queue_length, specialty, appointment_time, doctor_avg_time, doctor_id}
+        try:
+            entries = json.load(sys.stdin)
+        except json.JSONDecodeError as e:
+            print(json.dumps({'error': f'Invalid JSON input: {e}'}))
+            sys.exit(1)
+        
+        result = predictor.predict_many(entries)
+        print(json.dumps(result))
+        
+    elif command == 'forecast_queue':
+        # Stdin: JSON array of queue rows ordered by position {id, stage, estimated_duration, stage_start_time}
+        try:
+            rows = json.load(sys.stdin)
+        except json.JSONDecodeError as e:
+            print(json.dumps({'error': f'Invalid JSON input: {e}'}))
+            sys.exit(1)
+        
+        print(json.dumps(QueueForecaster(rows).forecast()))
+        
+    elif command == 'recommend_slots':
+        # Stdin: JSON object {doctor_id | specialty, start, end, days, top_k}
+        try:
+            args = json.load(sys.stdin)
+        except json.JSONDecodeError as e:
+            print(json.dumps({'error': f'Invalid JSON input: {e}'}))
+            sys.exit(1)
+        
+        print(json.dumps(SlotRecommender(predictor).recommend(**args)))
+        
+    elif command == 'build_slot_index':
+        # Precompute the per-doctor, per-hour load index from appointment history
+        print(json.dumps(SlotRecommender(predictor).build_index()))
+        
     elif command == 'predict_slot':
         # Args: doctor_id, slot_time, current_bookings
         doctor_id = int(sys.argv[2]) if len(sys.argv) > 2 else 1
@@ -211,6 +818,11 @@ def main():
         result = predictor.predict_slot_availability(doctor_id, slot_time, current_bookings)
         print(json.dumps(result))
         
+    elif command == 'serve':
+        # Long-lived mode: repeated requests are answered from the cache
+        serve(WaitTimePredictor(cache=PredictionCache(maxsize=4096, ttl=60.0), noise_mode=noise_mode,
+                                duration_stats=duration_stats))
+        
     else:
         print(json.dumps({'error': f'Unknown command: {command}'}))
         sys.exit(1)
@@ -127,6 +127,23 @@ export const initDB = async () => {
             FOREIGN KEY (transferred_from) REFERENCES queue(id)
         );
         
+        -- Per-queue wait forecasts, rewritten by ml/scripts/queue_forecast.py
+        CREATE TABLE IF NOT EXISTS queue_forecasts (
+            queue_type_id INTEGER NOT NULL,
+            doctor_id INTEGER,
+            waiting INTEGER NOT NULL,
+            in_service INTEGER NOT NULL,
+            servers INTEGER NOT NULL,
+            load_minutes REAL NOT NULL,
+            next_wait_minutes REAL NOT NULL,
+            expected_transfers_in REAL NOT NULL,
+            projected_wait_minutes REAL NOT NULL,
+            horizon_minutes REAL NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (queue_type_id) REFERENCES queue_types(id),
+            FOREIGN KEY (doctor_id) REFERENCES doctors(id)
+        );
+        
         CREATE TABLE IF NOT EXISTS external_factors (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             date TEXT NOT NULL,
@@ -825,18 +842,21 @@ export const removeFromQueue = async (queueId: number) => {
 };
 
 export const getAllQueuesStatus = async () => {
-    const queueTypes = await getQueueTypes();
-    const result: any[] = [];
-    
-    for (const qt of queueTypes) {
-        const count = await query('SELECT COUNT(*) as count FROM queue WHERE queue_type_id = ?', [qt.id]);
-        result.push({
-            ...qt,
-            patientCount: count[0].count
-        });
-    }
-    
-    return result;
+    // One query for every queue type, with the forecasts ml/scripts/queue_forecast.py keeps current
+    return await query(
+        `SELECT qt.*,
+                (SELECT COUNT(*) FROM queue q WHERE q.queue_type_id = qt.id) as patientCount,
+                COALESCE(SUM(qf.waiting), 0) as waitingCount,
+                MAX(qf.next_wait_minutes) as nextWaitMinutes,
+                MAX(qf.projected_wait_minutes) as projectedWaitMinutes,
+                COALESCE(SUM(qf.expected_transfers_in), 0) as expectedTransfersIn,
+                MAX(qf.updated_at) as forecastUpdatedAt
+         FROM queue_types qt
+         LEFT JOIN queue_forecasts qf ON qf.queue_type_id = qt.id
+         WHERE qt.is_active = 1
+         GROUP BY qt.id
+         ORDER BY qt.id`
+    );
 };
 
 export const getDoctorsBySpecialty = async (specialty?: string) => {
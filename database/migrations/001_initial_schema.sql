@@ -103,6 +103,23 @@ CREATE TABLE IF NOT EXISTS queue (
     FOREIGN KEY (transferred_from) REFERENCES queue(id)
 );
 
+-- Per-queue wait forecasts, rewritten by ml/scripts/queue_forecast.py
+CREATE TABLE IF NOT EXISTS queue_forecasts (
+    queue_type_id INTEGER NOT NULL,
+    doctor_id INTEGER,
+    waiting INTEGER NOT NULL,
+    in_service INTEGER NOT NULL,
+    servers INTEGER NOT NULL,
+    load_minutes REAL NOT NULL,
+    next_wait_minutes REAL NOT NULL,
+    expected_transfers_in REAL NOT NULL,
+    projected_wait_minutes REAL NOT NULL,
+    horizon_minutes REAL NOT NULL,
+    updated_at TEXT NOT NULL,
+    FOREIGN KEY (queue_type_id) REFERENCES queue_types(id),
+    FOREIGN KEY (doctor_id) REFERENCES doctors(id)
+);
+
 CREATE TABLE IF NOT EXISTS external_factors (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     date TEXT NOT NULL,
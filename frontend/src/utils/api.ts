@@ -295,8 +295,9 @@ export const predictSlotAvailability = async (doctorId: string, slotTime: string
     return response.data;
 };
 
+// Waits precomputed by the forecast job; reading them never runs a model
 export const getQueueWithPredictions = async (doctorId: string) => {
-    const response = await api.get(`/queue/${doctorId}/predictions`);
+    const response = await api.get(`/queue/${doctorId}/waits`);
     return response.data;
 };
 
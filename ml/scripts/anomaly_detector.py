@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Streaming anomaly detection over consultation times and wait predictions.
+
+Each run folds in only what is new since the previous one:
+
+- appointments completed since the last run (same high-water mark as
+  retrain_model.py, see appointment_feed): a consultation far outside its
+  doctor's usual range is recorded in the anomalies table;
+- queue rows that started their consultation since the last run: the
+  observed wait (check-in to consultation start) minus the first
+  queue.estimated_wait seen for the row. When a doctor's recent errors
+  lean one way, predictions have drifted for that doctor and day.
+
+Both use a robust EWMA per doctor: an exponentially weighted level and
+mean absolute deviation, updated with residuals clipped at HUBER_K
+deviations so single outliers do not drag the baseline. Each doctor's
+state is three numbers, and rows waiting for their consultation are the
+only other thing kept, so memory does not grow with the history.
+
+When predictions drift hospital-wide, or for a large share of doctors,
+the run writes RETRAIN_SIGNAL_PATH; `retrain_model.py --if-signalled` only
+retrains when it is there.
+"""
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from appointment_feed import fetch_new_appointments, parse_time
+from atomic_file import atomic_open
+from queue_stages import FINISHED_STAGES, IN_SERVICE_STAGE
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models')
+STATE_PATH = os.path.join(MODELS_DIR, 'anomaly_state.json')
+RETRAIN_SIGNAL_PATH = os.path.join(MODELS_DIR, 'retrain_signal.json')
+
+# Weight of the newest value in the level and deviation
+EWM_ALPHA = 0.05
+
+# Residuals are clipped at this many deviations before they update the state
+HUBER_K = 3.0
+
+# Mean absolute deviation to standard deviation, for normally distributed values
+MAD_TO_STD = math.sqrt(math.pi / 2)
+
+# Observations before a doctor's state is trusted
+MIN_OBSERVATIONS = 20
+
+# |z| of an anomalous consultation time, and of a high severity one
+OUTLIER_Z = 4.0
+HIGH_SEVERITY_Z = 6.0
+
+# A mean prediction error beyond DRIFT_Z standard deviations and DRIFT_MINUTES is drift
+DRIFT_Z = 0.75
+DRIFT_MINUTES = 5.0
+
+# Share of tracked doctors drifting at once that warrants a retrain
+RETRAIN_DRIFTING_SHARE = 0.5
+
+
+class RobustEWMA:
+    """Exponentially weighted level and deviation with Huber-clipped updates; O(1) state."""
+
+    def __init__(self, state=None):
+        self.count, self.level, self.deviation = state or (0, 0.0, 0.0)
+
+    @property
+    def std(self):
+        return self.deviation * MAD_TO_STD
+
+    @property
+    def warm(self):
+        return self.count >= MIN_OBSERVATIONS
+
+    def update(self, x):
+        """Fold in `x`; returns its z-score against the state before the update (0 while warming up)."""
+        self.count += 1
+        if self.count == 1:
+            self.level = x
+            return 0.0
+        residual = x - self.level
+        z = residual / self.std if self.std > 0 else 0.0
+        if self.count <= MIN_OBSERVATIONS:
+            # Warm-up: plain running mean and mean absolute deviation
+            weight = 1 / self.count
+            clipped = residual
+        else:
+            weight = EWM_ALPHA
+            bound = HUBER_K * self.std
+            clipped = min(max(residual, -bound), bound)
+        self.level += weight * clipped
+        self.deviation += weight * (abs(clipped) - self.deviation)
+        return z if self.count > MIN_OBSERVATIONS else 0.0
+
+    def to_list(self):
+        return [self.count, round(self.level, 4), round(self.deviation, 4)]
+
+
+class DetectorState:
+    """Per-doctor statistics, rows awaiting their consultation and the ingestion high-water mark."""
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        data = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+        self.last_appointment_id = data.get('last_appointment_id', 0)
+        # Only ids above the high-water mark; fetch_new_appointments drops the rest as the mark
+        # advances, and an open appointment holds it back for at most MAX_OPEN_AGE
+        self.processed_ids = set(data.get('processed_ids', []))
+        # doctor_id -> consultation minutes; doctor_id (and 'all') -> observed minus predicted wait
+        self.durations = {key: RobustEWMA(value) for key, value in data.get('durations', {}).items()}
+        self.wait_errors = {key: RobustEWMA(value) for key, value in data.get('wait_errors', {}).items()}
+        # queue id -> [doctor_id, first estimated_wait, check-in time]
+        self.pending = data.get('pending', {})
+        # "kind|doctor_id|YYYY-MM-DD" already reported
+        self.reported = set(data.get('reported', []))
+        # Whether this detector's retrain signal is still out
+        self.signalled = data.get('signalled', False)
+
+    def save(self):
+        data = {
+            'last_appointment_id': self.last_appointment_id,
+            'processed_ids': sorted(self.processed_ids),
+            'durations': {key: stats.to_list() for key, stats in self.durations.items()},
+            'wait_errors': {key: stats.to_list() for key, stats in self.wait_errors.items()},
+            'pending': self.pending,
+            'reported': sorted(self.reported),
+            'signalled': self.signalled,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with atomic_open(self.path) as f:
+            json.dump(data, f)
+
+    def report_once(self, kind, doctor_id, now):
+        """True the first time `kind` is reported for this doctor on now's day."""
+        key = f'{kind}|{doctor_id}|{now:%Y-%m-%d}'
+        if key in self.reported:
+            return False
+        # Keys from before yesterday can no longer come up
+        cutoff = f'{now - timedelta(days=1):%Y-%m-%d}'
+        self.reported = {old for old in self.reported if old.rsplit('|', 1)[1] >= cutoff}
+        self.reported.add(key)
+        return True
+
+
+def drift(stats):
+    """Mean prediction error in minutes when it counts as drift, else None."""
+    if not stats.warm or abs(stats.level) < DRIFT_MINUTES or abs(stats.level) < DRIFT_Z * stats.std:
+        return None
+    return stats.level
+
+
+def check_durations(conn, state, now):
+    """Anomalies among appointments completed since the last run."""
+    anomalies = []
+    for appointment_id, doctor_id, appointment_time, duration in fetch_new_appointments(conn, state, now):
+        stats = state.durations.setdefault(str(doctor_id), RobustEWMA())
+        expected, spread = stats.level, stats.std
+        z = stats.update(float(duration))
+        if abs(z) >= OUTLIER_Z:
+            when = parse_time(appointment_time)
+            anomalies.append((doctor_id, when.strftime('%Y-%m-%d %H:%M:%S'),
+                              f"Consultation took {duration:.0f} min, usually {expected:.0f} ± {spread:.0f} min (appointment {appointment_id})",
+                              'high' if abs(z) >= HIGH_SEVERITY_Z else 'medium'))
+    return anomalies
+
+
+def check_waits(conn, state, now):
+    """Observed against predicted waits for rows whose consultation started since the last run."""
+    anomalies = []
+    live = set()
+    for row_id, doctor_id, stage, estimated_wait, checked_in, stage_start in conn.execute(
+            "SELECT id, doctor_id, COALESCE(stage, 'waiting'), estimated_wait, COALESCE(check_in_time, created_at), stage_start_time "
+            "FROM queue WHERE doctor_id IS NOT NULL"):
+        key = str(row_id)
+        live.add(key)
+        started = stage == IN_SERVICE_STAGE or stage in FINISHED_STAGES
+        if key not in state.pending:
+            # The first estimate is what the patient was told; later ones converge on the truth
+            if not started and estimated_wait is not None and checked_in:
+                state.pending[key] = [doctor_id, estimated_wait, checked_in]
+            continue
+        if not started:
+            continue
+        _, predicted, checked_in = state.pending.pop(key)
+        if not stage_start:
+            continue
+        observed = (parse_time(stage_start) - parse_time(checked_in)).total_seconds() / 60
+        for stats_key in (str(doctor_id), 'all'):
+            state.wait_errors.setdefault(stats_key, RobustEWMA()).update(observed - predicted)
+    # Rows removed or transferred before their consultation never give an observed wait
+    state.pending = {key: value for key, value in state.pending.items() if key in live}
+
+    for doctor_id, stats in state.wait_errors.items():
+        error = drift(stats)
+        if doctor_id != 'all' and error is not None and state.report_once('wait_drift', doctor_id, now):
+            direction = 'longer' if error > 0 else 'shorter'
+            anomalies.append((int(doctor_id), now.strftime('%Y-%m-%d %H:%M:%S'),
+                              f"Waits run {abs(error):.0f} min {direction} than predicted over the last ~{1 / EWM_ALPHA:.0f} patients",
+                              'high' if abs(error) >= 2 * DRIFT_MINUTES and abs(error) >= 2 * DRIFT_Z * stats.std else 'medium'))
+    return anomalies
+
+
+def retrain_reasons(state):
+    reasons = []
+    overall = state.wait_errors.get('all')
+    if overall is not None and drift(overall) is not None:
+        reasons.append(f"predictions are off by {overall.level:+.1f} min on average across all doctors")
+    doctors = {key: stats for key, stats in state.wait_errors.items() if key != 'all' and stats.warm}
+    drifting = sorted(key for key, stats in doctors.items() if drift(stats) is not None)
+    if doctors and len(drifting) / len(doctors) >= RETRAIN_DRIFTING_SHARE:
+        reasons.append(f"{len(drifting)} of {len(doctors)} doctors drifting: {', '.join(drifting)}")
+    return reasons
+
+
+def run(db_path, state, signal_path=RETRAIN_SIGNAL_PATH, now=None):
+    """One incremental pass; returns (anomalies recorded, retrain reasons)."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    if state.signalled and not os.path.exists(signal_path):
+        # A retrain consumed the signal: judge the new models on their own errors
+        state.wait_errors = {}
+        state.signalled = False
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        anomalies = check_durations(conn, state, now) + check_waits(conn, state, now)
+        with conn:
+            conn.executemany("INSERT INTO anomalies (doctor_id, date, description, severity) VALUES (?, ?, ?, ?)", anomalies)
+    finally:
+        conn.close()
+    reasons = retrain_reasons(state)
+    if reasons:
+        with atomic_open(signal_path) as f:
+            json.dump({'raised_at': now.isoformat(timespec='seconds'), 'reasons': reasons}, f)
+        state.signalled = True
+    # Saved after the inserts, so a failed run is redone rather than skipped
+    state.save()
+    return anomalies, reasons
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Flag unusual consultation times and drifting wait predictions')
+    parser.add_argument('--db', default=os.environ.get('DB_PATH', '../../database/queue.db'))
+    parser.add_argument('--state', default=STATE_PATH)
+    parser.add_argument('--signal', default=RETRAIN_SIGNAL_PATH, help='Written when a retrain is warranted')
+    parser.add_argument('--rebuild', action='store_true', help='Discard the stored state and replay the whole history')
+    args = parser.parse_args()
+
+    state = DetectorState(None if args.rebuild else args.state)
+    state.path = args.state
+    anomalies, reasons = run(args.db, state, args.signal)
+
+    print(f"Recorded {len(anomalies)} anomalies; tracking {len(state.durations)} doctors, {len(state.pending)} waits pending.")
+    for reason in reasons:
+        print(f"Retrain warranted: {reason}")
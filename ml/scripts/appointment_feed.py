@@ -0,0 +1,50 @@
+"""
+Incremental reads of completed appointments.
+
+Appointments complete out of id order, so a plain "id > last seen" cursor
+would skip rows that finish after a later one. Consumers keep a high-water
+mark that never moves past an appointment that may still complete, plus the
+ids above it they have already consumed. Any object with
+`last_appointment_id` and `processed_ids` attributes can carry that state.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+# Statuses after which an appointment will never get an actual_duration
+CLOSED_STATUSES = ('completed', 'cancelled', 'no_show')
+
+# Open appointments older than this stop holding back the high-water mark
+MAX_OPEN_AGE = timedelta(days=2)
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+
+
+def fetch_new_appointments(conn, state, now=None):
+    """Completed appointments not yet consumed, as (id, doctor_id, appointment_time, actual_duration) rows.
+
+    Advances `state.last_appointment_id` and trims `state.processed_ids`.
+    """
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = conn.execute(
+        "SELECT id, doctor_id, appointment_time, actual_duration, status FROM appointments WHERE id > ? ORDER BY id",
+        (state.last_appointment_id,))
+
+    new_rows = []
+    first_open_id = None
+    max_id = state.last_appointment_id
+    for row_id, doctor_id, appointment_time, actual_duration, status in rows:
+        max_id = row_id
+        if actual_duration is not None:
+            if row_id not in state.processed_ids:
+                new_rows.append((row_id, doctor_id, appointment_time, actual_duration))
+            continue
+        still_open = status not in CLOSED_STATUSES and now - parse_time(appointment_time) < MAX_OPEN_AGE
+        if still_open and first_open_id is None:
+            first_open_id = row_id
+
+    state.last_appointment_id = first_open_id - 1 if first_open_id is not None else max_id
+    seen = state.processed_ids | {row[0] for row in new_rows}
+    state.processed_ids = {row_id for row_id in seen if row_id > state.last_appointment_id}
+    return new_rows
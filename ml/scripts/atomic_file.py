@@ -0,0 +1,36 @@
+"""
+Whole-file replacement for state and snapshot files read by other processes.
+
+    with atomic_open(path) as f:
+        json.dump(data, f)
+
+Readers see the old file or the new one, never a partial write. The data
+goes to a uniquely named temporary file next to `path` first, so concurrent
+writers (e.g. one duration_stats refresh per saved consultation) never
+write into each other's temporary file; the last one to finish wins.
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_open(path, mode='w'):
+    """A file object whose contents replace `path` when the block exits without an exception."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file private to its owner; the files it replaces were world-readable
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Offline backtest of every wait time predictor against the history.
+
+- forest:    ml/scripts/predict.py (compiled bundle or sklearn pickles)
+- heuristic: backend/src/services/ml_predictions.py
+- fallback:  BookingController.getFallbackPrediction (predict.fallback_prediction)
+
+Completed appointments are streamed in time order in chunks; only the
+current chunk and each doctor's current day are ever in memory. The
+observed wait of an appointment is its feedback.actual_wait when a patient
+reported one. Otherwise it is replayed from the doctor's day: each
+consultation starts when both the patient (check-in, else slot time) and
+the doctor (end of the previous consultation) are ready. The same replay
+gives the queue length each patient found, which is what the predictors
+are asked with, shaped as the booking controller shapes its requests.
+Hospital occupancy and traffic come from the external factor snapshots
+when there are any.
+
+Each predictor runs in its own child process, so peak RSS is its own, and
+predicts every chunk in one batch. Reported per predictor: MAE, RMSE and
+bias, the coverage of its interval, the Brier score and a reliability
+table of its P(wait > threshold), batch latency, rows per second and peak
+RSS.
+"""
+
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from benchmark import HEURISTIC_DIR, percentiles
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PREDICTORS = ('forest', 'heuristic', 'fallback')
+
+HISTORY_QUERY = """
+    SELECT a.id, a.doctor_id, a.appointment_time, a.check_in_time, a.actual_duration,
+           f.actual_wait, d.specialty, COALESCE(d.experience_years, 0)
+    FROM appointments a
+    JOIN doctors d ON d.id = a.doctor_id
+    LEFT JOIN (
+        SELECT appointment_id, AVG(actual_wait) as actual_wait
+        FROM feedback
+        WHERE actual_wait IS NOT NULL
+        GROUP BY appointment_id
+    ) f ON f.appointment_id = a.id
+    WHERE a.actual_duration IS NOT NULL AND a.appointment_time >= ? AND a.appointment_time < ?
+    ORDER BY a.appointment_time, a.id
+    """
+
+# What the booking controller sends when it has nothing better (see checkSlotAndPredict)
+DEFAULT_FACTORS = {'hospital_occupancy': 0.5, 'traffic_level': 0.5}
+DEFAULT_PATIENT_AGE = 40
+DEFAULT_STAFF_AT_STAGE = 2
+STAGE_SHARE = 0.6
+
+# z of a central 90% interval, for predictors that give a mean and variance
+Z_90 = 1.6449
+CALIBRATION_BINS = 10
+
+
+def parse_time(value):
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class DayReplay:
+    """One doctor's day, served in arrival order by a single doctor."""
+
+    def __init__(self, day):
+        self.day = day
+        self.free_at = None
+        # End times of earlier patients' consultations, ascending
+        self.ends = deque()
+
+    def admit(self, arrival, duration):
+        """(patients ahead on arrival, replayed wait in minutes) of the next patient."""
+        while self.ends and self.ends[0] <= arrival:
+            self.ends.popleft()
+        ahead = len(self.ends)
+        start = arrival if self.free_at is None or self.free_at <= arrival else self.free_at
+        self.free_at = start + timedelta(minutes=duration)
+        self.ends.append(self.free_at)
+        return ahead, (start - arrival).total_seconds() / 60
+
+
+def stream_history(db_path, start, end, chunksize):
+    """Chunks of replayed appointments, each a dict of equal-length columns, in time order."""
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(HISTORY_QUERY, (start, end))
+        days = {}
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            chunk = {name: [] for name in ('id', 'doctor_id', 'slot_time', 'queue_length', 'specialty',
+                                           'doctor_experience', 'observed_wait', 'reported')}
+            for appointment_id, doctor_id, appointment_time, check_in_time, duration, reported_wait, specialty, experience in rows:
+                slot = parse_time(appointment_time)
+                arrival = parse_time(check_in_time) if check_in_time else slot
+                replay = days.get(doctor_id)
+                if replay is None or replay.day != slot.date():
+                    replay = days[doctor_id] = DayReplay(slot.date())
+                ahead, replayed_wait = replay.admit(arrival, float(duration))
+                chunk['id'].append(appointment_id)
+                chunk['doctor_id'].append(doctor_id)
+                chunk['slot_time'].append(slot)
+                chunk['queue_length'].append(ahead)
+                chunk['specialty'].append(specialty or 'General')
+                chunk['doctor_experience'].append(experience)
+                chunk['observed_wait'].append(replayed_wait if reported_wait is None else float(reported_wait))
+                chunk['reported'].append(reported_wait is not None)
+            yield chunk
+    finally:
+        conn.close()
+
+
+def with_external_factors(chunk):
+    """Occupancy and traffic as of each slot time from the ingested snapshots, else the booking defaults."""
+    from external_factors import factors_at, load_snapshots
+    times = chunk['slot_time']
+    joined = factors_at(np.array(times, dtype='datetime64[s]'), load_snapshots(min(times), max(times)))
+    for name, default in DEFAULT_FACTORS.items():
+        chunk[name] = np.where(np.isnan(joined[name]), default, joined[name])
+    return chunk
+
+
+def booking_requests(chunk):
+    """predict.py requests, built from the replay the way checkSlotAndPredict builds them."""
+    queue_length = np.asarray(chunk['queue_length'])
+    return {
+        'total_queue_length': queue_length,
+        'patients_at_current_stage': np.floor(queue_length * STAGE_SHARE).astype(int),
+        'staff_at_current_stage': np.full(len(queue_length), DEFAULT_STAFF_AT_STAGE),
+        'hospital_occupancy': chunk['hospital_occupancy'],
+        'patient_age': np.full(len(queue_length), DEFAULT_PATIENT_AGE),
+        'traffic_level': chunk['traffic_level'],
+        'doctor_experience': np.asarray(chunk['doctor_experience']),
+        'slot_time': [slot.isoformat() + 'Z' for slot in chunk['slot_time']],
+    }
+
+
+def _forest(threshold):
+    import pandas as pd
+    import predict
+    predictor = predict.load_predictor()
+
+    def run(chunk):
+        result = predict.predict_batch_frame(predictor, pd.DataFrame(booking_requests(chunk)), (threshold,))
+        if 'p5' in result:
+            low, high = result['p5'].to_numpy(), result['p95'].to_numpy()
+        else:
+            std = np.sqrt(result['variance'].to_numpy())
+            low, high = result['mean'].to_numpy() - Z_90 * std, result['mean'].to_numpy() + Z_90 * std
+        return result['mean'].to_numpy(), low, high, result[f'tail_risk_{threshold:g}'].to_numpy()
+
+    return type(predictor).__name__, 0.9, run
+
+
+def _heuristic(threshold):
+    sys.path.insert(0, HEURISTIC_DIR)
+    import ml_predictions
+    predictor = ml_predictions.WaitTimePredictor()
+
+    def run(chunk):
+        entries = [{'queue_length': q, 'specialty': specialty, 'appointment_time': slot.isoformat() + 'Z', 'doctor_id': doctor_id}
+                   for q, specialty, slot, doctor_id in zip(chunk['queue_length'], chunk['specialty'], chunk['slot_time'], chunk['doctor_id'])]
+        results = predictor.predict_many(entries)
+        mean = np.array([r['predicted_wait_minutes'] for r in results], dtype=float)
+        low = np.array([r['min_wait_minutes'] for r in results], dtype=float)
+        high = np.array([r['max_wait_minutes'] for r in results], dtype=float)
+        # No tail risk and no stated interval level
+        return mean, low, high, None
+
+    return type(predictor).__name__, None, run
+
+
+def _fallback(threshold):
+    import predict
+
+    def run(chunk):
+        results = [predict.fallback_prediction(q) for q in chunk['queue_length']]
+        mean = np.array([r['mean'] for r in results], dtype=float)
+        std = np.sqrt([r['variance'] for r in results])
+        # getFallbackPrediction's tail_risk is fixed at a 30 minute threshold
+        tail_risk = np.array([r['tail_risk'] for r in results], dtype=float) if threshold == 30 else None
+        return mean, mean - Z_90 * std, mean + Z_90 * std, tail_risk
+
+    return 'getFallbackPrediction', 0.9, run
+
+
+class Scorecard:
+    """Running accuracy sums, so a history of any length is scored in one pass."""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.n = 0
+        self.reported = 0
+        self.abs_error = 0.0
+        self.sq_error = 0.0
+        self.error = 0.0
+        self.covered = 0
+        self.width = 0.0
+        self.brier = 0.0
+        self.bin_count = np.zeros(CALIBRATION_BINS, dtype=np.int64)
+        self.bin_predicted = np.zeros(CALIBRATION_BINS)
+        self.bin_observed = np.zeros(CALIBRATION_BINS)
+
+    def add(self, observed, reported, mean, low, high, tail_risk):
+        error = mean - observed
+        self.n += len(observed)
+        self.reported += int(np.sum(reported))
+        self.abs_error += float(np.abs(error).sum())
+        self.sq_error += float((error ** 2).sum())
+        self.error += float(error.sum())
+        self.covered += int(((observed >= low) & (observed <= high)).sum())
+        self.width += float((high - low).sum())
+        if tail_risk is not None:
+            exceeded = observed > self.threshold
+            self.brier += float(((tail_risk - exceeded) ** 2).sum())
+            bins = np.minimum((tail_risk * CALIBRATION_BINS).astype(int), CALIBRATION_BINS - 1)
+            self.bin_count += np.bincount(bins, minlength=CALIBRATION_BINS)
+            self.bin_predicted += np.bincount(bins, weights=tail_risk, minlength=CALIBRATION_BINS)
+            self.bin_observed += np.bincount(bins, weights=exceeded, minlength=CALIBRATION_BINS)
+
+    def summary(self, nominal_coverage):
+        if not self.n:
+            return {'rows': 0}
+        result = {
+            'rows': self.n,
+            'rows_with_reported_wait': self.reported,
+            'mae': self.abs_error / self.n,
+            'rmse': (self.sq_error / self.n) ** 0.5,
+            'bias': self.error / self.n,
+            'interval': {'nominal_coverage': nominal_coverage, 'coverage': self.covered / self.n,
+                         'mean_width': self.width / self.n},
+            'tail_risk': None,
+        }
+        if self.bin_count.sum():
+            filled = self.bin_count > 0
+            predicted = self.bin_predicted[filled] / self.bin_count[filled]
+            observed = self.bin_observed[filled] / self.bin_count[filled]
+            result['tail_risk'] = {
+                'threshold': self.threshold,
+                'brier': self.brier / self.n,
+                'mean_predicted': float(self.bin_predicted.sum() / self.n),
+                'observed_rate': float(self.bin_observed.sum() / self.n),
+                # Expected calibration error: bin gaps weighted by bin size
+                'ece': float(np.sum(np.abs(predicted - observed) * self.bin_count[filled]) / self.n),
+                'reliability': [
+                    {'bin': f'{i / CALIBRATION_BINS:.1f}-{(i + 1) / CALIBRATION_BINS:.1f}', 'count': int(count),
+                     'predicted': float(p), 'observed': float(o)}
+                    for i, count, p, o in zip(np.flatnonzero(filled), self.bin_count[filled], predicted, observed)
+                ],
+            }
+        return result
+
+
+def run_in_process(name, args):
+    """Backtest one predictor inside this process (called in a child process)."""
+    start = time.perf_counter()
+    implementation, nominal_coverage, predict_chunk = {'forest': _forest, 'heuristic': _heuristic, 'fallback': _fallback}[name](args.threshold)
+    load_seconds = time.perf_counter() - start
+
+    scorecard = Scorecard(args.threshold)
+    batch_seconds = []
+    replay_seconds = 0.0
+    history = stream_history(args.db, args.start, args.end, args.chunksize)
+    while True:
+        started = time.perf_counter()
+        chunk = next(history, None)
+        if chunk is None:
+            break
+        with_external_factors(chunk)
+        replay_seconds += time.perf_counter() - started
+
+        started = time.perf_counter()
+        mean, low, high, tail_risk = predict_chunk(chunk)
+        batch_seconds.append(time.perf_counter() - started)
+        scorecard.add(np.asarray(chunk['observed_wait']), chunk['reported'], mean, low, high, tail_risk)
+
+    result = scorecard.summary(nominal_coverage)
+    predict_seconds = sum(batch_seconds)
+    result.update({
+        'implementation': implementation,
+        'model_load_ms': load_seconds * 1000,
+        'replay_seconds': replay_seconds,
+        'predict_seconds': predict_seconds,
+        'rows_per_second': scorecard.n / predict_seconds if predict_seconds else None,
+        'us_per_row': predict_seconds / scorecard.n * 1e6 if scorecard.n else None,
+        'batch': {'chunksize': args.chunksize, 'batches': len(batch_seconds), **(percentiles(batch_seconds) if batch_seconds else {})},
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+    return result
+
+
+def backtest(name, args):
+    worker = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', name, '--db', args.db, '--start', args.start,
+         '--end', args.end, '--chunksize', str(args.chunksize), '--threshold', str(args.threshold)],
+        cwd=SCRIPT_DIR, check=True, capture_output=True, text=True)
+    return json.loads(worker.stdout)
+
+
+def print_table(predictors, stream=sys.stderr):
+    """Predictors from most to least accurate, with what each microsecond of prediction buys."""
+    print(f"{'predictor':<10} {'rows':>8} {'MAE':>7} {'bias':>7} {'coverage':>9} {'brier':>7} {'us/row':>8} {'RSS MB':>7}", file=stream)
+    ranked = sorted(predictors.items(), key=lambda item: item[1].get('mae', float('inf')))
+    for name, result in ranked:
+        if not result.get('rows'):
+            print(f"{name:<10} {0:>8}", file=stream)
+            continue
+        tail_risk = result['tail_risk']
+        print(f"{name:<10} {result['rows']:>8} {result['mae']:>7.2f} {result['bias']:>+7.2f} "
+              f"{result['interval']['coverage']:>9.3f} {tail_risk['brier'] if tail_risk else float('nan'):>7.3f} "
+              f"{result['us_per_row']:>8.1f} {result['peak_rss_mb']:>7.0f}", file=stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest wait time predictors against the appointments history')
+    parser.add_argument('--db', default=os.environ.get('DB_PATH', '../../database/queue.db'))
+    parser.add_argument('--predictors', nargs='+', choices=PREDICTORS, default=list(PREDICTORS))
+    parser.add_argument('--start', default='0000', help='First appointment_time to replay (ISO 8601 prefix)')
+    parser.add_argument('--end', default='9999', help='Replay appointments before this appointment_time')
+    parser.add_argument('--chunksize', type=int, default=10_000, help='Appointments replayed and predicted per batch')
+    parser.add_argument('--threshold', type=float, default=30, help='Minutes of the tail risk being scored')
+    parser.add_argument('--output', default='-', help="JSON result path ('-' for stdout)")
+    parser.add_argument('--worker', choices=PREDICTORS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_in_process(args.worker, args)))
+        return
+
+    result = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'db': os.path.abspath(args.db),
+        'range': [args.start, args.end],
+        'predictors': {name: backtest(name, args) for name in args.predictors},
+    }
+    print_table(result['predictors'])
+
+    output = json.dumps(result, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
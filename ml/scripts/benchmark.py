@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Inference latency benchmark for both wait time predictors.
+
+- forest:    ml/scripts/predict.py (compiled bundle or sklearn pickles)
+- heuristic: backend/src/services/ml_predictions.py
+
+For each predictor this reports CLI cold-start time, import time, model
+load time, p50/p95/p99 latency of single and batched calls, throughput per
+batch size and per thread count, and peak RSS. Every predictor runs in its
+own child process so RSS and import costs are not shared between them.
+Results are written as JSON; --compare flags regressions against an older
+result file.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HEURISTIC_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'backend', 'src', 'services')
+PREDICTORS = ('forest', 'heuristic')
+
+CLI_ARGS = {
+    'forest': [os.path.join(SCRIPT_DIR, 'predict.py'), '8', '5', '2', '0.5', '40', '3', '10', '2026-01-17T14:00:00Z'],
+    'heuristic': [os.path.join(HEURISTIC_DIR, 'ml_predictions.py'), 'predict_wait', '8', 'General', '2026-01-17T14:00:00Z', '15'],
+}
+IMPORT_STATEMENTS = {
+    'forest': f"import sys; sys.path.insert(0, {SCRIPT_DIR!r}); import predict",
+    'heuristic': f"import sys; sys.path.insert(0, {HEURISTIC_DIR!r}); import ml_predictions",
+}
+
+def percentiles(samples_seconds):
+    ms = np.asarray(samples_seconds) * 1000
+    return {
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'mean_ms': float(ms.mean()),
+    }
+
+def time_calls(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def random_requests(n, seed=0):
+    rng = np.random.default_rng(seed)
+    hours = rng.integers(8, 18, n)
+    minutes = rng.choice([0, 15, 30, 45], n)
+    days = rng.integers(10, 29, n)
+    return [{
+        'total_queue_length': int(rng.integers(0, 16)),
+        'patients_at_current_stage': int(rng.integers(0, 8)),
+        'staff_at_current_stage': int(rng.integers(1, 6)),
+        'hospital_occupancy': float(rng.uniform(0.3, 0.9)),
+        'patient_age': int(rng.integers(18, 81)),
+        'traffic_level': int(rng.integers(0, 11)),
+        'doctor_experience': int(rng.integers(1, 31)),
+        'slot_time': f'2026-01-{days[i]:02d}T{hours[i]:02d}:{minutes[i]:02d}:00Z',
+    } for i in range(n)]
+
+def _forest_calls():
+    import pandas as pd
+    import predict
+
+    start = time.perf_counter()
+    predictor = predict.load_predictor()
+    load_seconds = time.perf_counter() - start
+
+    def single(request):
+        return predict.predict_request(predictor, request)
+
+    def batch(requests):
+        return predict.predict_batch_frame(predictor, pd.DataFrame(requests))
+
+    return load_seconds, type(predictor).__name__, single, batch
+
+def _heuristic_calls():
+    sys.path.insert(0, HEURISTIC_DIR)
+    import ml_predictions
+
+    start = time.perf_counter()
+    predictor = ml_predictions.WaitTimePredictor()
+    load_seconds = time.perf_counter() - start
+
+    def to_entry(request):
+        return {'queue_length': request['total_queue_length'], 'specialty': 'General',
+                'appointment_time': request['slot_time'], 'doctor_avg_time': 15}
+
+    def single(request):
+        entry = to_entry(request)
+        return predictor.predict(entry['queue_length'], entry['specialty'], entry['appointment_time'], entry['doctor_avg_time'])
+
+    def batch(requests):
+        return predictor.predict_many([to_entry(request) for request in requests])
+
+    return load_seconds, type(predictor).__name__, single, batch
+
+def run_in_process(name, repeats, batch_sizes, concurrency):
+    """Benchmark one predictor inside this process (called in a child process)."""
+    load_seconds, implementation, single, batch = (_forest_calls if name == 'forest' else _heuristic_calls)()
+    requests = random_requests(max(repeats, max(batch_sizes)))
+
+    single(requests[0])  # warm up lazy imports
+    index = iter(range(10**9))
+    single_samples = time_calls(lambda: single(requests[next(index) % len(requests)]), repeats)
+
+    batched = []
+    for size in batch_sizes:
+        rows = requests[:size]
+        batch(rows)
+        samples = time_calls(lambda: batch(rows), max(3, repeats // max(1, size // 10)))
+        stats = percentiles(samples)
+        stats.update({'batch_size': size, 'rows_per_second': size / float(np.median(samples))})
+        batched.append(stats)
+
+    threaded = []
+    for workers in concurrency:
+        n_calls = max(repeats, workers * 20)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(single, (requests[i % len(requests)] for i in range(n_calls))))
+        elapsed = time.perf_counter() - start
+        threaded.append({'threads': workers, 'calls': n_calls, 'calls_per_second': n_calls / elapsed})
+
+    return {
+        'implementation': implementation,
+        'model_load_ms': load_seconds * 1000,
+        'single': percentiles(single_samples),
+        'batch': batched,
+        'concurrency': threaded,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def measure_cold_start(name, repeats):
+    # Point predict.py at a socket that does not exist so it never uses a running server
+    env = dict(os.environ, MEDIQUEUE_PREDICTOR_SOCKET='/nonexistent/mediqueue_benchmark.sock')
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + CLI_ARGS[name], cwd=SCRIPT_DIR, env=env, check=True, capture_output=True)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+def measure_import(name, repeats):
+    code = f"import time; start = time.perf_counter(); {IMPORT_STATEMENTS[name]}; print(time.perf_counter() - start)"
+    samples = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, '-c', code], cwd=SCRIPT_DIR, check=True, capture_output=True, text=True)
+        samples.append(float(result.stdout.strip()))
+    return percentiles(samples)
+
+def benchmark(name, args):
+    worker = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', name, '--repeats', str(args.repeats),
+         '--batch-sizes', *map(str, args.batch_sizes), '--concurrency', *map(str, args.concurrency)],
+        cwd=SCRIPT_DIR, check=True, capture_output=True, text=True)
+    result = json.loads(worker.stdout)
+    result['cold_start'] = measure_cold_start(name, args.cold_repeats)
+    result['import'] = measure_import(name, args.cold_repeats)
+    return result
+
+def compare(current, baseline, tolerance):
+    """List latency metrics that got slower than the baseline by more than `tolerance`."""
+    regressions = []
+    for name, result in current['predictors'].items():
+        previous = baseline.get('predictors', {}).get(name)
+        if not previous:
+            continue
+        checks = [(f'{name}.{section}.p95_ms', result[section]['p95_ms'], previous[section]['p95_ms'])
+                  for section in ('cold_start', 'import', 'single')]
+        checks.append((f'{name}.model_load_ms', result['model_load_ms'], previous['model_load_ms']))
+        for metric, value, old_value in checks:
+            if old_value > 0 and value > old_value * (1 + tolerance):
+                regressions.append({'metric': metric, 'baseline': old_value, 'current': value})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark wait time prediction latency and throughput')
+    parser.add_argument('--predictors', nargs='+', choices=PREDICTORS, default=list(PREDICTORS))
+    parser.add_argument('--repeats', type=int, default=200, help='Timed single-prediction calls')
+    parser.add_argument('--cold-repeats', type=int, default=5, help='Process launches for cold-start and import timing')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 10, 100, 1000])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--output', default='-', help="JSON result path ('-' for stdout)")
+    parser.add_argument('--compare', help='Earlier result JSON to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown before a metric counts as a regression')
+    parser.add_argument('--worker', choices=PREDICTORS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_in_process(args.worker, args.repeats, args.batch_sizes, args.concurrency)))
+        return
+
+    result = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'predictors': {name: benchmark(name, args) for name in args.predictors},
+    }
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            result['regressions'] = compare(result, json.load(f), args.tolerance)
+        exit_code = 1 if result['regressions'] else 0
+
+    output = json.dumps(result, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    sys.exit(exit_code)
+
+if __name__ == '__main__':
+    main()
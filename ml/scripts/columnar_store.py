@@ -0,0 +1,119 @@
+"""
+Column-per-file training data store.
+
+Each column is a .npy file with an explicit dtype, plus schema.json holding
+the column order, dtypes and row count. Writers stream query results in
+chunks straight into memory-mapped files. Readers get np.memmap views, so a
+multi-year history is paged in on demand instead of parsed into a DataFrame.
+"""
+
+import json
+import os
+
+import numpy as np
+
+SCHEMA_FILE = 'schema.json'
+
+
+def export_query(conn, query, out_dir, schema, params=(), chunksize=100_000):
+    """Stream `query` into one .npy file per column.
+
+    `schema` maps each selected column, in SELECT order, to a NumPy dtype.
+    Returns the number of rows written.
+    """
+    n_rows = conn.execute(f"SELECT COUNT(*) FROM ({query})", params).fetchone()[0]
+    columns = open_columns(out_dir, schema, n_rows)
+
+    cursor = conn.execute(query, params)
+    offset = 0
+    while offset < n_rows:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            break
+        rows = rows[:n_rows - offset]
+        chunk = list(zip(*rows))
+        for i, (name, column) in enumerate(columns.items()):
+            column[offset:offset + len(rows)] = np.asarray(chunk[i], dtype=float if column.dtype.kind == 'f' else None)
+        offset += len(rows)
+
+    for column in columns.values():
+        column.flush()
+    write_schema(out_dir, schema, offset)
+    return offset
+
+
+def open_columns(out_dir, schema, n_rows):
+    """Create writable memory-mapped .npy files of `n_rows` for every column in `schema`."""
+    os.makedirs(out_dir, exist_ok=True)
+    return {
+        name: np.lib.format.open_memmap(
+            os.path.join(out_dir, f'{name}.npy'), mode='w+', dtype=np.dtype(dtype), shape=(n_rows,))
+        for name, dtype in schema.items()
+    }
+
+
+def write_schema(out_dir, schema, n_rows):
+    with open(os.path.join(out_dir, SCHEMA_FILE), 'w') as f:
+        json.dump({
+            'columns': list(schema),
+            'dtypes': {name: np.dtype(dtype).str for name, dtype in schema.items()},
+            'n_rows': n_rows,
+        }, f, indent=2)
+
+
+def read_schema(data_dir):
+    with open(os.path.join(data_dir, SCHEMA_FILE)) as f:
+        return json.load(f)
+
+
+def load_columns(data_dir, columns=None):
+    """Memory-map the requested columns (all by default) without reading them."""
+    schema = read_schema(data_dir)
+    arrays = {}
+    for name in columns or schema['columns']:
+        array = np.load(os.path.join(data_dir, f'{name}.npy'), mmap_mode='r')
+        # A crashed export can leave files longer than the rows it wrote
+        arrays[name] = array[:schema['n_rows']]
+    return arrays
+
+
+def rolling_std_by_group(groups, values, window, fill_value=1.0):
+    """Trailing rolling std (ddof=1) of `values` within each group, in input order.
+
+    Equivalent to pandas' groupby(...).rolling(window).std() realigned to the
+    original rows, computed from cumulative sums instead of a DataFrame.
+    """
+    n = len(values)
+    result = np.full(n, fill_value, dtype=np.float64)
+    if n == 0:
+        return result
+
+    order = np.argsort(groups, kind='stable')
+    sorted_groups = np.asarray(groups)[order]
+    sorted_values = np.asarray(values, dtype=np.float64)[order]
+
+    # Position where each row's group starts in sorted order
+    is_start = np.empty(n, dtype=bool)
+    is_start[0] = True
+    is_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    group_start = np.maximum.accumulate(np.where(is_start, np.arange(n), 0))
+
+    # Centering each group on its own mean keeps the cumulative sums well conditioned
+    starts = np.flatnonzero(is_start)
+    sizes = np.diff(np.append(starts, n))
+    sorted_values = sorted_values - np.repeat(np.add.reduceat(sorted_values, starts) / sizes, sizes)
+    cumsum = np.concatenate([[0.0], np.cumsum(sorted_values)])
+    cumsum_sq = np.concatenate([[0.0], np.cumsum(sorted_values ** 2)])
+
+    end = np.arange(n) + 1
+    start = end - window
+    valid = start >= group_start
+    start = np.where(valid, start, 0)
+
+    total = cumsum[end] - cumsum[start]
+    total_sq = cumsum_sq[end] - cumsum_sq[start]
+    variance = np.maximum((total_sq - total ** 2 / window) / (window - 1), 0.0)
+
+    stds = np.where(valid, np.sqrt(variance), fill_value)
+    result[order] = stds
+    return result
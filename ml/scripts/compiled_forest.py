@@ -0,0 +1,275 @@
+"""
+Compiled inference artifact for the wait time models.
+
+Flattens fitted RandomForestRegressors and the fitted feature pipeline (schema
+and scaling, see feature_pipeline) into plain NumPy arrays saved in one
+uncompressed .npz. The evaluator below needs only NumPy:
+the arrays are memory-mapped straight out of the archive, so loading costs a
+few page faults instead of importing sklearn and unpickling every tree.
+
+The mean forest can also carry a quantile regression forest table: for every
+leaf, LEAF_QUANTILE_POINTS equal-weight points summarising the training
+targets that land in it. A prediction's distribution is the mixture of the
+leaves it reaches, one per tree (Meinshausen, 2006). Quantiles and P(wait > t)
+therefore come from the same traversal as the mean, with no separate
+variance forest and no normal assumption.
+"""
+
+import mmap
+import struct
+import zipfile
+
+import numpy as np
+
+from feature_pipeline import FeaturePipeline
+from instrumentation import METRICS
+
+# Rows traversed per chunk; bounds the (rows x trees) index matrix
+CHUNK_ROWS = 4096
+
+FOREST_KEYS = ['feature', 'threshold', 'left', 'right', 'value', 'roots', 'max_depth']
+
+# Points kept per leaf to represent its training target distribution
+LEAF_QUANTILE_POINTS = 8
+
+# Quantiles reported by predict_distribution unless others are asked for
+QUANTILE_LEVELS = (0.05, 0.5, 0.9, 0.95)
+
+
+def flatten_forest(forest):
+    """Concatenate every tree of a fitted forest into flat node arrays.
+
+    Child indices are global. Leaves point back at themselves, so evaluation
+    can run a fixed number of steps without tracking which rows are finished.
+    """
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        node_ids = np.arange(offset, offset + n_nodes)
+        is_leaf = tree.children_left < 0
+
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+        lefts.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+        rights.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+        values.append(tree.value[:, 0, 0])
+        roots.append(offset)
+
+        max_depth = max(max_depth, tree.max_depth)
+        offset += n_nodes
+
+    return {
+        'feature': np.concatenate(features).astype(np.int32),
+        'threshold': np.concatenate(thresholds).astype(np.float64),
+        'left': np.concatenate(lefts).astype(np.int32),
+        'right': np.concatenate(rights).astype(np.int32),
+        'value': np.concatenate(values).astype(np.float64),
+        'roots': np.array(roots, dtype=np.int32),
+        'max_depth': np.array(max_depth, dtype=np.int32),
+    }
+
+
+def leaf_quantile_table(forest, features_scaled, target, points=LEAF_QUANTILE_POINTS):
+    """Summarise the training targets reaching every leaf of a CompiledForest.
+
+    Returns `leaf_slot`, mapping each node to its table row (-1 for split
+    nodes), and the (n_leaves, points) table of midpoint quantiles. Trees are
+    summarised one at a time, so the working memory grows with the rows but
+    not with rows x trees.
+    """
+    leaf_nodes = np.flatnonzero(forest.left == np.arange(len(forest.left)))
+    leaf_slot = np.full(len(forest.left), -1, dtype=np.int32)
+    leaf_slot[leaf_nodes] = np.arange(len(leaf_nodes))
+    # A leaf no training row reaches (not expected for a forest fitted on the same rows) keeps its mean
+    table = np.repeat(np.asarray(forest.value[leaf_nodes], dtype=np.float32)[:, None], points, axis=1)
+
+    # Cast once rather than in every per-tree apply
+    features_scaled = np.asarray(features_scaled, dtype=np.float32)
+    # Sorting the targets once leaves one stable sort by leaf per tree
+    by_target = np.argsort(np.asarray(target, dtype=np.float64), kind='stable')
+    sorted_targets = np.asarray(target, dtype=np.float64)[by_target]
+    levels = (np.arange(points) + 0.5) / points
+    for tree in range(len(forest.roots)):
+        leaves = forest.apply(features_scaled, trees=[tree])[by_target, 0]
+        order = np.argsort(leaves, kind='stable')
+        leaves, targets = leaves[order], sorted_targets[order]
+        populated, start, count = np.unique(leaves, return_index=True, return_counts=True)
+
+        # Linear interpolation between order statistics within each leaf's sorted run
+        position = start[:, None] + levels[None, :] * (count[:, None] - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, (start + count - 1)[:, None])
+        fraction = position - lower
+        table[leaf_slot[populated]] = targets[lower] * (1 - fraction) + targets[upper] * fraction
+    return leaf_slot, table
+
+
+def export_bundle(path, model_mean, model_variance, pipeline, training_data=None):
+    """Write the forests and the fitted feature pipeline to a single uncompressed .npz.
+
+    `model_variance` may be None when `training_data` (unscaled features,
+    target) is given: the mean forest then also gets its leaf quantile table
+    and the distribution comes from it.
+    """
+    arrays = pipeline.to_arrays()
+    models = [('mean', model_mean)] + ([('variance', model_variance)] if model_variance is not None else [])
+    for prefix, model in models:
+        for key, array in flatten_forest(model).items():
+            arrays[f'{prefix}_{key}'] = array
+    if training_data is not None:
+        features, target = training_data
+        features_scaled = pipeline.transform(np.asarray(features, dtype=np.float64))
+        leaf_slot, table = leaf_quantile_table(CompiledForest(arrays, 'mean'), features_scaled, target)
+        arrays['mean_leaf_slot'] = leaf_slot
+        arrays['mean_leaf_quantiles'] = table
+    # np.savez stores members uncompressed, which load_bundle relies on
+    np.savez(path, **arrays)
+
+
+def _mmap_npz(path):
+    """Map every member of an uncompressed .npz without copying it."""
+    arrays = {}
+    with open(path, 'rb') as f, zipfile.ZipFile(path) as archive:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path}: member {info.filename} is compressed and cannot be memory-mapped")
+            # Skip the local file header to reach the .npy payload
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            arrays[info.filename[:-len('.npy')]] = np.ndarray(
+                shape, dtype, buffer=buffer, offset=f.tell(), order='F' if fortran_order else 'C')
+    return arrays
+
+
+def load_bundle(path, mmap_mode=True):
+    if mmap_mode:
+        return _mmap_npz(path)
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+class CompiledForest:
+    """Pure-NumPy evaluator for a forest flattened by flatten_forest."""
+
+    def __init__(self, arrays, prefix):
+        self.feature = arrays[f'{prefix}_feature']
+        self.threshold = arrays[f'{prefix}_threshold']
+        self.left = arrays[f'{prefix}_left']
+        self.right = arrays[f'{prefix}_right']
+        self.value = arrays[f'{prefix}_value']
+        self.roots = arrays[f'{prefix}_roots']
+        self.max_depth = int(arrays[f'{prefix}_max_depth'])
+
+    def apply(self, X, trees=None):
+        """Leaf index reached in every tree (or the given `trees` indices), shape (n_rows, n_trees)."""
+        roots = self.roots if trees is None else self.roots[trees]
+        # sklearn compares float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        leaves = np.empty((X.shape[0], len(roots)), dtype=np.int32)
+        for start in range(0, X.shape[0], CHUNK_ROWS):
+            chunk = X[start:start + CHUNK_ROWS]
+            rows = np.arange(chunk.shape[0])[:, None]
+            nodes = np.broadcast_to(roots, (chunk.shape[0], len(roots)))
+            for _ in range(self.max_depth):
+                go_left = chunk[rows, self.feature[nodes]] <= self.threshold[nodes]
+                nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+            leaves[start:start + CHUNK_ROWS] = nodes
+        return leaves
+
+    def predict(self, X):
+        return self.value[self.apply(X)].mean(axis=1)
+
+
+class CompiledWaitTimePredictor:
+    """Drop-in replacement for predict.WaitTimePredictor backed by a compiled bundle."""
+
+    def __init__(self, bundle_path, mmap_mode=True, pipeline=None):
+        """`pipeline` is the caller's FeaturePipeline; the bundle is refused unless it was built for the same schema."""
+        arrays = load_bundle(bundle_path, mmap_mode)
+        self.pipeline = FeaturePipeline.from_arrays(arrays, default=pipeline)
+        if pipeline is not None:
+            pipeline.check(self.pipeline, f"Model bundle {bundle_path}")
+        self.model_mean = CompiledForest(arrays, 'mean')
+        # Older bundles carry a variance forest instead of the leaf quantile table
+        self.model_variance = CompiledForest(arrays, 'variance') if 'variance_feature' in arrays else None
+        self.leaf_slot = arrays.get('mean_leaf_slot')
+        self.leaf_quantiles = arrays.get('mean_leaf_quantiles')
+
+    @property
+    def has_quantiles(self):
+        return self.leaf_quantiles is not None
+
+    def transform(self, feature_matrix):
+        return self.pipeline.transform(np.asarray(feature_matrix, dtype=np.float64))
+
+    def predict(self, features):
+        mean_predictions, variance_predictions = self.predict_batch([features])
+        return mean_predictions[0], variance_predictions[0]
+
+    def predict_batch(self, feature_matrix):
+        if self.model_variance is None:
+            distribution = self.predict_distribution(feature_matrix, levels=(), thresholds=())
+            return distribution['mean'], distribution['variance']
+        with METRICS.stage('scaler_transform'):
+            features_scaled = self.transform(feature_matrix)
+        with METRICS.stage('forest_traversal'):
+            return self.model_mean.predict(features_scaled), self.model_variance.predict(features_scaled)
+
+    def predict_distribution(self, feature_matrix, thresholds=(30,), levels=QUANTILE_LEVELS):
+        """Mean, variance, P(wait > t) (n, len(thresholds)) and quantiles (n, len(levels)) in one traversal."""
+        if not self.has_quantiles:
+            raise ValueError("This model bundle has no leaf quantile table")
+        with METRICS.stage('scaler_transform'):
+            features_scaled = self.transform(feature_matrix)
+
+        n = features_scaled.shape[0]
+        levels = np.asarray(levels, dtype=np.float64)
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        result = {
+            'mean': np.empty(n), 'variance': np.empty(n),
+            'quantiles': np.empty((n, len(levels))), 'exceedance': np.empty((n, len(thresholds))),
+            'levels': tuple(levels.tolist()),
+        }
+        # Chunks bound the (rows x trees x points) mixture sample
+        for start in range(0, n, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, n)
+            with METRICS.stage('forest_traversal'):
+                leaves = self.model_mean.apply(features_scaled[start:stop])
+            with METRICS.stage('leaf_quantiles'):
+                result['mean'][start:stop] = self.model_mean.value[leaves].mean(axis=1)
+                samples = self.leaf_quantiles[self.leaf_slot[leaves]].reshape(stop - start, -1).astype(np.float64)
+                samples.sort(axis=1)
+                result['variance'][start:stop] = samples.var(axis=1)
+
+                # Quantiles by interpolating the sorted, equal-weight mixture sample
+                position = levels * (samples.shape[1] - 1)
+                lower = np.floor(position).astype(np.int64)
+                upper = np.minimum(lower + 1, samples.shape[1] - 1)
+                fraction = position - lower
+                result['quantiles'][start:stop] = samples[:, lower] * (1 - fraction) + samples[:, upper] * fraction
+
+                for j, threshold in enumerate(thresholds):
+                    result['exceedance'][start:stop, j] = (samples > threshold).mean(axis=1)
+        return result
+
+
+def verify_bundle(path, model_mean, model_variance, pipeline, feature_matrix, rtol=1e-6, atol=1e-6):
+    """Check that the compiled bundle reproduces sklearn's predictions (the mean only when `model_variance` is None)."""
+    compiled = CompiledWaitTimePredictor(path, pipeline=pipeline)
+    features_scaled = pipeline.transform(feature_matrix)
+    mean_compiled, variance_compiled = compiled.predict_batch(np.asarray(feature_matrix, dtype=np.float64))
+    if not np.allclose(mean_compiled, model_mean.predict(features_scaled), rtol=rtol, atol=atol):
+        return False
+    return model_variance is None or np.allclose(variance_compiled, model_variance.predict(features_scaled), rtol=rtol, atol=atol)
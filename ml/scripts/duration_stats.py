@@ -0,0 +1,244 @@
+"""
+Consultation-time statistics per doctor and per specialty.
+
+Every completed appointment's actual_duration updates, for its doctor and
+for the doctor's specialty:
+
+- count, mean and variance over all time (Welford),
+- an exponentially weighted mean and variance that follows recent pace,
+- p50 and p90 estimates (P-square, five markers, no samples kept).
+
+Each key's state is a handful of numbers, so updates are O(1) and the
+whole store is a small JSON file. The predictor reads it with a dict lookup
+instead of aggregating appointments in SQL. Ingestion is incremental, using
+the same high-water mark as retrain_model.py (see appointment_feed).
+"""
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+import time
+
+from appointment_feed import fetch_new_appointments
+from atomic_file import atomic_open
+
+STATS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models', 'duration_stats.json')
+
+# Weight of the newest duration in the exponentially weighted moments
+EWM_ALPHA = 0.1
+
+QUANTILES = (0.5, 0.9)
+
+
+class P2Quantile:
+    """Streaming quantile estimate (Jain & Chlamtac's P-square algorithm)."""
+
+    def __init__(self, p, state=None):
+        self.p = p
+        state = state or {}
+        # Marker heights, actual positions and desired positions
+        self.heights = state.get('heights', [])
+        self.positions = state.get('positions', [1, 2, 3, 4, 5])
+        self.desired = state.get('desired', [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5])
+
+    def to_dict(self):
+        return {'heights': self.heights, 'positions': self.positions, 'desired': self.desired}
+
+    def add(self, x):
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(x)
+            heights.sort()
+            return
+
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if heights[i] <= x < heights[i + 1])
+
+        positions, desired, p = self.positions, self.desired, self.p
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        increments = (0, p / 2, p, (1 + p) / 2, 1)
+        for i in range(5):
+            desired[i] += increments[i]
+
+        for i in (1, 2, 3):
+            d = desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if d > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (positions[i + step] - positions[i])
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i, step):
+        q, n = self.heights, self.positions
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self):
+        heights = self.heights
+        if not heights:
+            return None
+        if len(heights) < 5:
+            # Exact quantile of the few values seen so far
+            return heights[min(len(heights) - 1, int(round(self.p * (len(heights) - 1))))]
+        return heights[2]
+
+
+class DurationStats:
+    """Running moments and quantiles of one doctor's (or specialty's) durations."""
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.count = state.get('count', 0)
+        self.mean = state.get('mean', 0.0)
+        self.m2 = state.get('m2', 0.0)
+        self.ewm_mean = state.get('ewm_mean', 0.0)
+        self.ewm_var = state.get('ewm_var', 0.0)
+        self.quantiles = {p: P2Quantile(p, state.get('quantiles', {}).get(str(p))) for p in QUANTILES}
+
+    def add(self, duration):
+        self.count += 1
+        delta = duration - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (duration - self.mean)
+
+        if self.count == 1:
+            self.ewm_mean, self.ewm_var = duration, 0.0
+        else:
+            diff = duration - self.ewm_mean
+            increment = EWM_ALPHA * diff
+            self.ewm_mean += increment
+            self.ewm_var = (1 - EWM_ALPHA) * (self.ewm_var + diff * increment)
+
+        for quantile in self.quantiles.values():
+            quantile.add(duration)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self):
+        return {
+            'count': self.count, 'mean': self.mean, 'm2': self.m2,
+            'ewm_mean': self.ewm_mean, 'ewm_var': self.ewm_var,
+            'quantiles': {str(p): q.to_dict() for p, q in self.quantiles.items()},
+        }
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'std': math.sqrt(self.variance),
+            'recent_mean': self.ewm_mean,
+            'recent_std': math.sqrt(self.ewm_var),
+            **{f'p{round(p * 100)}': q.value() for p, q in self.quantiles.items()},
+        }
+
+
+class DurationStatsStore:
+    """DurationStats keyed by "doctor:<id>" and "specialty:<name>", persisted as JSON.
+
+    `last_appointment_id` and `processed_ids` are the ingestion high-water
+    mark. Readers in long-lived processes call refresh(), which reloads the
+    file at most every `check_interval` seconds when it has changed.
+    """
+
+    def __init__(self, path=STATS_PATH, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.stats = {}
+        self.last_appointment_id = 0
+        self.processed_ids = set()
+        self._mtime = None
+        self._last_check = 0.0
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path) as f:
+            data = json.load(f)
+        self.stats = {key: DurationStats(state) for key, state in data.get('stats', {}).items()}
+        self.last_appointment_id = data.get('last_appointment_id', 0)
+        self.processed_ids = set(data.get('processed_ids', []))
+        self._mtime = mtime
+
+    def save(self):
+        data = {
+            'last_appointment_id': self.last_appointment_id,
+            'processed_ids': sorted(self.processed_ids),
+            'stats': {key: stats.to_dict() for key, stats in self.stats.items()},
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Each saved consultation spawns a refresh, so several may save at once
+        with atomic_open(self.path) as f:
+            json.dump(data, f)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def add(self, doctor_id, specialty, duration):
+        for key in (f'doctor:{doctor_id}', f'specialty:{specialty or "default"}'):
+            self.stats.setdefault(key, DurationStats()).add(duration)
+
+    def ingest(self, conn, now=None):
+        """Fold in appointments completed since the last run; returns how many were added."""
+        specialties = dict(conn.execute("SELECT id, specialty FROM doctors"))
+        new_rows = fetch_new_appointments(conn, self, now)
+        for _, doctor_id, _, duration in new_rows:
+            self.add(doctor_id, specialties.get(doctor_id), float(duration))
+        return len(new_rows)
+
+    def get(self, doctor_id=None, specialty=None):
+        """Stats for the doctor, falling back to the specialty; None when neither has any."""
+        self.refresh()
+        for key in (f'doctor:{doctor_id}' if doctor_id is not None else None,
+                    f'specialty:{specialty}' if specialty else None):
+            stats = self.stats.get(key)
+            if stats is not None and stats.count:
+                return stats
+        return None
+
+    def average_duration(self, doctor_id=None, specialty=None):
+        """Recent mean consultation time, as predict()'s doctor_avg_time."""
+        stats = self.get(doctor_id, specialty)
+        return stats.ewm_mean if stats is not None else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Update per-doctor and per-specialty consultation time statistics')
+    parser.add_argument('--db', default=os.environ.get('DB_PATH', '../../database/queue.db'))
+    parser.add_argument('--output', default=STATS_PATH)
+    parser.add_argument('--rebuild', action='store_true', help='Discard the stored statistics and replay the whole history')
+    parser.add_argument('--show', action='store_true', help='Print the summary of every key')
+    args = parser.parse_args()
+
+    store = DurationStatsStore(args.output)
+    if args.rebuild:
+        store.stats, store.last_appointment_id, store.processed_ids = {}, 0, set()
+
+    conn = sqlite3.connect(args.db)
+    added = store.ingest(conn)
+    conn.close()
+    store.save()
+
+    print(f"Added {added} completed appointments; {len(store.stats)} keys tracked.")
+    if args.show:
+        print(json.dumps({key: stats.summary() for key, stats in sorted(store.stats.items())}, indent=2))
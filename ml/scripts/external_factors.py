@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Ingestion of hospital occupancy and external factors (traffic, weather).
+
+An asyncio loop polls two kinds of input on their own intervals:
+
+- occupancy, counted from the queue and appointments tables;
+- traffic and weather, from a pluggable FactorSource (FileFactorSource
+  reads a local JSON file that any feed, or a person, can keep current).
+
+Every occupancy tick appends one fixed-size record with the latest values
+of everything to a per-day snapshot file (SNAPSHOT_DTYPE, 29 bytes per
+record). It also rewrites latest.json and today's external_factors row,
+which the booking controller reads. The predictor keeps latest.json in
+memory through LatestFactors, so requests may omit hospital_occupancy and
+traffic_level. Training joins event times against the snapshots with one
+searchsorted (factors_at) instead of a per-row SQL lookup.
+
+    python external_factors.py --source-path traffic.json
+    python external_factors.py --once
+"""
+
+import abc
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from atomic_file import atomic_open
+from queue_stages import FINISHED_STAGES, IN_SERVICE_STAGE
+
+# Shared by the ingestor and the predictor's LatestFactors; set MEDIQUEUE_FACTORS_DIR to move both
+FACTORS_DIR = os.environ.get('MEDIQUEUE_FACTORS_DIR',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'external_factors'))
+LATEST_FILE = 'latest.json'
+
+# One snapshot record; time is UTC epoch seconds
+SNAPSHOT_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('hospital_occupancy', '<f4'),
+    ('queued', '<i4'),
+    ('in_service', '<i4'),
+    ('appointments_open', '<i4'),
+    ('traffic_level', '<f4'),
+    ('weather_code', 'i1'),
+])
+
+WEATHER_CODES = {'clear': 0, 'cloudy': 1, 'rain': 2, 'snow': 3, 'fog': 4, 'storm': 5}
+
+# Patients a doctor can have on site before the hospital counts as full
+PATIENTS_PER_DOCTOR = 8
+
+OCCUPANCY_QUERY = f"""
+    SELECT
+        (SELECT COUNT(*) FROM queue
+         WHERE COALESCE(stage, 'waiting') NOT IN ({', '.join('?' * len(FINISHED_STAGES))})
+           AND COALESCE(stage, 'waiting') != ?),
+        (SELECT COUNT(*) FROM queue WHERE stage = ?),
+        (SELECT COUNT(*) FROM appointments
+         WHERE status IN ('booked', 'checked_in', 'waiting') AND DATE(appointment_time) = DATE('now')),
+        (SELECT COUNT(*) FROM doctors WHERE is_active = 1)
+    """
+
+
+def count_occupancy(db_path, patients_per_doctor=PATIENTS_PER_DOCTOR):
+    """Current occupancy counts from the database, in one query."""
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        queued, in_service, appointments_open, doctors = conn.execute(
+            OCCUPANCY_QUERY, (*FINISHED_STAGES, IN_SERVICE_STAGE, IN_SERVICE_STAGE)).fetchone()
+    finally:
+        conn.close()
+    capacity = max(doctors, 1) * patients_per_doctor
+    return {
+        'hospital_occupancy': min((queued + in_service) / capacity, 1.0),
+        'queued': queued,
+        'in_service': in_service,
+        'appointments_open': appointments_open,
+    }
+
+
+class FactorSource(abc.ABC):
+    """Traffic and weather provider; subclasses implement fetch()."""
+
+    name = 'base'
+
+    @abc.abstractmethod
+    async def fetch(self):
+        """{'traffic_level': 0-10, 'weather_condition': str}; either may be missing."""
+
+
+class FileFactorSource(FactorSource):
+    """Reads {"traffic_level": 4, "weather_condition": "rain"} from a local JSON file."""
+
+    name = 'file'
+
+    def __init__(self, path):
+        self.path = path
+
+    async def fetch(self):
+        return await asyncio.to_thread(self._read)
+
+    def _read(self):
+        with open(self.path) as f:
+            data = json.load(f)
+        factors = {}
+        if data.get('traffic_level') is not None:
+            factors['traffic_level'] = min(max(float(data['traffic_level']), 0.0), 10.0)
+        if data.get('weather_condition'):
+            factors['weather_condition'] = str(data['weather_condition'])
+        return factors
+
+
+# Registered sources, selected with --source
+SOURCES = {FileFactorSource.name: FileFactorSource}
+
+
+class SnapshotWriter:
+    """Appends SNAPSHOT_DTYPE records to one YYYY-MM-DD.bin file per UTC day."""
+
+    def __init__(self, directory=FACTORS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, values, at):
+        record = np.zeros(1, dtype=SNAPSHOT_DTYPE)
+        record['time'] = int(at.replace(tzinfo=timezone.utc).timestamp())
+        for name in SNAPSHOT_DTYPE.names[1:]:
+            if name in values:
+                record[name] = values[name]
+        record['weather_code'] = WEATHER_CODES.get(values.get('weather_condition'), -1)
+        # Whole records in append mode, so readers never see a partial one from a finished write
+        with open(os.path.join(self.directory, f'{at:%Y-%m-%d}.bin'), 'ab') as f:
+            f.write(record.tobytes())
+
+    def write_latest(self, values):
+        with atomic_open(os.path.join(self.directory, LATEST_FILE)) as f:
+            json.dump(values, f)
+
+
+def load_snapshots(start, end, directory=FACTORS_DIR):
+    """Snapshot records between two datetimes (naive UTC), in time order, memory-mapped per day."""
+    days = []
+    day = start.date()
+    while day <= end.date():
+        path = os.path.join(directory, f'{day:%Y-%m-%d}.bin')
+        if os.path.exists(path) and os.path.getsize(path) >= SNAPSHOT_DTYPE.itemsize:
+            # A writer may be mid-append; read only whole records
+            count = os.path.getsize(path) // SNAPSHOT_DTYPE.itemsize
+            days.append(np.memmap(path, dtype=SNAPSHOT_DTYPE, mode='r', shape=(count,)))
+        day += timedelta(days=1)
+    if not days:
+        return np.zeros(0, dtype=SNAPSHOT_DTYPE)
+    snapshots = np.concatenate(days)
+    lo, hi = (int(t.replace(tzinfo=timezone.utc).timestamp()) for t in (start, end))
+    return snapshots[(snapshots['time'] >= lo) & (snapshots['time'] <= hi)]
+
+
+def factors_at(times, snapshots, max_age=timedelta(minutes=15), columns=('hospital_occupancy', 'traffic_level')):
+    """As-of join: each column's latest snapshot value at or before every time (datetime64 or epoch seconds).
+
+    NaN where no snapshot is at most `max_age` older than the time.
+    """
+    times = np.asarray(times)
+    if times.dtype.kind == 'M':
+        times = times.astype('datetime64[s]').astype(np.int64)
+    index = np.searchsorted(snapshots['time'], times, side='right') - 1
+    found = index >= 0
+    found[found] &= times[found] - snapshots['time'][index[found]] <= max_age.total_seconds()
+    joined = {}
+    for column in columns:
+        values = np.full(len(times), np.nan)
+        values[found] = snapshots[column][index[found]]
+        joined[column] = values
+    return joined
+
+
+class LatestFactors:
+    """The ingestor's latest values, reloaded from latest.json at most every `check_interval` seconds when changed."""
+
+    def __init__(self, directory=FACTORS_DIR, max_age=timedelta(minutes=15), check_interval=1.0):
+        self.path = os.path.join(directory, LATEST_FILE)
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.values = {}
+        self._mtime = None
+        self._last_check = 0.0
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self.values, self._mtime = {}, None
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path) as f:
+            self.values = json.load(f)
+        self._mtime = mtime
+
+    def get(self):
+        """Latest values, or {} when the ingestor has not written any within max_age."""
+        self.refresh()
+        updated_at = self.values.get('updated_at')
+        if not updated_at or datetime.now(timezone.utc).replace(tzinfo=None) - datetime.fromisoformat(updated_at) > self.max_age:
+            return {}
+        return self.values
+
+
+LATEST_FACTORS = LatestFactors()
+
+
+class FactorIngestor:
+    """Polls occupancy and the factor source concurrently and records every occupancy tick."""
+
+    def __init__(self, db_path, source=None, writer=None, occupancy_interval=30.0, source_interval=300.0,
+                 patients_per_doctor=PATIENTS_PER_DOCTOR):
+        self.db_path = db_path
+        self.source = source
+        self.writer = writer or SnapshotWriter()
+        self.occupancy_interval = occupancy_interval
+        self.source_interval = source_interval
+        self.patients_per_doctor = patients_per_doctor
+        # Latest value of every factor; the source's last answer stays until it gives a new one
+        self.latest = {}
+
+    async def poll_source(self):
+        if self.source is None:
+            return
+        try:
+            self.latest.update(await self.source.fetch())
+        except (OSError, ValueError) as e:
+            print(f"Factor source {self.source.name} failed, keeping previous values: {e}", file=sys.stderr)
+
+    async def poll_occupancy(self):
+        counts = await asyncio.to_thread(count_occupancy, self.db_path, self.patients_per_doctor)
+        self.latest.update(counts)
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        self.latest['updated_at'] = now.isoformat()
+        await asyncio.to_thread(self.record, now)
+
+    def record(self, now):
+        self.writer.append(self.latest, now)
+        self.writer.write_latest(self.latest)
+        self.write_daily_row(now)
+
+    def write_daily_row(self, now):
+        """Keep today's external_factors row (read by the booking controller) at the latest ingested values.
+
+        Only factors actually ingested are written; without a source, traffic and weather are left alone.
+        """
+        values = {'hospital_occupancy': round(self.latest['hospital_occupancy'], 3)}
+        if self.latest.get('traffic_level') is not None:
+            values['traffic_level'] = int(round(self.latest['traffic_level']))
+        if self.latest.get('weather_condition'):
+            values['weather_condition'] = self.latest['weather_condition']
+        date = now.strftime('%Y-%m-%d')
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                updated = conn.execute(
+                    f"UPDATE external_factors SET {', '.join(f'{column} = ?' for column in values)} WHERE date = ?",
+                    (*values.values(), date)).rowcount
+                if not updated:
+                    conn.execute(
+                        f"INSERT INTO external_factors ({', '.join(values)}, date) VALUES ({', '.join('?' * (len(values) + 1))})",
+                        (*values.values(), date))
+        finally:
+            conn.close()
+
+    async def _every(self, interval, poll):
+        while True:
+            started = time.monotonic()
+            try:
+                await poll()
+            except (sqlite3.Error, OSError) as e:
+                # One failed tick (database locked, snapshot disk full) must not stop the other poller
+                print(f"Factor ingestion ({poll.__name__}) failed: {e}", file=sys.stderr)
+            await asyncio.sleep(max(interval - (time.monotonic() - started), 0))
+
+    async def run_once(self):
+        await self.poll_source()
+        await self.poll_occupancy()
+
+    async def run(self):
+        # The first occupancy record waits for the source, so it already carries traffic and weather
+        await self.poll_source()
+        await asyncio.gather(
+            self._every(self.source_interval, self.poll_source),
+            self._every(self.occupancy_interval, self.poll_occupancy),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record hospital occupancy, traffic and weather snapshots')
+    parser.add_argument('--db', default=os.environ.get('DB_PATH', '../../database/queue.db'))
+    parser.add_argument('--output-dir', default=FACTORS_DIR, help='Directory of the daily snapshot files and latest.json (default: $MEDIQUEUE_FACTORS_DIR)')
+    parser.add_argument('--source', choices=sorted(SOURCES), default=FileFactorSource.name)
+    parser.add_argument('--source-path', help='JSON file read by the file source; without it only occupancy is recorded')
+    parser.add_argument('--occupancy-interval', type=float, default=30.0, help='Seconds between occupancy snapshots')
+    parser.add_argument('--source-interval', type=float, default=300.0, help='Seconds between traffic/weather reads')
+    parser.add_argument('--patients-per-doctor', type=int, default=PATIENTS_PER_DOCTOR, help='On-site patients per active doctor at full occupancy')
+    parser.add_argument('--once', action='store_true', help='Take one snapshot and exit')
+    args = parser.parse_args()
+
+    if os.path.abspath(args.output_dir) != os.path.abspath(FACTORS_DIR):
+        print(f"Warning: predictions read latest.json from {FACTORS_DIR}; set MEDIQUEUE_FACTORS_DIR={args.output_dir} "
+              "for the prediction server as well", file=sys.stderr)
+    source = SOURCES[args.source](args.source_path) if args.source_path else None
+    ingestor = FactorIngestor(args.db, source, SnapshotWriter(args.output_dir), args.occupancy_interval,
+                              args.source_interval, args.patients_per_doctor)
+    try:
+        asyncio.run(ingestor.run_once() if args.once else ingestor.run())
+    except KeyboardInterrupt:
+        pass
+    if args.once:
+        print(json.dumps(ingestor.latest))
+
+
+if __name__ == '__main__':
+    main()
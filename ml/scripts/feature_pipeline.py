@@ -0,0 +1,238 @@
+"""
+Model inputs, defined once for training, retraining and serving.
+
+A FeaturePipeline owns a model family's column order, its categorical
+encodings, the time features derived from a slot time, and the standard
+scaling fitted on the training rows:
+
+    pipeline = WAIT_TIME_FEATURES.fit(WAIT_TIME_FEATURES.matrix(data))   # training
+    features_scaled = pipeline.transform(pipeline.matrix(rows))          # serving
+
+matrix() and transform() are plain NumPy, so serving never needs sklearn.
+The schema (name, columns, encodings) and its hash travel with every model
+artifact: the compiled bundle embeds it and registry versions carry
+feature_pipeline.json. Loaders call check(), so a model built for other
+inputs is refused at load time instead of silently fed the wrong columns.
+"""
+
+import hashlib
+import json
+from datetime import datetime
+
+import numpy as np
+
+from atomic_file import atomic_open
+
+PIPELINE_FILE = 'feature_pipeline.json'
+
+TIME_SLOT_CODES = {'morning': 0, 'afternoon': 1, 'evening': 2}
+
+# Hours at which the afternoon and evening slots start
+TIME_SLOT_STARTS = [12, 17]
+
+# Columns a row may omit when it has a slot_time to derive them from
+TIME_COLUMNS = ('time_of_day', 'day_of_week', 'time_slot')
+
+
+def temporal_features(slot_time_str):
+    # Calculate temporal features from slot_time
+    dt = datetime.fromisoformat(slot_time_str.replace('Z', '+00:00'))
+    time_of_day = dt.hour + dt.minute / 60
+    day_of_week = dt.weekday()
+    time_slot = 'morning' if time_of_day < 12 else 'afternoon' if time_of_day < 17 else 'evening'
+    return time_of_day, day_of_week, time_slot
+
+
+def temporal_feature_arrays(slot_times):
+    import pandas as pd
+    # Vectorized temporal_features: keeps the wall-clock time of each timestamp
+    local_times = pd.Series(slot_times, dtype=str).str.replace(r'(Z|[+-]\d{2}:?\d{2})$', '', regex=True)
+    dt = pd.to_datetime(local_times, format='ISO8601')
+    time_of_day = (dt.dt.hour + dt.dt.minute / 60).to_numpy(dtype=float)
+    day_of_week = dt.dt.weekday.to_numpy()
+    return time_of_day, day_of_week, time_slot_names(time_of_day)
+
+
+def time_slot_names(time_of_day):
+    return np.array(list(TIME_SLOT_CODES))[np.digitize(time_of_day, TIME_SLOT_STARTS)]
+
+
+def encode_categories(values, codes, column):
+    """Map category names to their codes; a scalar gives a scalar."""
+    if isinstance(values, str):
+        if values not in codes:
+            raise ValueError(f"Unknown {column} value: {values!r}")
+        return codes[values]
+    names = np.asarray(values)
+    encoded = np.full(names.shape, -1)
+    for name, code in codes.items():
+        encoded[names == name] = code
+    if (encoded < 0).any():
+        raise ValueError(f"Unknown {column} values: {sorted(set(names[encoded < 0]))}")
+    return encoded
+
+
+class FeaturePipeline:
+    def __init__(self, name, columns, encodings=None, mean=None, scale=None):
+        self.name = name
+        self.columns = list(columns)
+        # encoded column -> (source column, {category: code})
+        self.encodings = dict(encodings or {})
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float64)
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float64)
+
+    @property
+    def schema(self):
+        return {
+            'name': self.name,
+            'columns': self.columns,
+            'encodings': {column: {'source': source, 'codes': codes} for column, (source, codes) in self.encodings.items()},
+        }
+
+    @property
+    def schema_hash(self):
+        return hashlib.sha256(json.dumps(self.schema, sort_keys=True).encode()).hexdigest()
+
+    @property
+    def inputs(self):
+        """Row fields the columns are built from (an encoded column's source in its place)."""
+        return [self.encodings[column][0] if column in self.encodings else column for column in self.columns]
+
+    @property
+    def fitted(self):
+        return self.mean is not None
+
+    def check(self, other, source='model'):
+        """Raise ValueError unless `other` (e.g. the pipeline stored with a model) has this schema."""
+        if other.schema_hash != self.schema_hash:
+            raise ValueError(
+                f"{source} was built for {other.name} features {other.columns}, "
+                f"but {self.name} features {self.columns} are expected")
+
+    def row(self, values):
+        """Unscaled feature vector for one request dict of scalars."""
+        if 'slot_time' in values and any(field not in values for field in self.inputs):
+            values = {**dict(zip(TIME_COLUMNS, temporal_features(values['slot_time']))), **values}
+        features = []
+        for column in self.columns:
+            if column in self.encodings:
+                source, codes = self.encodings[column]
+                features.append(encode_categories(values[source], codes, source))
+            else:
+                features.append(values[column])
+        return features
+
+    def matrix(self, rows, dtype=np.float64):
+        """Unscaled (n, len(columns)) matrix from a DataFrame or dict of (memory-mapped) columns."""
+        derived = {}
+        missing = [field for field in self.inputs if field not in rows]
+        if 'slot_time' in rows and missing:
+            derived = dict(zip(TIME_COLUMNS, temporal_feature_arrays(rows['slot_time'])))
+        elif missing == ['time_slot'] and 'time_of_day' in rows:
+            derived = {'time_slot': time_slot_names(np.asarray(rows['time_of_day'], dtype=float))}
+
+        keys = list(rows.keys())
+        n_rows = len(rows[keys[0]]) if keys else 0
+        matrix = np.empty((n_rows, len(self.columns)), dtype=dtype)
+        for i, column in enumerate(self.columns):
+            if column in self.encodings:
+                source, codes = self.encodings[column]
+                matrix[:, i] = encode_categories(rows[source] if source in rows else derived[source], codes, source)
+            else:
+                matrix[:, i] = rows[column] if column in rows else derived[column]
+        return matrix
+
+    def fit(self, matrix):
+        """A copy of this pipeline scaled to `matrix`, as StandardScaler would be."""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        std = matrix.std(axis=0)
+        # Constant columns are centred but not scaled
+        scale = np.where(std < 10 * np.finfo(np.float64).eps, 1.0, std)
+        return self.with_scaling(matrix.mean(axis=0), scale)
+
+    def with_scaling(self, mean, scale):
+        return FeaturePipeline(self.name, self.columns, self.encodings, mean, scale)
+
+    def transform(self, matrix):
+        """Scale an unscaled matrix (or one feature vector) column-wise; float32 input stays float32."""
+        if not self.fitted:
+            raise ValueError(f"The {self.name} feature pipeline has not been fitted")
+        matrix = np.asarray(matrix)
+        if matrix.dtype != np.float32:
+            matrix = matrix.astype(np.float64)
+        return ((matrix - self.mean) / self.scale).astype(matrix.dtype, copy=False)
+
+    def to_dict(self):
+        return {
+            **self.schema,
+            'schema_hash': self.schema_hash,
+            'mean': None if self.mean is None else self.mean.tolist(),
+            'scale': None if self.scale is None else self.scale.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        encodings = {column: (spec['source'], spec['codes']) for column, spec in data.get('encodings', {}).items()}
+        return cls(data['name'], data['columns'], encodings, data.get('mean'), data.get('scale'))
+
+    def save(self, path):
+        with atomic_open(path) as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_arrays(self):
+        """Members for a compiled .npz bundle."""
+        return {
+            'feature_schema': np.array(json.dumps(self.schema, sort_keys=True)),
+            'scaler_mean': self.mean,
+            'scaler_scale': self.scale,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, default=None):
+        """Pipeline stored in a bundle; bundles from before the schema was embedded get `default`'s."""
+        if 'feature_schema' in arrays:
+            pipeline = cls.from_dict(json.loads(str(arrays['feature_schema'])))
+        elif default is not None:
+            pipeline = default
+        else:
+            raise ValueError("Model bundle has no feature schema")
+        mean, scale = np.asarray(arrays['scaler_mean']), np.asarray(arrays['scaler_scale'])
+        if len(mean) != len(pipeline.columns):
+            raise ValueError(f"Model bundle scales {len(mean)} features, but {pipeline.name} has {len(pipeline.columns)}")
+        return pipeline.with_scaling(mean, scale)
+
+
+def load_pipeline(path, default=None):
+    """Read a feature_pipeline.json, or a legacy StandardScaler pickle scaled onto `default`'s schema."""
+    if path.endswith('.pkl'):
+        if default is None:
+            raise ValueError(f"Scaler pickle {path} has no feature schema")
+        # Imported here so serving from JSON never pays for sklearn/joblib
+        import joblib
+        scaler = joblib.load(path)
+        # Scalers fitted on a DataFrame remember its columns; others only their count
+        names = getattr(scaler, 'feature_names_in_', None)
+        fitted_on = list(names) if names is not None else f'{len(scaler.mean_)} features'
+        if len(scaler.mean_) != len(default.columns) or (names is not None and fitted_on != default.columns):
+            raise ValueError(f"Scaler {path} was fitted on {fitted_on}, but {default.name} features {default.columns} are expected")
+        return default.with_scaling(scaler.mean_, scaler.scale_)
+    with open(path) as f:
+        data = json.load(f)
+    pipeline = FeaturePipeline.from_dict(data)
+    if data.get('schema_hash') not in (None, pipeline.schema_hash):
+        raise ValueError(f"Feature pipeline {path} does not match its schema hash")
+    return pipeline
+
+
+# Inputs of train_model.py's model, served by predict.py
+WAIT_TIME_FEATURES = FeaturePipeline(
+    'wait_time',
+    ['total_queue_length', 'patients_at_current_stage', 'staff_at_current_stage', 'hospital_occupancy', 'patient_age', 'traffic_level', 'doctor_experience', 'time_of_day', 'day_of_week', 'time_slot_encoded'],
+    {'time_slot_encoded': ('time_slot', TIME_SLOT_CODES)},
+)
+
+# Inputs of retrain_model.py's model, built from the appointments history
+HISTORY_FEATURES = FeaturePipeline(
+    'wait_time_history',
+    ['doctor_id', 'time_of_day', 'day_of_week', 'avg_recent_duration', 'queue_length'],
+)
@@ -1,97 +1,206 @@
+import argparse
+import os
+
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-import random
-
-def generate_synthetic_data(num_samples=1000):
-    data = []
-    doctors = [1, 2, 3, 4, 5]  # Multiple doctors
-    base_date = datetime(2023, 1, 1)
-    
-    for _ in range(num_samples):
-        doctor_id = random.choice(doctors)
+
+from columnar_store import open_columns, write_schema
+
+DOCTORS = np.array([1, 2, 3, 4, 5])  # Multiple doctors
+BASE_DATE = np.datetime64('2023-01-01')
+PRIORITIES = np.array(['normal', 'urgent', 'emergency'])
+TIME_SLOTS = np.array(['morning', 'afternoon', 'evening'])
+
+# Column order and on-disk dtypes of the generated data
+COLUMN_SCHEMA = {
+    'doctor_id': np.int32,
+    'time_of_day': np.float64,
+    'day_of_week': np.int8,
+    'day_of_month': np.int8,
+    'month': np.int8,
+    'time_slot': '<U9',
+    'avg_recent_duration': np.float64,
+    'total_queue_length': np.int32,
+    'patients_at_current_stage': np.int32,
+    'staff_at_current_stage': np.int32,
+    'patients_waiting_checkin': np.int32,
+    'patient_age': np.int32,
+    'patient_priority': '<U9',
+    'patient_no_show_rate': np.float64,
+    'doctor_experience': np.int32,
+    'traffic_level': np.int32,
+    'hospital_occupancy': np.float64,
+    'actual_wait_time': np.float64,
+    'variance': np.float64,
+}
+
+# Mean arrivals per doctor per day in arrival-sequence mode
+ARRIVALS_PER_DAY = 30
+
+def _calendar(days_offset):
+    dates = BASE_DATE + days_offset.astype('timedelta64[D]')
+    day_of_week = (dates.astype('datetime64[D]').astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+    month = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    day_of_month = (dates - dates.astype('datetime64[M]')).astype(np.int64) + 1
+    return day_of_week, day_of_month, month
+
+def _uniform_int(rng, low, high_inclusive):
+    """Like random.randint with a per-row upper bound."""
+    return low + np.floor(rng.random(len(high_inclusive)) * (high_inclusive - low + 1)).astype(np.int64)
+
+def _arrival_sequences(rng, num_samples):
+    """Per-doctor, per-day Poisson arrivals; queue length counts the arrivals of the past hour."""
+    n_groups = int(np.ceil(num_samples / ARRIVALS_PER_DAY * 1.2)) + 1
+    while True:
+        counts = rng.poisson(ARRIVALS_PER_DAY, n_groups)
+        if counts.sum() >= num_samples:
+            break
+        n_groups *= 2
+
+    group_doctor = rng.choice(DOCTORS, n_groups)
+    group_day = rng.integers(0, 366, n_groups)
+    group = np.repeat(np.arange(n_groups), counts)[:num_samples]
+    time_of_day = rng.uniform(8, 18, num_samples)
+
+    # Order arrivals within each doctor-day
+    order = np.lexsort((time_of_day, group))
+    group, time_of_day = group[order], time_of_day[order]
+
+    # Arrivals for the same doctor-day within the last hour (a group spans < 24h)
+    key = group * 24.0 + time_of_day
+    recent = np.arange(num_samples) - np.searchsorted(key, key - 1.0, side='left')
+
+    doctor_id = group_doctor[group]
+    days_offset = group_day[group]
+    # Doctors keep their own pace and experience
+    doctor_pace = rng.uniform(5, 25, DOCTORS.max() + 1)
+    doctor_experience = rng.integers(1, 31, DOCTORS.max() + 1)
+    avg_recent_duration = np.clip(doctor_pace[doctor_id] + rng.normal(0, 2, num_samples), 5, 25)
+    return doctor_id, days_offset, time_of_day, recent, avg_recent_duration, doctor_experience[doctor_id]
+
+def generate_synthetic_data(num_samples=1000, seed=None, arrivals=False, rng=None):
+    """Generate synthetic wait time samples, every column drawn as one array.
+
+    With `arrivals=True` rows are per-doctor, per-day arrival sequences in
+    time order instead of independent draws.
+    """
+    rng = rng if rng is not None else np.random.default_rng(seed)
+    n = num_samples
+
+    if arrivals:
+        doctor_id, days_offset, time_of_day, total_queue_length, avg_recent_duration, doctor_experience = _arrival_sequences(rng, n)
+    else:
+        doctor_id = rng.choice(DOCTORS, n)
         # Random date within a year
-        days_offset = random.randint(0, 365)
-        slot_time = base_date + timedelta(days=days_offset)
-        time_of_day = random.uniform(8, 18)  # 8 AM to 6 PM
-        day_of_week = slot_time.weekday()
-        day_of_month = slot_time.day
-        month = slot_time.month
-        
-        # Multi-stage queue features (adapted for MediQueueAI)
-        total_queue_length = random.randint(0, 15)
-        # Stage-specific waiting
-        patients_waiting_checkin = random.randint(0, 5)
-        patients_waiting_triage = random.randint(0, total_queue_length // 3)
-        patients_waiting_consultation = random.randint(0, total_queue_length // 2)
-        patients_waiting_payment = random.randint(0, 3)
-        
-        # Staff serving each stage
-        staff_checkin = random.randint(1, 3)
-        staff_triage = random.randint(1, 2)
-        staff_consultation = random.randint(1, 5)
-        staff_payment = random.randint(1, 2)
-        
-        # Current stage for this prediction (simplified to consultation for booking)
-        current_stage = 'consultation'
-        patients_at_current_stage = patients_waiting_consultation
-        staff_at_current_stage = staff_consultation
-        
+        days_offset = rng.integers(0, 366, n)
+        time_of_day = rng.uniform(8, 18, n)  # 8 AM to 6 PM
+        total_queue_length = rng.integers(0, 16, n)
         # Recent durations (simulate past waits)
-        avg_recent_duration = random.uniform(5, 25)
-        
-        # Patient features
-        patient_age = random.randint(18, 80)
-        patient_priority = random.choice(['normal', 'urgent', 'emergency'])
-        patient_no_show_rate = random.uniform(0, 0.3)
-        
-        # Doctor features
-        doctor_experience = random.randint(1, 30)
-        
-        # External factors
-        traffic = random.randint(0, 10)
-        occupancy = random.uniform(0.3, 0.9)
-        
-        # Time-based features
-        time_slot = 'morning' if time_of_day < 12 else 'afternoon' if time_of_day < 17 else 'evening'
-        
-        # Actual wait time: realistic hospital wait times with temporal effects
-        time_slot_multiplier = 1.0 if time_slot == 'morning' else 1.3 if time_slot == 'afternoon' else 0.8  # Afternoon peak, evening slower
-        weekend_multiplier = 1.2 if day_of_week >= 5 else 1.0  # Weekend effects
-        
-        base_wait = 5 + total_queue_length * 0.8 + patients_at_current_stage * 1.2 + (5 / max(staff_at_current_stage, 1)) + patients_waiting_checkin * 0.3 + (18 - time_of_day) * 0.3 + patient_age * 0.05 + (1 if patient_priority == 'urgent' else 0) * 3 + doctor_experience * -0.1 + traffic * 0.3 + occupancy * 5
-        base_wait = base_wait * time_slot_multiplier * weekend_multiplier
-        noise = np.random.normal(0, 2)
-        actual_wait_time = max(0, base_wait + noise)
-        
-        # Variance: realistic uncertainty
-        variance = 0.5 + total_queue_length * 0.15 + patients_at_current_stage * 0.25 + traffic * 0.05 + random.uniform(0, 1)
-        
-        data.append({
-            'doctor_id': doctor_id,
-            'time_of_day': time_of_day,
-            'day_of_week': day_of_week,
-            'day_of_month': day_of_month,
-            'month': month,
-            'time_slot': time_slot,
-            'avg_recent_duration': avg_recent_duration,
-            'total_queue_length': total_queue_length,
-            'patients_at_current_stage': patients_at_current_stage,
-            'staff_at_current_stage': staff_at_current_stage,
-            'patients_waiting_checkin': patients_waiting_checkin,
-            'patient_age': patient_age,
-            'patient_priority': patient_priority,
-            'patient_no_show_rate': patient_no_show_rate,
-            'doctor_experience': doctor_experience,
-            'traffic_level': traffic,
-            'hospital_occupancy': occupancy,
-            'actual_wait_time': actual_wait_time,
-            'variance': variance
-        })
-    
-    return pd.DataFrame(data)
+        avg_recent_duration = rng.uniform(5, 25, n)
+        doctor_experience = rng.integers(1, 31, n)
+    day_of_week, day_of_month, month = _calendar(days_offset)
+
+    # Stage-specific waiting
+    patients_waiting_checkin = rng.integers(0, 6, n)
+    patients_waiting_triage = _uniform_int(rng, 0, total_queue_length // 3)
+    patients_waiting_consultation = _uniform_int(rng, 0, total_queue_length // 2)
+    patients_waiting_payment = rng.integers(0, 4, n)
+
+    # Staff serving each stage
+    staff_checkin = rng.integers(1, 4, n)
+    staff_triage = rng.integers(1, 3, n)
+    staff_consultation = rng.integers(1, 6, n)
+    staff_payment = rng.integers(1, 3, n)
+
+    # Current stage for this prediction (simplified to consultation for booking)
+    patients_at_current_stage = patients_waiting_consultation
+    staff_at_current_stage = staff_consultation
+
+    # Patient features
+    patient_age = rng.integers(18, 81, n)
+    patient_priority = PRIORITIES[rng.integers(0, 3, n)]
+    patient_no_show_rate = rng.uniform(0, 0.3, n)
+
+    # External factors
+    traffic = rng.integers(0, 11, n)
+    occupancy = rng.uniform(0.3, 0.9, n)
+
+    # Time-based features
+    slot_index = np.digitize(time_of_day, [12, 17])
+    time_slot = TIME_SLOTS[slot_index]
+
+    # Actual wait time: realistic hospital wait times with temporal effects
+    time_slot_multiplier = np.array([1.0, 1.3, 0.8])[slot_index]  # Afternoon peak, evening slower
+    weekend_multiplier = np.where(day_of_week >= 5, 1.2, 1.0)  # Weekend effects
+
+    base_wait = (5 + total_queue_length * 0.8 + patients_at_current_stage * 1.2 + (5 / np.maximum(staff_at_current_stage, 1))
+                 + patients_waiting_checkin * 0.3 + (18 - time_of_day) * 0.3 + patient_age * 0.05
+                 + (patient_priority == 'urgent') * 3 + doctor_experience * -0.1 + traffic * 0.3 + occupancy * 5)
+    base_wait = base_wait * time_slot_multiplier * weekend_multiplier
+    noise = rng.normal(0, 2, n)
+    actual_wait_time = np.maximum(0, base_wait + noise)
+
+    # Variance: realistic uncertainty
+    variance = 0.5 + total_queue_length * 0.15 + patients_at_current_stage * 0.25 + traffic * 0.05 + rng.uniform(0, 1, n)
+
+    return pd.DataFrame({
+        'doctor_id': doctor_id,
+        'time_of_day': time_of_day,
+        'day_of_week': day_of_week,
+        'day_of_month': day_of_month,
+        'month': month,
+        'time_slot': time_slot,
+        'avg_recent_duration': avg_recent_duration,
+        'total_queue_length': total_queue_length,
+        'patients_at_current_stage': patients_at_current_stage,
+        'staff_at_current_stage': staff_at_current_stage,
+        'patients_waiting_checkin': patients_waiting_checkin,
+        'patient_age': patient_age,
+        'patient_priority': patient_priority,
+        'patient_no_show_rate': patient_no_show_rate,
+        'doctor_experience': doctor_experience,
+        'traffic_level': traffic,
+        'hospital_occupancy': occupancy,
+        'actual_wait_time': actual_wait_time,
+        'variance': variance
+    })
+
+def write_synthetic_data(path, num_samples, chunk_size=1_000_000, seed=None, arrivals=False):
+    """Generate `num_samples` rows chunk by chunk, so memory stays bounded by `chunk_size`.
+
+    A path ending in .csv is appended to chunk by chunk; any other path is a
+    directory of memory-mapped .npy columns (see columnar_store). Each chunk
+    draws from its own child of `seed`, so output is reproducible for a
+    given seed and chunk size.
+    """
+    n_chunks = max(1, int(np.ceil(num_samples / chunk_size)))
+    child_seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    columns = None if path.endswith('.csv') else open_columns(path, COLUMN_SCHEMA, num_samples)
+
+    for i, child_seed in enumerate(child_seeds):
+        start = i * chunk_size
+        size = min(chunk_size, num_samples - start)
+        df = generate_synthetic_data(size, arrivals=arrivals, rng=np.random.default_rng(child_seed))
+        if columns is None:
+            df.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+        else:
+            for name, column in columns.items():
+                column[start:start + size] = df[name].to_numpy()
+
+    if columns is not None:
+        for column in columns.values():
+            column.flush()
+        write_schema(path, COLUMN_SCHEMA, num_samples)
 
 if __name__ == "__main__":
-    df = generate_synthetic_data(1000)
-    df.to_csv('../data/historical_wait_times.csv', index=False)
-    print("Generated 1000 synthetic samples.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Generate synthetic wait time training data')
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=1_000_000, help='Rows generated and written per chunk')
+    parser.add_argument('--arrivals', action='store_true', help='Emit per-doctor, per-day arrival sequences instead of i.i.d. rows')
+    parser.add_argument('--output', default='../data/historical_wait_times.csv', help='.csv file or directory for .npy columns')
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_synthetic_data(args.output, args.samples, args.chunk_size, args.seed, args.arrivals)
+    print(f"Generated {args.samples} synthetic samples.")
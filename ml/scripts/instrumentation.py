@@ -0,0 +1,231 @@
+"""
+Counters, per-stage timers and optional profiling for the predictors.
+
+    from instrumentation import METRICS
+    with METRICS.stage('forest_traversal'):
+        ...
+    METRICS.increment('requests_total')
+
+Stage timings are kept as count/sum/max plus cumulative histogram buckets,
+so a long-lived process can be scraped as Prometheus text or JSON. One-shot
+CLI processes can append their metrics to a JSON-lines file on exit
+(MEDIQUEUE_METRICS_LOG).
+
+Profiling is off unless MEDIQUEUE_PROFILE (or a script's --profile flag)
+names a mode:
+
+- cprofile: cProfile of the main thread, dumped as a .prof file
+- sample:   a sampling profiler over every thread, dumped as folded stacks
+            (flamegraph.pl / speedscope input)
+
+Dumps go to MEDIQUEUE_PROFILE_DIR (default: the system temp directory) on
+exit, and on SIGUSR1 for long-running servers.
+"""
+
+import atexit
+import cProfile
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the stage timing histogram buckets
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+PROFILE_MODES = ('cprofile', 'sample')
+
+
+# Metrics whose lock must be renewed in a forked child: a thread may hold it
+# when another forks (prediction worker restarts)
+_LIVE_METRICS = weakref.WeakSet()
+
+
+def _reset_locks_after_fork():
+    for metrics in _LIVE_METRICS:
+        metrics._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+class Metrics:
+    def __init__(self, namespace='mediqueue', labels=None):
+        self.namespace = namespace
+        self.labels = dict(labels or {})
+        self.counters = Counter()
+        self.timers = {}
+        self._lock = threading.Lock()
+        _LIVE_METRICS.add(self)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            timer = self.timers.get(stage)
+            if timer is None:
+                timer = self.timers[stage] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(BUCKETS)}
+            timer['count'] += 1
+            timer['sum'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    timer['buckets'][i] += 1
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'labels': dict(self.labels),
+                'counters': dict(self.counters),
+                'stages': {
+                    name: {'count': t['count'], 'sum_seconds': t['sum'], 'max_seconds': t['max'],
+                           'mean_seconds': t['sum'] / t['count'] if t['count'] else 0.0}
+                    for name, t in self.timers.items()
+                },
+            }
+
+    def _label_text(self, **extra):
+        labels = {**self.labels, **extra}
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+    def to_prometheus(self, gauges=None):
+        """Prometheus text exposition; `gauges` adds point-in-time values (e.g. cache size)."""
+        ns = self.namespace
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines += [f'# TYPE {ns}_{name} counter', f'{ns}_{name}{self._label_text()} {value}']
+            if self.timers:
+                lines.append(f'# TYPE {ns}_stage_seconds histogram')
+            for stage, t in sorted(self.timers.items()):
+                for bound, count in zip(BUCKETS, t['buckets']):
+                    lines.append(f'{ns}_stage_seconds_bucket{self._label_text(stage=stage, le=bound)} {count}')
+                lines.append(f'{ns}_stage_seconds_bucket{self._label_text(stage=stage, le="+Inf")} {t["count"]}')
+                lines.append(f'{ns}_stage_seconds_sum{self._label_text(stage=stage)} {t["sum"]}')
+                lines.append(f'{ns}_stage_seconds_count{self._label_text(stage=stage)} {t["count"]}')
+        for name, value in sorted((gauges or {}).items()):
+            lines += [f'# TYPE {ns}_{name} gauge', f'{ns}_{name}{self._label_text()} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Raw counters and stage timers, picklable, for merge() into another process's Metrics."""
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'timers': {name: {**t, 'buckets': list(t['buckets'])} for name, t in self.timers.items()},
+            }
+
+    def merge(self, snapshot):
+        """Add another process's snapshot() (e.g. a prediction worker's) to these metrics."""
+        with self._lock:
+            self.counters.update(snapshot['counters'])
+            for stage, other in snapshot['timers'].items():
+                timer = self.timers.get(stage)
+                if timer is None:
+                    self.timers[stage] = {**other, 'buckets': list(other['buckets'])}
+                    continue
+                timer['count'] += other['count']
+                timer['sum'] += other['sum']
+                timer['max'] = max(timer['max'], other['max'])
+                timer['buckets'] = [a + b for a, b in zip(timer['buckets'], other['buckets'])]
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def log_on_exit(self, path):
+        """Append this process's metrics as one JSON line to `path` when it exits."""
+        def write():
+            record = {'timestamp': time.time(), 'pid': os.getpid(), 'argv0': os.path.basename(sys.argv[0]), **self.to_dict()}
+            with open(path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        atexit.register(write)
+
+
+METRICS = Metrics()
+
+if os.environ.get('MEDIQUEUE_METRICS_LOG'):
+    METRICS.log_on_exit(os.environ['MEDIQUEUE_METRICS_LOG'])
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval and counts folded stacks."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def enable_profiling(mode=None, output_dir=None, name=None):
+    """Start profiling per `mode` (default: MEDIQUEUE_PROFILE); returns the dump function or None."""
+    mode = mode or os.environ.get('MEDIQUEUE_PROFILE')
+    if not mode:
+        return None
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode {mode!r}; expected one of {PROFILE_MODES}")
+    output_dir = output_dir or os.environ.get('MEDIQUEUE_PROFILE_DIR') or tempfile.gettempdir()
+    os.makedirs(output_dir, exist_ok=True)
+    name = name or os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+    base = os.path.join(output_dir, f'{name}-{os.getpid()}')
+
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def dump(*_):
+            profiler.dump_stats(f'{base}.prof')
+    else:
+        sampler = SamplingProfiler().start()
+
+        def dump(*_):
+            sampler.dump(f'{base}.folded')
+
+    atexit.register(dump)
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, dump)
+    return dump
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Versioned model bundles with an atomically switched `current` pointer.
+
+    registry/<name>/versions/<version>/   models, feature pipeline, manifest.json
+    registry/<name>/CURRENT               id of the active version
+    registry/<name>/history.json          activations and rollbacks, newest last
+
+A bundle is written into a staging directory and renamed into versions/
+only once it is complete, and a version directory is never modified after
+that. Switching versions is a single os.replace() of CURRENT, so a reader
+that resolves the pointer once and loads from that directory always gets
+models, feature pipeline and schema from the same training run. Long-running
+predictors watch CURRENT and swap in the new version (see prediction_server).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_DIR = os.path.join(SCRIPT_DIR, '..', 'models', 'registry')
+MANIFEST_FILE = 'manifest.json'
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, text):
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class PendingVersion:
+    """A bundle being written; files go into `dir` until publish() moves it into place."""
+
+    def __init__(self, directory, version):
+        self.dir = directory
+        self.version = version
+
+    def path(self, filename):
+        return os.path.join(self.dir, filename)
+
+
+class ModelRegistry:
+    def __init__(self, name, root=REGISTRY_DIR):
+        self.name = name
+        self.dir = os.path.join(root, name)
+        self.versions_dir = os.path.join(self.dir, 'versions')
+        self.pointer_path = os.path.join(self.dir, 'CURRENT')
+        self.history_path = os.path.join(self.dir, 'history.json')
+
+    @contextmanager
+    def publish(self, feature_columns=None, metrics=None, source=None, activate=True, feature_pipeline=None):
+        """Stage a new version; on leaving the block it is sealed and (by default) made current.
+
+            with registry.publish(feature_pipeline=pipeline, metrics=m, source='train_model') as bundle:
+                joblib.dump(model, bundle.path('mean.pkl'))
+
+        A `feature_pipeline` records its columns and schema hash in the
+        manifest. Nothing becomes visible if the block raises.
+        """
+        if feature_pipeline is not None:
+            feature_columns = feature_pipeline.columns
+        created_at = datetime.now(timezone.utc)
+        version = f"{created_at:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        staging_dir = os.path.join(self.dir, f'.staging-{version}')
+        os.makedirs(staging_dir)
+        pending = PendingVersion(staging_dir, version)
+        try:
+            yield pending
+            files = sorted(name for name in os.listdir(staging_dir) if name != MANIFEST_FILE)
+            manifest = {
+                'name': self.name,
+                'version': version,
+                'created_at': created_at.isoformat(),
+                'source': source,
+                'previous': self.current_version(),
+                'feature_columns': list(feature_columns) if feature_columns is not None else None,
+                'feature_schema_hash': feature_pipeline.schema_hash if feature_pipeline is not None else None,
+                'metrics': metrics or {},
+                'files': {name: _sha256(os.path.join(staging_dir, name)) for name in files},
+            }
+            _write_atomic(os.path.join(staging_dir, MANIFEST_FILE), json.dumps(manifest, indent=2))
+            os.makedirs(self.versions_dir, exist_ok=True)
+            os.rename(staging_dir, os.path.join(self.versions_dir, version))
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        pending.dir = os.path.join(self.versions_dir, version)
+        if activate:
+            self.activate(version)
+
+    def versions(self):
+        """Sealed version ids, oldest first."""
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(name for name in os.listdir(self.versions_dir)
+                      if os.path.exists(os.path.join(self.versions_dir, name, MANIFEST_FILE)))
+
+    def current_version(self):
+        try:
+            with open(self.pointer_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def version_dir(self, version=None):
+        """Directory of `version` (default: current); None when the registry is empty."""
+        version = version or self.current_version()
+        return os.path.join(self.versions_dir, version) if version else None
+
+    def path(self, filename, version=None):
+        version_dir = self.version_dir(version)
+        return os.path.join(version_dir, filename) if version_dir else None
+
+    def manifest(self, version=None):
+        version_dir = self.version_dir(version)
+        if version_dir is None:
+            return None
+        with open(os.path.join(version_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+
+    def history(self):
+        try:
+            with open(self.history_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def activate(self, version, rollback=False):
+        if version not in self.versions():
+            raise ValueError(f"Unknown {self.name} model version: {version}")
+        entry = {'version': version, 'activated_at': datetime.now(timezone.utc).isoformat()}
+        if rollback:
+            entry['rollback'] = True
+        history = self.history()
+        history.append(entry)
+        _write_atomic(self.history_path, json.dumps(history, indent=2))
+        _write_atomic(self.pointer_path, version + '\n')
+
+    def activation_stack(self):
+        """Versions that led to the current one, oldest first; a rollback undoes the activations after its version."""
+        stack = []
+        for entry in self.history():
+            version = entry['version']
+            if entry.get('rollback') and version in stack:
+                del stack[stack.index(version) + 1:]
+            elif not stack or stack[-1] != version:
+                stack.append(version)
+        return stack
+
+    def rollback_target(self):
+        """The version rollback() returns to: the latest one, still on disk, active before the current one."""
+        current = self.current_version()
+        available = set(self.versions())
+        stack = self.activation_stack()
+        if stack and stack[-1] == current:
+            stack.pop()
+        earlier = [version for version in stack if version in available and version != current]
+        return earlier[-1] if earlier else None
+
+    def rollback(self, version=None):
+        """Make `version` current again, or by default the version active before the current one.
+
+        Repeated rollbacks keep walking back through the activation history.
+        """
+        if version is None:
+            version = self.rollback_target()
+            if version is None:
+                raise ValueError(f"No earlier {self.name} model version to roll back to")
+        self.activate(version, rollback=True)
+        return version
+
+    def prune(self, keep=10):
+        """Delete all but the newest `keep` versions; the current version and its rollback target are always kept."""
+        protected = {self.current_version(), self.rollback_target()}
+        versions = self.versions()
+        removed = [version for version in versions[:-keep] if version not in protected] if keep > 0 else []
+        for version in removed:
+            shutil.rmtree(os.path.join(self.versions_dir, version))
+        return removed
+
+    def verify(self, version=None):
+        """True when every file of the version still matches its manifest checksum."""
+        manifest = self.manifest(version)
+        version_dir = self.version_dir(version)
+        return all(_sha256(os.path.join(version_dir, name)) == digest for name, digest in manifest['files'].items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect and switch published model versions')
+    parser.add_argument('--name', default='wait_time', help='Model name within the registry')
+    parser.add_argument('--root', default=REGISTRY_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='List versions, marking the current one')
+    show = commands.add_parser('show', help='Print a manifest')
+    show.add_argument('version', nargs='?')
+    activate = commands.add_parser('activate', help='Make a version current')
+    activate.add_argument('version')
+    rollback = commands.add_parser('rollback', help='Return to the previously active version; repeat to go further back')
+    rollback.add_argument('--to', dest='version')
+    prune = commands.add_parser('prune', help='Delete old versions')
+    prune.add_argument('--keep', type=int, default=10)
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.name, args.root)
+    try:
+        if args.command == 'list':
+            current = registry.current_version()
+            for version in registry.versions():
+                metrics = registry.manifest(version)['metrics']
+                print(f"{'*' if version == current else ' '} {version}  {json.dumps(metrics)}")
+        elif args.command == 'show':
+            print(json.dumps(registry.manifest(args.version), indent=2))
+        elif args.command == 'activate':
+            registry.activate(args.version)
+            print(f"{args.name}: {args.version} is now current")
+        elif args.command == 'rollback':
+            print(f"{args.name}: rolled back to {registry.rollback(args.version)}")
+        elif args.command == 'prune':
+            print(f"{args.name}: removed {len(registry.prune(args.keep))} versions")
+    except (ValueError, TypeError, FileNotFoundError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
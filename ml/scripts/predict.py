@@ -1,64 +1,364 @@
-import pandas as pd
-import joblib
-from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
 import numpy as np
+import os
+import socket
 import sys
 import json
-from datetime import datetime
-from scipy.stats import norm
+
+from feature_pipeline import PIPELINE_FILE, WAIT_TIME_FEATURES, load_pipeline
+from instrumentation import METRICS, enable_profiling
+from prediction_cache import quantize
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(SCRIPT_DIR, '..', 'models')
+MODEL_MEAN_PATH = os.path.join(MODELS_DIR, 'wait_time_predictor_mean.pkl')
+MODEL_VARIANCE_PATH = os.path.join(MODELS_DIR, 'wait_time_predictor_variance.pkl')
+SCALER_PATH = os.path.join(MODELS_DIR, 'scaler.pkl')
+COMPILED_MODEL_PATH = os.path.join(MODELS_DIR, 'wait_time_predictor.npz')
+
+# Registry model published by train_model.py and the files in each of its versions.
+# Versions carrying leaf quantiles in the compiled bundle have no variance.pkl.
+MODEL_NAME = 'wait_time'
+BUNDLE_FILES = {
+    'mean': 'mean.pkl',
+    'variance': 'variance.pkl',
+    'pipeline': PIPELINE_FILE,
+    'compiled': 'wait_time_predictor.npz',
+}
+
+# Unix socket served by prediction_server.py
+SOCKET_PATH = os.environ.get('MEDIQUEUE_PREDICTOR_SOCKET', '/tmp/mediqueue_predictor.sock')
+
+# Cache quantization step per feature column; None keeps the exact value
+FEATURE_QUANTA = [{'hospital_occupancy': 0.01, 'time_of_day': 5 / 60}.get(column) for column in WAIT_TIME_FEATURES.columns]
+
+REQUEST_FIELDS = ['total_queue_length', 'patients_at_current_stage', 'staff_at_current_stage', 'hospital_occupancy', 'patient_age', 'traffic_level', 'doctor_experience', 'slot_time']
 
 class WaitTimePredictor:
-    def __init__(self, model_mean_path, model_variance_path, scaler_path):
+    def __init__(self, model_mean_path, model_variance_path, pipeline_path):
+        # Imported here so the thin client never pays for sklearn/joblib
+        import joblib
+        self.pipeline = load_pipeline(pipeline_path, default=WAIT_TIME_FEATURES)
+        WAIT_TIME_FEATURES.check(self.pipeline, f"Feature pipeline {pipeline_path}")
         self.model_mean = joblib.load(model_mean_path)
-        self.model_variance = joblib.load(model_variance_path)
-        self.scaler = joblib.load(scaler_path)
+        # Versions published since the leaf quantiles replaced the variance forest have no variance.pkl
+        self.model_variance = joblib.load(model_variance_path) if model_variance_path and os.path.exists(model_variance_path) else None
+
+    def predict(self, features):
+        mean_predictions, variance_predictions = self.predict_batch([features])
+        return mean_predictions[0], variance_predictions[0]
+
+    def predict_batch(self, feature_matrix):
+        # One scaler pass and one traversal per forest for all rows
+        with METRICS.stage('scaler_transform'):
+            features_scaled = self.pipeline.transform(feature_matrix)
+        with METRICS.stage('forest_traversal'):
+            if self.model_variance is not None:
+                return self.model_mean.predict(features_scaled), self.model_variance.predict(features_scaled)
+            # Without a variance forest, the spread of the trees' predictions
+            per_tree = np.stack([tree.predict(features_scaled) for tree in self.model_mean.estimators_])
+        return per_tree.mean(axis=0), per_tree.var(axis=0)
+
+class CachedPredictor:
+    """Serves repeated, quantized feature vectors from a PredictionCache.
+
+    `loader` builds the underlying predictor; it is called again whenever the
+    cache sees the model files change, so a retrain is picked up live.
+    """
+    def __init__(self, loader, cache):
+        self.loader = loader
+        self.cache = cache
+        self.predictor = loader()
+        cache.on_invalidate(self.reload)
+
+    def reload(self):
+        # Requests already running keep the predictor object they started with
+        try:
+            self.predictor = self.loader()
+        except Exception as e:
+            print(f"Model reload failed, keeping previous models: {e}", file=sys.stderr)
+            return
+        # Drop anything the old models cached while the new ones were loading
+        self.cache.clear()
+
+    @property
+    def has_quantiles(self):
+        return getattr(self.predictor, 'has_quantiles', False)
 
     def predict(self, features):
-        features_scaled = self.scaler.transform([features])
-        mean_prediction = self.model_mean.predict(features_scaled)[0]
-        variance_prediction = self.model_variance.predict(features_scaled)[0]
-        return mean_prediction, variance_prediction
+        key = quantize(features, FEATURE_QUANTA)
+        return self.cache.get_or_compute(key, lambda: self.predictor.predict(list(key)))
+
+    def _cached(self, keys, compute):
+        results = [self.cache.get(key) for key in keys]
+        # Predict each distinct missing key once, in a single batch
+        missing = list(dict.fromkeys(key for key, result in zip(keys, results) if result is None))
+        if missing:
+            computed = dict(zip(missing, compute(missing)))
+            for key, value in computed.items():
+                self.cache.put(key, value)
+            results = [computed[key] if result is None else result for key, result in zip(keys, results)]
+        return results
+
+    def predict_batch(self, feature_matrix):
+        keys = [quantize(row, FEATURE_QUANTA) for row in feature_matrix]
+        results = self._cached(keys, lambda missing: zip(*self.predictor.predict_batch(np.array(missing, dtype=float))))
+        means, variances = zip(*results) if results else ((), ())
+        return np.array(means, dtype=float), np.array(variances, dtype=float)
+
+    def predict_distribution(self, feature_matrix, thresholds=(30,)):
+        from compiled_forest import QUANTILE_LEVELS
+        thresholds = tuple(float(threshold) for threshold in thresholds)
+        # Distributions are cached apart from predict_batch's (mean, variance) pairs
+        keys = [(thresholds, quantize(row, FEATURE_QUANTA)) for row in feature_matrix]
+
+        def compute(missing):
+            result = self.predictor.predict_distribution(np.array([row for _, row in missing], dtype=float), thresholds=thresholds)
+            return zip(result['mean'], result['variance'], result['quantiles'], result['exceedance'])
 
-def prepare_features(total_queue_length, patients_at_current_stage, staff_at_current_stage, hospital_occupancy, patient_age, traffic_level, doctor_experience, time_of_day, day_of_week, time_slot):
-    # Include temporal features
-    time_slot_encoded = {'morning': 0, 'afternoon': 1, 'evening': 2}[time_slot]
-    features = [total_queue_length, patients_at_current_stage, staff_at_current_stage, hospital_occupancy, patient_age, traffic_level, doctor_experience, time_of_day, day_of_week, time_slot_encoded]
-    return features
+        results = self._cached(keys, compute)
+        if not results:
+            return self.predictor.predict_distribution(np.empty((0, len(FEATURE_QUANTA))), thresholds=thresholds)
+        means, variances, quantiles, exceedance = zip(*results)
+        return {
+            'mean': np.array(means, dtype=float), 'variance': np.array(variances, dtype=float),
+            'quantiles': np.array(quantiles, dtype=float), 'exceedance': np.array(exceedance, dtype=float),
+            'levels': QUANTILE_LEVELS,
+        }
+
+def resolve_model_paths():
+    """Files of the current registry version, or the unversioned files from before the registry."""
+    from model_registry import ModelRegistry
+    version_dir = ModelRegistry(MODEL_NAME).version_dir()
+    if version_dir is None:
+        return COMPILED_MODEL_PATH, MODEL_MEAN_PATH, MODEL_VARIANCE_PATH, SCALER_PATH
+    return tuple(os.path.join(version_dir, BUNDLE_FILES[key]) for key in ('compiled', 'mean', 'variance', 'pipeline'))
+
+def load_predictor(compiled_path=None, model_mean_path=None, model_variance_path=None, pipeline_path=None):
+    """Load the models; raises ValueError when they were built for other features than WAIT_TIME_FEATURES.
+
+    `pipeline_path` is a feature_pipeline.json, or a scaler pickle from before the pipeline existed.
+    """
+    paths = [compiled_path, model_mean_path, model_variance_path, pipeline_path]
+    if None in paths:
+        # Explicit pickles are loaded as given rather than shadowed by the current version's bundle
+        if compiled_path is None and any(paths[1:]):
+            paths[0] = ''
+        # Each unset path comes from the current registry version; a mismatched pipeline is rejected on load
+        paths = [default if path is None else path for path, default in zip(paths, resolve_model_paths())]
+    compiled_path, model_mean_path, model_variance_path, pipeline_path = paths
+    METRICS.increment('model_loads_total')
+    with METRICS.stage('model_load'):
+        # Prefer the memory-mapped compiled bundle; it avoids importing sklearn
+        if compiled_path and os.path.exists(compiled_path):
+            from compiled_forest import CompiledWaitTimePredictor
+            return CompiledWaitTimePredictor(compiled_path, pipeline=WAIT_TIME_FEATURES)
+        return WaitTimePredictor(model_mean_path, model_variance_path, pipeline_path)
 
 def calculate_tail_risk(mean, variance, threshold=30):
+    # scipy.special is a fraction of scipy.stats' import cost
+    from scipy.special import ndtr
     # Assuming normal distribution, P(wait > threshold)
     std = np.sqrt(variance)
-    return 1 - norm.cdf(threshold, mean, std)
+    if np.ndim(threshold) > 0:
+        # One column per threshold: (n,) means x (k,) thresholds -> (n, k)
+        mean = np.expand_dims(np.asarray(mean, dtype=float), -1)
+        std = np.expand_dims(np.asarray(std, dtype=float), -1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return ndtr((mean - np.asarray(threshold, dtype=float)) / std)
+
+# Inputs a request may leave to the external factors ingestor (external_factors.py)
+INGESTED_FIELDS = ('hospital_occupancy', 'traffic_level')
+
+def parse_request(request):
+    """Coerce a request dict (CLI args or JSON line) into typed prediction inputs.
+
+    Missing hospital_occupancy / traffic_level are taken from the ingestor's latest values.
+    """
+    if any(request.get(field) is None for field in INGESTED_FIELDS):
+        from external_factors import LATEST_FACTORS
+        latest = LATEST_FACTORS.get()
+        request = {**{field: latest.get(field) for field in INGESTED_FIELDS}, **{k: v for k, v in request.items() if v is not None}}
+        missing = [field for field in INGESTED_FIELDS if request.get(field) is None]
+        if missing:
+            raise KeyError(f"{', '.join(missing)} (not in the request and no recent ingested value)")
+    return {
+        'total_queue_length': int(request['total_queue_length']),
+        'patients_at_current_stage': int(request['patients_at_current_stage']),
+        'staff_at_current_stage': int(request['staff_at_current_stage']),
+        'hospital_occupancy': float(request['hospital_occupancy']),
+        'patient_age': int(request['patient_age']),
+        'traffic_level': int(float(request['traffic_level'])),
+        'doctor_experience': int(request['doctor_experience']),
+        'slot_time': str(request['slot_time']),
+    }
+
+def quantile_name(level):
+    return f'p{round(level * 100)}'
+
+def predict_request(predictor, request):
+    """Run one prediction for a request dict and return the JSON-ready result.
+
+    Models with leaf quantiles also return p5/p50/p90/p95, and their tail risk
+    is read from the predicted distribution instead of a normal approximation.
+    """
+    METRICS.increment('predictions_total')
+    with METRICS.stage('features'):
+        features = WAIT_TIME_FEATURES.row(parse_request(request))
+    if getattr(predictor, 'has_quantiles', False):
+        distribution = predictor.predict_distribution(np.array([features], dtype=float))
+        result = {'mean': float(distribution['mean'][0]), 'variance': float(distribution['variance'][0]),
+                  'tail_risk': float(distribution['exceedance'][0, 0])}
+        for level, value in zip(distribution['levels'], distribution['quantiles'][0]):
+            result[quantile_name(level)] = float(value)
+        return result
+    mean, variance = predictor.predict(features)
+    with METRICS.stage('tail_risk'):
+        tail_risk = calculate_tail_risk(mean, variance)
+    return {'mean': float(mean), 'variance': float(variance), 'tail_risk': float(tail_risk)}
+
+def predict_requests(predictor, requests):
+    """Predict many request dicts in one batch, with predict_request's result for each.
+
+    A request that does not parse gets an {'error': ...} result; the others are still predicted.
+    """
+    results = [None] * len(requests)
+    features, valid = [], []
+    with METRICS.stage('features'):
+        for i, request in enumerate(requests):
+            try:
+                features.append(WAIT_TIME_FEATURES.row(parse_request(request)))
+                valid.append(i)
+            except (KeyError, TypeError, ValueError) as e:
+                results[i] = {'error': f'Invalid request: {e}'}
+    if not valid:
+        return results
+    METRICS.increment('predictions_total', len(valid))
+    feature_matrix = np.array(features, dtype=float)
+    if getattr(predictor, 'has_quantiles', False):
+        distribution = predictor.predict_distribution(feature_matrix)
+        for k, i in enumerate(valid):
+            results[i] = {'mean': float(distribution['mean'][k]), 'variance': float(distribution['variance'][k]),
+                          'tail_risk': float(distribution['exceedance'][k, 0])}
+            for level, value in zip(distribution['levels'], distribution['quantiles'][k]):
+                results[i][quantile_name(level)] = float(value)
+        return results
+    mean, variance = predictor.predict_batch(feature_matrix)
+    with METRICS.stage('tail_risk'):
+        tail_risk = calculate_tail_risk(mean, variance)
+    for k, i in enumerate(valid):
+        results[i] = {'mean': float(mean[k]), 'variance': float(variance[k]), 'tail_risk': float(tail_risk[k])}
+    return results
+
+def fallback_prediction(total_queue_length):
+    """Queue-length heuristic for when the models cannot answer; same numbers as BookingController.getFallbackPrediction."""
+    queue_length = int(float(total_queue_length))
+    if queue_length == 0:
+        return {'mean': 5, 'variance': 4, 'tail_risk': 0.05}
+    # ~5 min check-in, then ~10 min per patient ahead
+    mean = 5 + queue_length * 10
+    std = 3 + queue_length * 2
+    threshold = 30
+    z_score = (threshold - mean) / std
+    tail_risk = 0.5 + abs(z_score) * 0.15 if z_score < 0 else max(0.05, 0.5 - z_score * 0.15)
+    # int(x + 0.5) rounds halves up, as Math.round does
+    return {'mean': mean, 'variance': std ** 2, 'tail_risk': min(0.95, max(0.05, int(tail_risk * 100 + 0.5) / 100))}
+
+def predict_batch_frame(predictor, rows, thresholds=(30,)):
+    """Predict every row of a batch; returns a DataFrame with one tail risk column per threshold (and p5/p50/p90/p95 columns with leaf quantiles)."""
+    import pandas as pd
+    METRICS.increment('batch_rows_total', len(rows))
+    with METRICS.stage('features'):
+        # `rows` holds slot_time or the derived time_of_day/day_of_week columns, plus the request fields
+        feature_matrix = WAIT_TIME_FEATURES.matrix(rows)
+    if getattr(predictor, 'has_quantiles', False):
+        distribution = predictor.predict_distribution(feature_matrix, thresholds)
+        result = pd.DataFrame({'mean': distribution['mean'], 'variance': distribution['variance']})
+        for i, level in enumerate(distribution['levels']):
+            result[quantile_name(level)] = distribution['quantiles'][:, i]
+        tail_risk = distribution['exceedance']
+    else:
+        mean, variance = predictor.predict_batch(feature_matrix)
+        with METRICS.stage('tail_risk'):
+            tail_risk = calculate_tail_risk(mean, variance, np.asarray(thresholds, dtype=float))
+        result = pd.DataFrame({'mean': mean, 'variance': variance})
+    for i, threshold in enumerate(thresholds):
+        result[f'tail_risk_{threshold:g}'] = tail_risk[:, i]
+    return result
+
+def load_batch_rows(path):
+    import pandas as pd
+    if path == '-':
+        return pd.read_json(sys.stdin, lines=True)
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jsonl', '.json', '.ndjson'):
+        return pd.read_json(path, lines=True)
+    if extension == '.csv':
+        return pd.read_csv(path)
+    if extension in ('.arrow', '.feather'):
+        # Requires pyarrow
+        return pd.read_feather(path)
+    raise ValueError(f"Unsupported batch input format: {path}")
+
+def batch_main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog='predict.py --batch', description='Predict wait times for many rows in one pass')
+    parser.add_argument('--batch', required=True, metavar='INPUT', help="JSON lines, CSV or Arrow file of feature rows ('-' for JSON lines on stdin)")
+    parser.add_argument('--threshold', nargs='+', type=float, default=[30], help='SLA thresholds in minutes for tail risk')
+    parser.add_argument('--output', default='-', help="Output path (.csv or JSON lines); '-' for stdout")
+    args = parser.parse_args(argv)
+
+    rows = load_batch_rows(args.batch)
+    predictor = load_predictor()
+    result = predict_batch_frame(predictor, rows, args.threshold)
+
+    if args.output == '-':
+        result.to_json(sys.stdout, orient='records', lines=True)
+    elif args.output.lower().endswith('.csv'):
+        result.to_csv(args.output, index=False)
+    else:
+        result.to_json(args.output, orient='records', lines=True)
+
+def request_prediction(request, socket_path=SOCKET_PATH, timeout=5.0):
+    """Send one request to a running prediction server.
+
+    Returns the decoded response, or None when no server is listening so the
+    caller can fall back to loading the models in-process.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall((json.dumps(request) + '\n').encode())
+            with sock.makefile('r') as reader:
+                line = reader.readline()
+    except (FileNotFoundError, ConnectionRefusedError, socket.timeout, OSError):
+        return None
+    if not line:
+        return None
+    response = json.loads(line)
+    response.pop('id', None)
+    return response
 
 if __name__ == "__main__":
+    METRICS.labels['predictor'] = 'forest'
+    # MEDIQUEUE_PROFILE=cprofile|sample dumps a profile of this run (see instrumentation)
+    enable_profiling()
+
+    if len(sys.argv) > 1 and sys.argv[1].startswith('--batch'):
+        batch_main(sys.argv[1:])
+        sys.exit(0)
+
     if len(sys.argv) < 9:
         print("Usage: python predict.py <total_queue_length> <patients_at_current_stage> <staff_at_current_stage> <hospital_occupancy> <patient_age> <traffic_level> <doctor_experience> <slot_time>")
         sys.exit(1)
-    
-    total_queue_length = int(sys.argv[1])
-    patients_at_current_stage = int(sys.argv[2])
-    staff_at_current_stage = int(sys.argv[3])
-    hospital_occupancy = float(sys.argv[4])
-    patient_age = int(sys.argv[5])
-    traffic_level = int(sys.argv[6])
-    doctor_experience = int(sys.argv[7])
-    slot_time_str = sys.argv[8]
-    
-    # Calculate temporal features from slot_time
-    dt = datetime.fromisoformat(slot_time_str.replace('Z', '+00:00'))
-    time_of_day = dt.hour + dt.minute / 60
-    day_of_week = dt.weekday()
-    time_slot = 'morning' if time_of_day < 12 else 'afternoon' if time_of_day < 17 else 'evening'
-    
-    model_mean_path = '../models/wait_time_predictor_mean.pkl'
-    model_variance_path = '../models/wait_time_predictor_variance.pkl'
-    scaler_path = '../models/scaler.pkl'
-    
-    predictor = WaitTimePredictor(model_mean_path, model_variance_path, scaler_path)
-    features = prepare_features(total_queue_length, patients_at_current_stage, staff_at_current_stage, hospital_occupancy, patient_age, traffic_level, doctor_experience, time_of_day, day_of_week, time_slot)
-    mean, variance = predictor.predict(features)
-    tail_risk = calculate_tail_risk(mean, variance)
-    
-    print(json.dumps({'mean': mean, 'variance': variance, 'tail_risk': tail_risk}))
\ No newline at end of file
+
+    request = dict(zip(REQUEST_FIELDS, sys.argv[1:9]))
+
+    # Prefer the long-lived server; only load the models here if it is not running
+    result = request_prediction(request)
+    if result is None or 'error' in result:
+        METRICS.increment('server_unavailable_total' if result is None else 'server_errors_total')
+        predictor = load_predictor()
+        result = predict_request(predictor, request)
+
+    print(json.dumps(result))
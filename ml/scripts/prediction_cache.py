@@ -0,0 +1,147 @@
+"""
+LRU + TTL cache for wait time predictions.
+
+Keys are quantized feature vectors, so patients refreshing the queue display
+within the same few minutes share one entry. The cache can watch the model
+files on disk: when a retrain replaces them, every entry is dropped and the
+registered invalidation hooks fire (e.g. to reload the predictor).
+"""
+
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+_MISSING = object()
+
+# Caches whose lock must be renewed in a forked child (another thread may have held it at the fork)
+_LIVE_CACHES = weakref.WeakSet()
+
+
+def _reset_locks_after_fork():
+    for cache in _LIVE_CACHES:
+        cache._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+def quantize(values, steps):
+    """Round each value to its step (None or 0 leaves it unchanged) and return a hashable key."""
+    quantized = []
+    for value, step in zip(values, steps):
+        if step:
+            value = round(round(float(value) / step) * step, 6)
+        quantized.append(value)
+    return tuple(quantized)
+
+
+class PredictionCache:
+    def __init__(self, maxsize=4096, ttl=60.0, watch_paths=(), check_interval=1.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.watch_paths = list(watch_paths)
+        self.check_interval = check_interval
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hooks = []
+        self._signature = self._source_signature()
+        self._last_check = self.clock()
+        _LIVE_CACHES.add(self)
+
+    def _source_signature(self):
+        signature = []
+        for path in self.watch_paths:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def on_invalidate(self, hook):
+        """Register a callable run (without arguments) after every invalidation."""
+        self._hooks.append(hook)
+
+    def clear(self):
+        """Drop every entry without counting an invalidation or running the hooks."""
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+        for hook in self._hooks:
+            hook()
+
+    def check_sources(self, force=False):
+        """Invalidate if any watched model file changed since the last check."""
+        now = self.clock()
+        if not self.watch_paths or (not force and now - self._last_check < self.check_interval):
+            return False
+        self._last_check = now
+        signature = self._source_signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        self.invalidate()
+        return True
+
+    def get(self, key, default=None):
+        self.check_sources()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def reset_stats(self):
+        """Zero the counters, e.g. in a forked worker that should report only its own lookups."""
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Long-lived wait time prediction server.
+
+Loads WaitTimePredictor once and answers JSON-lines requests, either over a
+Unix socket (one thread per connection) or over stdin/stdout for a parent
+process that keeps the server as a child. With --workers N the socket server
+predicts in N forked processes (see worker_pool), answering with the
+queue-length heuristic, marked "degraded", when they fall behind.
+
+Request:  {"id": 1, "total_queue_length": 8, ..., "slot_time": "2026-01-17T14:00:00Z"}
+Response: {"id": 1, "mean": 21.4, "variance": 3.2, "tail_risk": 0.01}
+
+Control ops: {"op": "ping"}, {"op": "stats"} and {"op": "metrics", "format": "json" | "prometheus"}.
+"""
+
+import argparse
+import json
+import os
+import socketserver
+import sys
+from functools import partial
+
+from instrumentation import METRICS, PROFILE_MODES, enable_profiling
+from model_registry import ModelRegistry
+from prediction_cache import PredictionCache
+from predict import (
+    CachedPredictor,
+    MODEL_NAME,
+    SOCKET_PATH,
+    load_predictor,
+    predict_request,
+)
+
+
+def handle_line(predictor, line, pool=None):
+    """Decode one request line and return the encoded response line; predictions go to `pool` when given."""
+    request_id = None
+    try:
+        request = json.loads(line)
+        request_id = request.get('id')
+        if request.get('op') == 'ping':
+            response = {'status': 'ok'}
+        elif request.get('op') == 'stats':
+            response = {'cache': cache_stats(predictor, pool), 'model_version': ModelRegistry(MODEL_NAME).current_version()}
+            if pool is not None:
+                response['pool'] = pool.stats()
+        elif request.get('op') == 'metrics':
+            response = metrics_response(predictor, request.get('format', 'json'), pool)
+        else:
+            METRICS.increment('requests_total')
+            with METRICS.stage('request'):
+                response = pool.predict(request) if pool is not None else predict_request(predictor, request)
+    except Exception as e:
+        METRICS.increment('request_errors_total')
+        response = {'error': str(e)}
+    response['id'] = request_id
+    return json.dumps(response) + '\n'
+
+
+def cache_stats(predictor, pool=None):
+    """Statistics of the cache that answers predictions: the workers' when they predict."""
+    if pool is not None:
+        return pool.cache_stats()
+    cache = getattr(predictor, 'cache', None)
+    return cache.stats() if cache else None
+
+
+def metrics_response(predictor, fmt='json', pool=None):
+    """Counters, stage timings and cache statistics, as JSON or Prometheus text; workers' included."""
+    stats = cache_stats(predictor, pool) or {}
+    metrics = pool.metrics() if pool is not None else METRICS
+    if fmt == 'prometheus':
+        gauges = {f'cache_{name}': value for name, value in stats.items() if isinstance(value, (int, float))}
+        return {'prometheus': metrics.to_prometheus(gauges)}
+    return {'metrics': metrics.to_dict(), 'cache': stats or None}
+
+
+class PredictionRequestHandler(socketserver.StreamRequestHandler):
+    """Serves every request line on one connection until the client closes it."""
+
+    def handle(self):
+        for raw in self.rfile:
+            line = raw.decode().strip()
+            if not line:
+                continue
+            self.wfile.write(handle_line(self.server.predictor, line, self.server.pool).encode())
+            self.wfile.flush()
+
+
+class PredictionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # listen() backlog; the default of 5 refuses connections during a burst of bookings
+    request_queue_size = 128
+
+    def __init__(self, socket_path, predictor, pool=None):
+        self.predictor = predictor
+        self.pool = pool
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, PredictionRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def serve_stdio(predictor, stdin=sys.stdin, stdout=sys.stdout):
+    """Answer requests from stdin in order, one response line per request line."""
+    for raw in stdin:
+        line = raw.strip()
+        if not line:
+            continue
+        stdout.write(handle_line(predictor, line))
+        stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve wait time predictions from preloaded models')
+    parser.add_argument('--socket', default=SOCKET_PATH, help='Unix socket path to listen on')
+    parser.add_argument('--stdio', action='store_true', help='Serve JSON lines over stdin/stdout instead of a socket')
+    parser.add_argument('--compiled', help="Compiled .npz bundle (default: the current registry version's); pass '' to load the pickles instead")
+    parser.add_argument('--model-mean', help="Mean model pickle (default: the current registry version's)")
+    parser.add_argument('--model-variance', help="Variance model pickle (default: the current registry version's)")
+    parser.add_argument('--pipeline', help="Feature pipeline JSON or legacy scaler pickle (default: the current registry version's)")
+    parser.add_argument('--cache-size', type=int, default=4096, help='Max cached predictions; 0 disables caching but still follows model changes')
+    parser.add_argument('--cache-ttl', type=float, default=60.0, help='Seconds a cached prediction stays valid')
+    parser.add_argument('--workers', type=int, default=0, help='Predict in this many forked worker processes; 0 predicts in the server process')
+    parser.add_argument('--max-pending', type=int, default=256, help='Requests queued for the workers before new ones get the fallback estimate')
+    parser.add_argument('--timeout', type=float, default=1.0, help='Seconds to wait for a worker before answering with the fallback estimate')
+    parser.add_argument('--max-batch', type=int, default=64, help='Most requests a worker predicts in one batch')
+    parser.add_argument('--batch-wait', type=float, default=0.0, help='Seconds a batch waits for more requests once it has one; 0 takes only those already queued')
+    parser.add_argument('--profile', choices=PROFILE_MODES, help='Profile the server (default: MEDIQUEUE_PROFILE); dumped on exit and on SIGUSR1')
+    args = parser.parse_args()
+    if args.workers and args.stdio:
+        parser.error('--workers needs the socket server; --stdio answers one request at a time')
+
+    METRICS.labels['predictor'] = 'forest'
+    enable_profiling(args.profile)
+
+    loader = partial(load_predictor, args.compiled, args.model_mean, args.model_variance, args.pipeline)
+    # A newly published (or rolled back) registry version, or changed explicit model files,
+    # drop the cache and swap the models in without a restart
+    model_paths = [ModelRegistry(MODEL_NAME).pointer_path]
+    model_paths += [path for path in (args.compiled, args.model_mean, args.model_variance, args.pipeline) if path]
+    cache = PredictionCache(max(args.cache_size, 0), args.cache_ttl, watch_paths=model_paths)
+    predictor = CachedPredictor(loader, cache)
+
+    if args.stdio:
+        serve_stdio(predictor)
+        return
+
+    pool = None
+    if args.workers:
+        from worker_pool import PredictionPool
+        # Forked after the models are loaded, so every worker shares them
+        pool = PredictionPool(predictor, args.workers, args.max_pending, args.timeout, args.max_batch, args.batch_wait)
+    server = PredictionServer(args.socket, predictor, pool)
+    print(f"Prediction server listening on {args.socket}" + (f" with {args.workers} workers" if pool else ''), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if pool is not None:
+            pool.close()
+
+
+if __name__ == '__main__':
+    main()
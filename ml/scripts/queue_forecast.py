@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Hospital-wide wait forecasts for every queue, precomputed in bulk.
+
+Each run reads every active queue row in one query, forecasts the wait of
+every patient in every queue (queue type x doctor) in one vectorized pass
+and writes the results back in one transaction: queue.estimated_wait per
+patient and one queue_forecasts row per queue. Display reads are then
+plain lookups and never start an ML process.
+
+A patient waits for the remaining service of everyone ahead of them in the
+same queue, shared over the queue's servers: an exclusive cumulative sum
+within each queue of the snapshot sorted by queue and position.
+
+Transfers between queue types (queue.transferred_from) are learned from
+consecutive snapshots. A row that disappears is an exit from its queue
+type, and a new row pointing back at it makes that exit a transfer. The
+resulting matrix turns the patients expected to finish upstream within the
+horizon into expected arrivals downstream. Each queue's projected wait at
+the horizon includes them.
+
+    python queue_forecast.py                 # one run
+    python queue_forecast.py --interval 30   # every 30 s until stopped
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from atomic_file import atomic_open
+from instrumentation import METRICS
+from queue_stages import DEFAULT_DURATION, FINISHED_STAGES, IN_SERVICE_STAGE, remaining_minutes
+
+TRANSFER_STATS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models', 'transfer_stats.json')
+
+# Pseudo-exits added to every queue type, so a few early transfers do not read as certainties
+TRANSFER_PRIOR = 1.0
+
+SNAPSHOT_QUERY = """
+    SELECT id, COALESCE(queue_type_id, 1), COALESCE(doctor_id, 0), position,
+           COALESCE(stage, 'waiting'), COALESCE(estimated_duration, ?),
+           stage_start_time, COALESCE(transferred_from, 0)
+    FROM queue
+    """
+
+# Same table as database/migrations/001_initial_schema.sql, for databases created before it
+FORECAST_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS queue_forecasts (
+        queue_type_id INTEGER NOT NULL,
+        doctor_id INTEGER,
+        waiting INTEGER NOT NULL,
+        in_service INTEGER NOT NULL,
+        servers INTEGER NOT NULL,
+        load_minutes REAL NOT NULL,
+        next_wait_minutes REAL NOT NULL,
+        expected_transfers_in REAL NOT NULL,
+        projected_wait_minutes REAL NOT NULL,
+        horizon_minutes REAL NOT NULL,
+        updated_at TEXT NOT NULL,
+        FOREIGN KEY (queue_type_id) REFERENCES queue_types(id),
+        FOREIGN KEY (doctor_id) REFERENCES doctors(id)
+    )
+    """
+
+
+def parse_minutes_since(values, now):
+    """Minutes from each SQLite/ISO 8601 timestamp to `now` (naive UTC); NaN where missing or invalid."""
+    import pandas as pd
+    started = pd.to_datetime(pd.Series(values, dtype=object), utc=True, errors='coerce', format='ISO8601')
+    elapsed = (pd.Timestamp(now, tz='UTC') - started).dt.total_seconds() / 60
+    return elapsed.to_numpy(dtype=float, na_value=np.nan)
+
+
+def load_snapshot(conn):
+    """Every queue row as NumPy columns, from a single query."""
+    rows = conn.execute(SNAPSHOT_QUERY, (DEFAULT_DURATION,)).fetchall()
+    ids, queue_types, doctors, positions, stages, durations, stage_starts, transferred_from = (
+        zip(*rows) if rows else ([],) * 8)
+    return {
+        'id': np.array(ids, dtype=np.int64),
+        'queue_type_id': np.array(queue_types, dtype=np.int64),
+        'doctor_id': np.array(doctors, dtype=np.int64),
+        'position': np.array(positions, dtype=np.int64),
+        'stage': np.array(stages, dtype=object),
+        'estimated_duration': np.array(durations, dtype=np.float64),
+        'stage_start_time': np.array(stage_starts, dtype=object),
+        'transferred_from': np.array(transferred_from, dtype=np.int64),
+    }
+
+
+class TransferStats:
+    """Exit and transfer counts per queue type, learned by diffing consecutive snapshots."""
+
+    def __init__(self, path=TRANSFER_STATS_PATH):
+        self.path = path
+        self.previous_ids = np.array([], dtype=np.int64)
+        self.previous_types = np.array([], dtype=np.int64)
+        # queue_type_id -> rows that left it; "from>to" -> rows that left by transferring
+        self.exits = {}
+        self.transfers = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.previous_ids = np.array(data.get('previous_ids', []), dtype=np.int64)
+            self.previous_types = np.array(data.get('previous_types', []), dtype=np.int64)
+            self.exits = data.get('exits', {})
+            self.transfers = data.get('transfers', {})
+
+    def observe(self, snapshot):
+        """Count the exits and transfers since the previous snapshot, then remember this one."""
+        gone = ~np.isin(self.previous_ids, snapshot['id'])
+        gone_ids, gone_types = self.previous_ids[gone], self.previous_types[gone]
+        for queue_type, count in zip(*np.unique(gone_types, return_counts=True)):
+            self.exits[str(queue_type)] = self.exits.get(str(queue_type), 0) + int(count)
+
+        # New rows created by transferring one of the rows that left
+        new = ~np.isin(snapshot['id'], self.previous_ids) & np.isin(snapshot['transferred_from'], gone_ids)
+        if new.any():
+            order = np.argsort(gone_ids)
+            source = gone_types[order][np.searchsorted(gone_ids[order], snapshot['transferred_from'][new])]
+            for pair in zip(source.tolist(), snapshot['queue_type_id'][new].tolist()):
+                key = f'{pair[0]}>{pair[1]}'
+                self.transfers[key] = self.transfers.get(key, 0) + 1
+
+        self.previous_ids = snapshot['id'].copy()
+        self.previous_types = snapshot['queue_type_id'].copy()
+        return int(gone.sum()), int(new.sum())
+
+    def matrix(self, queue_types):
+        """P[i, j]: chance a patient leaving queue_types[i] joins queue_types[j] next."""
+        index = {int(queue_type): i for i, queue_type in enumerate(queue_types)}
+        counts = np.zeros((len(queue_types), len(queue_types)))
+        for key, count in self.transfers.items():
+            source, target = (int(part) for part in key.split('>'))
+            if source in index and target in index:
+                counts[index[source], index[target]] = count
+        exits = np.array([self.exits.get(str(int(queue_type)), 0) for queue_type in queue_types], dtype=float)
+        return counts / (exits + TRANSFER_PRIOR)[:, None]
+
+    def save(self):
+        data = {
+            'previous_ids': self.previous_ids.tolist(),
+            'previous_types': self.previous_types.tolist(),
+            'exits': self.exits,
+            'transfers': self.transfers,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with atomic_open(self.path) as f:
+            json.dump(data, f)
+
+
+def remaining_service(snapshot, now):
+    """Minutes of service each row still needs: the estimate, less the time already spent in consultation."""
+    in_service = snapshot['stage'] == IN_SERVICE_STAGE
+    elapsed = np.full(len(in_service), np.nan)
+    if in_service.any():
+        elapsed[in_service] = parse_minutes_since(snapshot['stage_start_time'][in_service], now)
+    return remaining_minutes(snapshot['estimated_duration'], snapshot['stage'], elapsed), in_service
+
+
+def forecast(snapshot, now, transfer_matrix=None, transfer_types=(), servers_by_type=None, horizon=60.0):
+    """Wait of every row and a summary of every queue, vectorized over the whole snapshot.
+
+    Returns (ids, waits) in snapshot order and a list of per-queue dicts.
+    `transfer_matrix` is TransferStats.matrix(transfer_types).
+    """
+    servers_by_type = servers_by_type or {}
+    remaining, in_service = remaining_service(snapshot, now)
+    finished = np.isin(snapshot['stage'], FINISHED_STAGES)
+
+    # Sort into queues, each in position order, and find where every queue starts
+    order = np.lexsort((snapshot['id'], snapshot['position'], snapshot['doctor_id'], snapshot['queue_type_id']))
+    queue_type, doctor = snapshot['queue_type_id'][order], snapshot['doctor_id'][order]
+    service = remaining[order]
+    starts_queue = np.r_[True, (queue_type[1:] != queue_type[:-1]) | (doctor[1:] != doctor[:-1])] if len(order) else np.array([], dtype=bool)
+    queue_of = np.cumsum(starts_queue) - 1
+    starts = np.flatnonzero(starts_queue)
+
+    # A doctor's queue has one server; a shared queue (no doctor) has its type's staff count
+    queue_types, queue_doctors = queue_type[starts], doctor[starts]
+    queue_servers = np.array([1 if d else servers_by_type.get(int(t), 1) for t, d in zip(queue_types, queue_doctors)], dtype=float)
+
+    # Exclusive within-queue cumulative sum: the service of everyone ahead
+    total = np.cumsum(service)
+    ahead = total - service
+    ahead -= ahead[starts][queue_of]
+    waits_sorted = ahead / queue_servers[queue_of]
+    # The first `servers` patients of a queue each have a server to themselves
+    rank = np.arange(len(order)) - starts[queue_of]
+    waits_sorted[rank < queue_servers[queue_of]] = 0.0
+    done_at = (ahead + service) / queue_servers[queue_of]
+
+    waits = np.empty_like(waits_sorted)
+    waits[order] = waits_sorted
+
+    n_queues = len(starts)
+    load = np.bincount(queue_of, weights=service, minlength=n_queues)
+    waiting = np.bincount(queue_of, weights=(~in_service[order] & ~finished[order]), minlength=n_queues)
+    serving = np.bincount(queue_of, weights=in_service[order], minlength=n_queues)
+
+    # Expected transfers in: patients finishing upstream within the horizon, times the transfer odds
+    transfers_in = np.zeros(n_queues)
+    extra = []
+    if transfer_matrix is not None and len(transfer_types):
+        type_index = {int(t): i for i, t in enumerate(transfer_types)}
+        finishing = np.zeros(len(transfer_types))
+        known = np.array([int(t) in type_index for t in queue_type], dtype=bool)
+        within = known & (done_at <= horizon)
+        np.add.at(finishing, [type_index[int(t)] for t in queue_type[within]], 1)
+        arrivals = finishing @ transfer_matrix
+        queues_per_type = np.bincount([type_index[int(t)] for t in queue_types if int(t) in type_index], minlength=len(transfer_types))
+        for q, t in enumerate(queue_types):
+            if int(t) in type_index:
+                transfers_in[q] = arrivals[type_index[int(t)]] / queues_per_type[type_index[int(t)]]
+        # Types nobody is queueing for yet still get their expected arrivals
+        for i, t in enumerate(transfer_types):
+            if queues_per_type[i] == 0 and arrivals[i] > 0:
+                extra.append((int(t), arrivals[i]))
+
+    # Mean service time per queue type, for the work the transfers bring in
+    type_duration = {}
+    for t in np.unique(snapshot['queue_type_id']):
+        type_duration[int(t)] = float(snapshot['estimated_duration'][snapshot['queue_type_id'] == t].mean())
+
+    summaries = []
+    for q in range(n_queues):
+        t, servers = int(queue_types[q]), queue_servers[q]
+        incoming_work = transfers_in[q] * type_duration.get(t, DEFAULT_DURATION)
+        summaries.append({
+            'queue_type_id': t,
+            'doctor_id': int(queue_doctors[q]) or None,
+            'waiting': int(waiting[q]),
+            'in_service': int(serving[q]),
+            'servers': int(servers),
+            'load_minutes': float(load[q]),
+            'next_wait_minutes': float(load[q] / servers),
+            'expected_transfers_in': float(transfers_in[q]),
+            # Fluid approximation: work left at the horizon, after the servers have worked through it
+            'projected_wait_minutes': float(max(load[q] + incoming_work - servers * horizon, 0.0) / servers),
+        })
+    for t, arrivals in extra:
+        servers = servers_by_type.get(t, 1)
+        incoming_work = arrivals * type_duration.get(t, DEFAULT_DURATION)
+        summaries.append({
+            'queue_type_id': t, 'doctor_id': None, 'waiting': 0, 'in_service': 0, 'servers': servers,
+            'load_minutes': 0.0, 'next_wait_minutes': 0.0, 'expected_transfers_in': float(arrivals),
+            'projected_wait_minutes': float(max(incoming_work - servers * horizon, 0.0) / servers),
+        })
+    return snapshot['id'], waits, summaries
+
+
+def write_forecasts(conn, ids, waits, summaries, horizon, updated_at):
+    conn.executemany("UPDATE queue SET estimated_wait = ? WHERE id = ?",
+                     zip(np.round(waits, 1).tolist(), ids.tolist()))
+    conn.execute("DELETE FROM queue_forecasts")
+    conn.executemany(
+        """INSERT INTO queue_forecasts (queue_type_id, doctor_id, waiting, in_service, servers, load_minutes,
+                                        next_wait_minutes, expected_transfers_in, projected_wait_minutes,
+                                        horizon_minutes, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        [(s['queue_type_id'], s['doctor_id'], s['waiting'], s['in_service'], s['servers'],
+          round(s['load_minutes'], 1), round(s['next_wait_minutes'], 1), round(s['expected_transfers_in'], 2),
+          round(s['projected_wait_minutes'], 1), horizon, updated_at) for s in summaries])
+
+
+def run_once(db_path, transfer_stats, servers_by_names=None, horizon=60.0, now=None):
+    """Snapshot, forecast and write back in one write transaction; returns a short report."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=10)
+    try:
+        conn.execute(FORECAST_TABLE_SQL)
+        type_names = dict(conn.execute("SELECT name, id FROM queue_types"))
+        servers_by_type = {type_names[name]: count for name, count in (servers_by_names or {}).items() if name in type_names}
+        # Holding the write lock from the read on keeps the snapshot and the writes consistent
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            with METRICS.stage('forecast_snapshot'):
+                snapshot = load_snapshot(conn)
+            with METRICS.stage('forecast_compute'):
+                exits, transfers = transfer_stats.observe(snapshot)
+                transfer_types = np.union1d(list(type_names.values()), snapshot['queue_type_id']).astype(np.int64)
+                ids, waits, summaries = forecast(snapshot, now, transfer_stats.matrix(transfer_types), transfer_types,
+                                                 servers_by_type, horizon)
+            with METRICS.stage('forecast_write'):
+                write_forecasts(conn, ids, waits, summaries, horizon, now.strftime('%Y-%m-%d %H:%M:%S'))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    transfer_stats.save()
+    METRICS.increment('forecast_runs_total')
+    METRICS.increment('forecast_rows_total', len(ids))
+    return {'rows': len(ids), 'queues': len(summaries), 'exits': exits, 'transfers': transfers}
+
+
+def server_count(value):
+    """A QUEUE_TYPE=COUNT argument, e.g. laboratory=2, as (name, count)."""
+    name, _, count = value.partition('=')
+    if not name or not count.isdigit() or int(count) < 1:
+        raise argparse.ArgumentTypeError(f"expected QUEUE_TYPE=COUNT, got {value!r}")
+    return name, int(count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute wait forecasts for every queue in the hospital')
+    parser.add_argument('--db', default=os.environ.get('DB_PATH', '../../database/queue.db'))
+    parser.add_argument('--interval', type=float, default=0, help='Seconds between runs; 0 runs once')
+    parser.add_argument('--horizon', type=float, default=60.0, help='Minutes ahead for the projected waits and expected transfers')
+    parser.add_argument('--servers', nargs='*', type=server_count, default=[], metavar='QUEUE_TYPE=COUNT', help='Staff serving each shared queue type (default 1)')
+    parser.add_argument('--transfer-stats', default=TRANSFER_STATS_PATH)
+    args = parser.parse_args()
+
+    METRICS.labels['job'] = 'queue_forecast'
+    servers = dict(args.servers)
+    transfer_stats = TransferStats(args.transfer_stats)
+    while True:
+        started = time.perf_counter()
+        try:
+            report = run_once(args.db, transfer_stats, servers, args.horizon)
+            print(f"Forecast {report['rows']} patients in {report['queues']} queues "
+                  f"in {(time.perf_counter() - started) * 1000:.1f} ms "
+                  f"({report['exits']} left, {report['transfers']} transferred since last run)")
+        except sqlite3.Error as e:
+            METRICS.increment('forecast_errors_total')
+            print(f"Forecast run failed: {e}", file=sys.stderr)
+            if not args.interval:
+                sys.exit(1)
+        if not args.interval:
+            break
+        try:
+            time.sleep(max(args.interval - (time.perf_counter() - started), 0))
+        except KeyboardInterrupt:
+            break
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""
+Queue stage conventions shared by every reader of the queue table.
+
+queue_forecast, ml_predictions.QueueForecaster, external_factors and
+anomaly_detector all need to know which rows are still waiting, which are
+with the doctor and which no longer hold anyone up; they take it from here.
+"""
+
+import numpy as np
+
+# Stages that are done with the doctor and no longer hold anyone up
+FINISHED_STAGES = ('payment', 'completed', 'done', 'cancelled', 'no_show')
+IN_SERVICE_STAGE = 'consultation'
+
+# Minutes of service assumed when a row has no estimated_duration
+DEFAULT_DURATION = 10.0
+
+# Someone running over their estimate still needs a little longer
+MIN_REMAINING_MINUTES = 1.0
+
+
+def remaining_minutes(durations, stages, elapsed):
+    """Minutes of service each row still needs.
+
+    The estimate, less `elapsed` minutes already spent in consultation (NaN
+    where unknown) but at least MIN_REMAINING_MINUTES, and 0 once finished.
+    """
+    remaining = np.array(durations, dtype=np.float64)
+    stages = np.asarray(stages, dtype=object)
+    elapsed = np.asarray(elapsed, dtype=np.float64)
+    started = (stages == IN_SERVICE_STAGE) & ~np.isnan(elapsed)
+    remaining[started] = np.maximum(remaining[started] - elapsed[started], MIN_REMAINING_MINUTES)
+    remaining[np.isin(stages, FINISHED_STAGES)] = 0.0
+    return remaining
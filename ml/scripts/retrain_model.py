@@ -1,77 +1,285 @@
-import pandas as pd
-import psycopg2
-import joblib
-from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import RandomForestRegressor
-import numpy as np
+import argparse
+import json
+import os
+import sqlite3
 
 import pandas as pd
-import sqlite3
 import joblib
-from sklearn.preprocessing import StandardScaler
 from sklearn.ensemble import RandomForestRegressor
 import numpy as np
 
-def export_data_to_csv(db_path, csv_path):
-    conn = sqlite3.connect(db_path)
-    query = """
+from anomaly_detector import RETRAIN_SIGNAL_PATH
+from appointment_feed import fetch_new_appointments, parse_time
+from atomic_file import atomic_open
+from columnar_store import export_query, load_columns, rolling_std_by_group
+from feature_pipeline import HISTORY_FEATURES, PIPELINE_FILE, load_pipeline
+from model_registry import ModelRegistry
+
+# Registry model published by this script; separate from train_model.py's, as the features differ
+MODEL_NAME = 'wait_time_history'
+BUNDLE_FILES = {
+    'mean': 'mean.pkl',
+    'variance': 'variance.pkl',
+    'pipeline': PIPELINE_FILE,
+}
+# What versions published before the feature pipeline hold instead of it
+LEGACY_SCALER_FILE = 'scaler.pkl'
+STATE_FILE = 'retrain_state.json'
+
+# Window of the per-doctor rolling std used as the variance target
+VARIANCE_WINDOW = 10
+
+EXPORT_QUERY = """
     SELECT a.doctor_id, strftime('%H', a.appointment_time) + strftime('%M', a.appointment_time)/60.0 as time_of_day,
-           strftime('%w', a.appointment_time) as day_of_week,
+           CAST(strftime('%w', a.appointment_time) AS INTEGER) as day_of_week,
            COALESCE(avg_recent.avg_duration, 10) as avg_recent_duration,
            COALESCE(q.queue_length, 0) as queue_length,
            a.actual_duration as actual_wait_time
     FROM appointments a
     LEFT JOIN (
-        SELECT doctor_id, date(appointment_time), AVG(actual_duration) as avg_duration
+        SELECT doctor_id, date(appointment_time) as date, AVG(actual_duration) as avg_duration
         FROM appointments
         WHERE actual_duration IS NOT NULL
         GROUP BY doctor_id, date(appointment_time)
     ) avg_recent ON a.doctor_id = avg_recent.doctor_id AND date(a.appointment_time) = avg_recent.date
     LEFT JOIN (
-        SELECT doctor_id, date(created_at), COUNT(*) as queue_length
+        SELECT doctor_id, date(created_at) as date, COUNT(*) as queue_length
         FROM queue
         GROUP BY doctor_id, date(created_at)
     ) q ON a.doctor_id = q.doctor_id AND date(a.appointment_time) = q.date
     WHERE a.actual_duration IS NOT NULL
+    ORDER BY a.id
     """
-    df = pd.read_sql_query(query, conn)
+
+# Column dtypes for the streaming export, in EXPORT_QUERY order
+EXPORT_SCHEMA = {
+    'doctor_id': np.int32,
+    'time_of_day': np.float32,
+    'day_of_week': np.int8,
+    'avg_recent_duration': np.float32,
+    'queue_length': np.int32,
+    'actual_wait_time': np.float32,
+}
+
+def export_data_to_csv(db_path, csv_path):
+    conn = sqlite3.connect(db_path)
+    df = pd.read_sql_query(EXPORT_QUERY, conn)
     df.to_csv(csv_path, index=False)
     conn.close()
 
+def export_data_columnar(db_path, out_dir, chunksize=100_000):
+    """Stream the export query into memory-mappable .npy columns; returns the row count."""
+    conn = sqlite3.connect(db_path)
+    n_rows = export_query(conn, EXPORT_QUERY, out_dir, EXPORT_SCHEMA, chunksize=chunksize)
+    conn.close()
+    return n_rows
+
+def prepare_columns(columns):
+    """prepare_data for memory-mapped columns: no DataFrame is built."""
+    features = HISTORY_FEATURES.matrix(columns, dtype=np.float32)
+    target_mean = np.asarray(columns['actual_wait_time'])
+    target_var = rolling_std_by_group(columns['doctor_id'], columns['actual_wait_time'], VARIANCE_WINDOW)
+    return features, target_mean, target_var
+
 def prepare_data(data):
-    features = data[['doctor_id', 'time_of_day', 'day_of_week', 'avg_recent_duration', 'queue_length']]
+    features = HISTORY_FEATURES.matrix(data)
     target_mean = data['actual_wait_time']
-    data['variance'] = data.groupby('doctor_id')['actual_wait_time'].rolling(10).std().fillna(1)
+    data['variance'] = data.groupby('doctor_id')['actual_wait_time'].transform(lambda s: s.rolling(10).std()).fillna(1)
     target_var = data['variance']
     return features, target_mean, target_var
 
 def train_models(features, target_mean, target_var):
-    scaler = StandardScaler()
-    features_scaled = scaler.fit_transform(features)
-    
+    pipeline = HISTORY_FEATURES.fit(features)
+    features_scaled = pipeline.transform(features)
+
     mean_model = RandomForestRegressor(n_estimators=100, random_state=42)
     mean_model.fit(features_scaled, target_mean)
-    
+
     var_model = RandomForestRegressor(n_estimators=100, random_state=42)
     var_model.fit(features_scaled, target_var)
-    
-    return mean_model, var_model, scaler
+
+    return mean_model, var_model, pipeline
+
+class RetrainState:
+    """Everything incremental retraining carries between runs.
+
+    `last_appointment_id` is a high-water mark: every appointment at or below
+    it is either already trained on or will never complete. Completed rows
+    above it that were already used are remembered in `processed_ids`, because
+    the mark cannot move past an appointment that is still open.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.last_appointment_id = data.get('last_appointment_id', 0)
+        self.processed_ids = set(data.get('processed_ids', []))
+        self.last_queue_id = data.get('last_queue_id', 0)
+        # "doctor_id|YYYY-MM-DD" -> [sum of durations, count]
+        self.daily_durations = data.get('daily_durations', {})
+        # "doctor_id|YYYY-MM-DD" -> queue rows created that day
+        self.daily_queue = data.get('daily_queue', {})
+        # doctor_id -> last VARIANCE_WINDOW - 1 durations, oldest first
+        self.recent_durations = data.get('recent_durations', {})
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def save(self, path):
+        data = {
+            'last_appointment_id': self.last_appointment_id,
+            'processed_ids': sorted(self.processed_ids),
+            'last_queue_id': self.last_queue_id,
+            'daily_durations': self.daily_durations,
+            'daily_queue': self.daily_queue,
+            'recent_durations': self.recent_durations,
+        }
+        with atomic_open(path) as f:
+            json.dump(data, f)
+
+def update_queue_counts(conn, state):
+    for row_id, doctor_id, created_at in conn.execute(
+            "SELECT id, doctor_id, date(created_at) FROM queue WHERE id > ? ORDER BY id", (state.last_queue_id,)):
+        key = f"{doctor_id}|{created_at}"
+        state.daily_queue[key] = state.daily_queue.get(key, 0) + 1
+        state.last_queue_id = row_id
+
+def build_training_rows(new_rows, state):
+    """Turn new appointments into the retrain feature set using the running aggregates."""
+    # Day averages include every completion of that day seen so far, as the export query does
+    for _, doctor_id, appointment_time, duration in new_rows:
+        key = f"{doctor_id}|{parse_time(appointment_time).date().isoformat()}"
+        totals = state.daily_durations.setdefault(key, [0.0, 0])
+        totals[0] += duration
+        totals[1] += 1
+
+    records = []
+    for _, doctor_id, appointment_time, duration in new_rows:
+        dt = parse_time(appointment_time)
+        key = f"{doctor_id}|{dt.date().isoformat()}"
+        total, count = state.daily_durations[key]
+
+        window = state.recent_durations.setdefault(str(doctor_id), [])
+        window.append(duration)
+        variance = float(np.std(window, ddof=1)) if len(window) >= VARIANCE_WINDOW else 1.0
+        del window[:-(VARIANCE_WINDOW - 1)]
+
+        records.append({
+            'doctor_id': doctor_id,
+            'time_of_day': dt.hour + dt.minute / 60.0,
+            'day_of_week': dt.isoweekday() % 7,  # SQLite %w: Sunday is 0
+            'avg_recent_duration': total / count if count else 10,
+            'queue_length': state.daily_queue.get(key, 0),
+            'actual_wait_time': duration,
+            'variance': variance,
+        })
+    return pd.DataFrame(records, columns=HISTORY_FEATURES.columns + ['actual_wait_time', 'variance'])
+
+def add_trees(model, features_scaled, target, trees_per_update, max_trees):
+    """Grow a fitted forest with trees trained on new rows only, keeping the newest max_trees."""
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + trees_per_update)
+    model.fit(features_scaled, target)
+    if max_trees and len(model.estimators_) > max_trees:
+        model.estimators_ = model.estimators_[-max_trees:]
+        model.set_params(n_estimators=max_trees)
+    return model
+
+def bootstrap_state(db_path):
+    """Replay the full history once so later runs only need the new rows."""
+    state = RetrainState()
+    conn = sqlite3.connect(db_path)
+    update_queue_counts(conn, state)
+    build_training_rows(fetch_new_appointments(conn, state), state)
+    conn.close()
+    return state
+
+def incremental_retrain(db_path, state, model_paths, trees_per_update, max_trees, min_rows):
+    conn = sqlite3.connect(db_path)
+    update_queue_counts(conn, state)
+    new_rows = fetch_new_appointments(conn, state)
+    conn.close()
+
+    if len(new_rows) < min_rows:
+        return None
+
+    data = build_training_rows(new_rows, state)
+    mean_model = joblib.load(model_paths['mean'])
+    var_model = joblib.load(model_paths['variance'])
+    # The scaling stays frozen: the existing trees split on its output
+    pipeline = load_pipeline(model_paths['pipeline'], default=HISTORY_FEATURES)
+    HISTORY_FEATURES.check(pipeline, f"Feature pipeline {model_paths['pipeline']}")
+    features_scaled = pipeline.transform(HISTORY_FEATURES.matrix(data))
+
+    add_trees(mean_model, features_scaled, data['actual_wait_time'], trees_per_update, max_trees)
+    add_trees(var_model, features_scaled, data['variance'], trees_per_update, max_trees)
+    return mean_model, var_model, pipeline, len(data)
 
 if __name__ == "__main__":
-    db_path = '../../backend/database.db'
+    parser = argparse.ArgumentParser(description='Retrain the wait time models from the appointments history')
+    parser.add_argument('--full', action='store_true', help='Re-export the whole history and refit from scratch')
+    parser.add_argument('--db', default=os.environ.get('DB_PATH', '../../database/queue.db'))
+    parser.add_argument('--format', choices=['npy', 'csv'], default='npy', help='Full export format: streamed .npy columns or a single CSV')
+    parser.add_argument('--chunksize', type=int, default=100_000, help='Rows fetched per chunk when streaming the export')
+    parser.add_argument('--trees-per-update', type=int, default=10, help='Trees added per incremental run')
+    parser.add_argument('--max-trees', type=int, default=200, help='Oldest trees are dropped beyond this')
+    parser.add_argument('--min-rows', type=int, default=50, help='Wait for at least this many new rows before updating')
+    parser.add_argument('--if-signalled', action='store_true', help='Only retrain when anomaly_detector.py has signalled prediction drift')
+    args = parser.parse_args()
+
+    if args.if_signalled and not os.path.exists(RETRAIN_SIGNAL_PATH):
+        print("No retrain signal; models unchanged.")
+        raise SystemExit(0)
+
+    db_path = args.db
     csv_path = '../data/historical_wait_times.csv'
-    
-    # Export latest data
-    export_data_to_csv(db_path, csv_path)
-    
-    # Load and train
-    data = pd.read_csv(csv_path)
-    features, target_mean, target_var = prepare_data(data)
-    mean_model, var_model, scaler = train_models(features, target_mean, target_var)
-    
-    # Save models
-    joblib.dump(mean_model, '../models/mean_predictor.pkl')
-    joblib.dump(var_model, '../models/var_predictor.pkl')
-    joblib.dump(scaler, '../models/scaler.pkl')
-    
-    print("Data exported and models retrained.")
\ No newline at end of file
+    columnar_dir = '../data/historical_wait_times'
+
+    # Models, feature pipeline and the state they were trained up to are published together as one version
+    registry = ModelRegistry(MODEL_NAME)
+    state = RetrainState.load(registry.path(STATE_FILE)) if registry.current_version() else None
+    model_paths = {key: registry.path(filename) for key, filename in BUNDLE_FILES.items()}
+    if model_paths['pipeline'] and not os.path.exists(model_paths['pipeline']):
+        model_paths['pipeline'] = registry.path(LEGACY_SCALER_FILE)
+
+    published = False
+    if args.full or state is None:
+        # Export latest data and load it
+        if args.format == 'npy':
+            export_data_columnar(db_path, columnar_dir, args.chunksize)
+            features, target_mean, target_var = prepare_columns(load_columns(columnar_dir))
+        else:
+            export_data_to_csv(db_path, csv_path)
+            data = pd.read_csv(csv_path)
+            features, target_mean, target_var = prepare_data(data)
+
+        # Train
+        mean_model, var_model, pipeline = train_models(features, target_mean, target_var)
+
+        with registry.publish(feature_pipeline=pipeline, metrics={'rows': len(target_mean)}, source='retrain_model --full') as bundle:
+            joblib.dump(mean_model, bundle.path(BUNDLE_FILES['mean']))
+            joblib.dump(var_model, bundle.path(BUNDLE_FILES['variance']))
+            pipeline.save(bundle.path(BUNDLE_FILES['pipeline']))
+            bootstrap_state(db_path).save(bundle.path(STATE_FILE))
+
+        print(f"Data exported and models retrained ({MODEL_NAME} version {bundle.version}).")
+        published = True
+    else:
+        result = incremental_retrain(db_path, state, model_paths, args.trees_per_update, args.max_trees, args.min_rows)
+        if result is None:
+            print(f"Fewer than {args.min_rows} new completed appointments; models unchanged.")
+        else:
+            mean_model, var_model, pipeline, n_rows = result
+            with registry.publish(feature_pipeline=pipeline, metrics={'new_rows': n_rows}, source='retrain_model') as bundle:
+                joblib.dump(mean_model, bundle.path(BUNDLE_FILES['mean']))
+                joblib.dump(var_model, bundle.path(BUNDLE_FILES['variance']))
+                pipeline.save(bundle.path(BUNDLE_FILES['pipeline']))
+                state.save(bundle.path(STATE_FILE))
+            print(f"Added {args.trees_per_update} trees per model from {n_rows} new appointments ({MODEL_NAME} version {bundle.version}).")
+            published = True
+
+    # The drift that raised the signal is answered by the new version
+    if published and os.path.exists(RETRAIN_SIGNAL_PATH):
+        os.remove(RETRAIN_SIGNAL_PATH)
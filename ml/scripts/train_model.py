@@ -1,62 +1,160 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
 import pandas as pd
 import joblib
-from sklearn.preprocessing import StandardScaler
+from joblib import Parallel, delayed
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split, cross_val_score
+from sklearn.model_selection import KFold
 from sklearn.metrics import mean_squared_error
 import numpy as np
+from columnar_store import load_columns
+from compiled_forest import export_bundle, verify_bundle
+from feature_pipeline import WAIT_TIME_FEATURES
+from model_registry import ModelRegistry
+from predict import BUNDLE_FILES, MODEL_NAME
 
 def load_historical_data(file_path):
+    # A directory holds memory-mapped .npy columns written by generate_data.py
+    if os.path.isdir(file_path):
+        return pd.DataFrame(load_columns(file_path))
     return pd.read_csv(file_path)
 
 def prepare_data(data):
-    # Include temporal features
-    data_encoded = data.copy()
-    data_encoded['time_slot_encoded'] = data_encoded['time_slot'].map({'morning': 0, 'afternoon': 1, 'evening': 2})
-    
-    features = data_encoded[['total_queue_length', 'patients_at_current_stage', 'staff_at_current_stage', 'hospital_occupancy', 'patient_age', 'traffic_level', 'doctor_experience', 'time_of_day', 'day_of_week', 'time_slot_encoded']]
-    target_mean = data_encoded['actual_wait_time']
-    target_variance = data_encoded['variance']
-    return features, target_mean, target_variance
-
-def train_model(features, target_mean, target_variance):
-    scaler = StandardScaler()
-    features_scaled = scaler.fit_transform(features)
-    
-    model_mean = RandomForestRegressor(n_estimators=100, random_state=42)
-    model_mean.fit(features_scaled, target_mean)
-    
-    model_variance = RandomForestRegressor(n_estimators=100, random_state=42)
-    model_variance.fit(features_scaled, target_variance)
-    
-    return model_mean, model_variance, scaler
+    # Unscaled feature matrix in the column order and encoding predict.py serves with
+    features = WAIT_TIME_FEATURES.matrix(data)
+    target = np.asarray(data['actual_wait_time'], dtype=np.float64)
+    return features, target
+
+class StageTimer:
+    """Collects wall time per named training stage."""
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def report(self):
+        total = sum(self.timings.values())
+        lines = [f"  {name:<18} {seconds:8.2f}s" for name, seconds in self.timings.items()]
+        return "\n".join(["Stage timings:"] + lines + [f"  {'total':<18} {total:8.2f}s"])
+
+def _fit_and_score(model, features, target, train_index, test_index):
+    model.fit(features[train_index], target[train_index])
+    return mean_squared_error(target[test_index], model.predict(features[test_index]))
+
+def cross_validate_models(models, features, targets, cv=5, jobs=-1):
+    """Cross-validate several models in one process pool.
+
+    Every (model, fold) pair is a separate task, so several models are
+    evaluated at the same time; cores left over after one task per worker
+    go to each forest's trees. Returns the RMSE per model, with
+    the same folds and scoring as cross_val_score(cv=5).
+    """
+    jobs = joblib.cpu_count() if jobs in (None, -1) else jobs
+    splits = list(KFold(n_splits=cv).split(features))
+    tasks = [(i, train_index, test_index) for i in range(len(models)) for train_index, test_index in splits]
+    workers = min(jobs, len(tasks))
+    tree_jobs = max(1, jobs // len(tasks))
+
+    scores = Parallel(n_jobs=workers)(
+        delayed(_fit_and_score)(clone(models[i]).set_params(n_jobs=tree_jobs), features, targets[i], train_index, test_index)
+        for i, train_index, test_index in tasks
+    )
+    mse = np.array(scores).reshape(len(models), cv).mean(axis=1)
+    return np.sqrt(mse)
+
+def train_model(features, target, jobs=-1):
+    """Fit the feature pipeline's scaling and the wait time forest.
+
+    There is no second forest for the variance: the compiled bundle keeps the
+    training targets' quantiles per leaf of this one (see compiled_forest),
+    and the spread, quantiles and tail risk are read from those.
+    """
+    pipeline = WAIT_TIME_FEATURES.fit(features)
+    features_scaled = pipeline.transform(features)
+
+    model_mean = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=jobs)
+    model_mean.fit(features_scaled, target)
+
+    # Serving predicts a row at a time; a thread pool per call would only add overhead
+    model_mean.set_params(n_jobs=None)
+    return model_mean, pipeline
+
+def interval_coverage(compiled_path, features, target, thresholds=(30,)):
+    """Share of targets at or below each predicted quantile, and predicted vs. observed P(wait > t)."""
+    from compiled_forest import CompiledWaitTimePredictor
+    distribution = CompiledWaitTimePredictor(compiled_path, pipeline=WAIT_TIME_FEATURES).predict_distribution(features, thresholds=thresholds)
+    report = {f'coverage_p{round(level * 100)}': float((target <= distribution['quantiles'][:, i]).mean())
+              for i, level in enumerate(distribution['levels'])}
+    for j, threshold in enumerate(thresholds):
+        report[f'tail_risk_{threshold:g}_predicted'] = float(distribution['exceedance'][:, j].mean())
+        report[f'tail_risk_{threshold:g}_observed'] = float((target > threshold).mean())
+    return report
 
 if __name__ == "__main__":
-    historical_data_path = '../data/historical_wait_times.csv'
-    
-    data = pd.read_csv(historical_data_path)
-    features, target_mean, target_variance = prepare_data(data)
-    
-    # Evaluate mean model
-    model_mean = RandomForestRegressor(n_estimators=100, random_state=42)
-    scores_mean = cross_val_score(model_mean, features, target_mean, cv=5, scoring='neg_mean_squared_error')
-    rmse_mean = np.sqrt(-scores_mean.mean())
-    
-    # Evaluate variance model
-    model_variance = RandomForestRegressor(n_estimators=100, random_state=42)
-    scores_variance = cross_val_score(model_variance, features, target_variance, cv=5, scoring='neg_mean_squared_error')
-    rmse_variance = np.sqrt(-scores_variance.mean())
-    
-    # Train final models
-    scaler = StandardScaler()
-    features_scaled = scaler.fit_transform(features)
-    model_mean.fit(features_scaled, target_mean)
-    model_variance.fit(features_scaled, target_variance)
-    
-    joblib.dump(model_mean, '../models/wait_time_predictor_mean.pkl')
-    joblib.dump(model_variance, '../models/wait_time_predictor_variance.pkl')
-    joblib.dump(scaler, '../models/scaler.pkl')
-    
+    parser = argparse.ArgumentParser(description='Train the wait time model and its leaf quantiles')
+    parser.add_argument('--data', default='../data/historical_wait_times.csv')
+    parser.add_argument('--jobs', type=int, default=-1, help='Worker processes/threads to use (-1: all cores)')
+    parser.add_argument('--timings', help='Also write the per-stage wall times to this JSON file')
+    args = parser.parse_args()
+
+    timer = StageTimer()
+
+    with timer.stage('load'):
+        data = load_historical_data(args.data)
+    with timer.stage('prepare'):
+        features, target = prepare_data(data)
+
+    # Evaluate the mean model
+    with timer.stage('cross_validation'):
+        (rmse_mean,) = cross_validate_models(
+            [RandomForestRegressor(n_estimators=100, random_state=42)],
+            features, [target], cv=5, jobs=args.jobs)
+
+    # Check the quantiles and tail risk on rows the forest has not seen (the last fold)
+    with timer.stage('calibration'):
+        train_index, test_index = list(KFold(n_splits=5).split(features))[-1]
+        holdout_mean, holdout_pipeline = train_model(features[train_index], target[train_index], jobs=args.jobs)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            holdout_path = os.path.join(tmp_dir, 'holdout.npz')
+            export_bundle(holdout_path, holdout_mean, None, holdout_pipeline,
+                          training_data=(features[train_index], target[train_index]))
+            calibration = interval_coverage(holdout_path, features[test_index], target[test_index])
+
+    # Train final model
+    with timer.stage('fit'):
+        model_mean, pipeline = train_model(features, target, jobs=args.jobs)
+
+    # Publish model, feature pipeline and compiled bundle as one registry version; predictors switch over atomically
+    registry = ModelRegistry(MODEL_NAME)
+    metrics = {'rmse_mean': float(rmse_mean), **calibration, 'rows': len(features)}
+    with registry.publish(feature_pipeline=pipeline, metrics=metrics, source='train_model') as bundle:
+        with timer.stage('save'):
+            joblib.dump(model_mean, bundle.path(BUNDLE_FILES['mean']))
+            pipeline.save(bundle.path(BUNDLE_FILES['pipeline']))
+
+        # Compiled artifact with the leaf quantiles, for sklearn-free inference in predict.py
+        with timer.stage('export_compiled'):
+            compiled_path = bundle.path(BUNDLE_FILES['compiled'])
+            export_bundle(compiled_path, model_mean, None, pipeline, training_data=(features, target))
+            if not verify_bundle(compiled_path, model_mean, None, pipeline, features):
+                raise RuntimeError("Compiled model predictions do not match sklearn")
+
     print(f"Mean model RMSE: {rmse_mean:.2f} minutes")
-    print(f"Variance model RMSE: {rmse_variance:.2f}")
-    print("Models trained and saved.")
\ No newline at end of file
+    print("Held-out calibration: " + ", ".join(f"{name} {value:.3f}" for name, value in calibration.items()))
+    print(timer.report())
+    if args.timings:
+        with open(args.timings, 'w') as f:
+            json.dump(timer.timings, f, indent=2)
+    print(f"Models trained and published as {MODEL_NAME} version {bundle.version}.")
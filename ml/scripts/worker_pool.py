@@ -0,0 +1,285 @@
+"""
+Pre-forked worker processes for the prediction server.
+
+One Python process is bound to one core by the GIL. PredictionPool loads
+the predictor once and forks N workers from it; the compiled bundle is
+memory-mapped and everything else is shared copy-on-write, so the workers
+add little memory. Prediction requests go through a bounded queue:
+
+- a dispatcher thread hands each idle worker everything that queued up
+  while it was busy (up to max_batch, waiting at most batch_wait for more),
+  so a burst is predicted in a few vectorized batches instead of one by one;
+- a request arriving when max_pending requests are already waiting, or not
+  answered within the timeout, or lost with a crashed worker, gets the
+  queue-length heuristic (predict.fallback_prediction) instead, marked
+  "degraded" with the reason, rather than waiting longer.
+
+Each worker counts its own predictions, stage timings and cache lookups and
+sends a snapshot of them with every reply; metrics() and cache_stats() add
+them up, so the server reports the whole pool rather than just the parent.
+
+Workers follow the registry on their own: when CURRENT moves, each one
+reloads the models into its private memory, so after a release N workers
+hold N copies instead of sharing the parent's. Restart the server after a
+release to get the shared copy back when memory is tight.
+
+    pool = PredictionPool(predictor, workers=4)
+    pool.predict({'total_queue_length': 8, ..., 'slot_time': '2026-01-17T14:00:00Z'})
+"""
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import signal
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from instrumentation import METRICS, Metrics
+from predict import fallback_prediction, predict_requests
+
+
+def _worker_main(conn, predictor, inherited_conns):
+    for other in inherited_conns:
+        other.close()
+    # The server shuts the pool down; Ctrl-C in a terminal must not kill workers mid-batch
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Report only what this worker does, not what the parent had counted when it forked
+    METRICS.reset()
+    cache = getattr(predictor, 'cache', None)
+    if cache is not None:
+        cache.reset_stats()
+    while True:
+        try:
+            requests = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            results = predict_requests(predictor, requests)
+        except Exception as e:
+            results = [{'error': str(e)}] * len(requests)
+        conn.send((results, {'metrics': METRICS.snapshot(), 'cache': cache.stats() if cache is not None else None}))
+
+
+class PredictionPool:
+    def __init__(self, predictor, workers=None, max_pending=256, timeout=1.0, max_batch=64, batch_wait=0.0):
+        self.predictor = predictor
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.restarts = 0
+        self._context = multiprocessing.get_context('fork')
+        self._requests = queue.Queue()
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._closed = False
+        # worker index -> (process, connection), and the batch it is working on
+        self._workers = [None] * (workers or os.cpu_count() or 1)
+        self._in_flight = {}
+        # worker index -> its latest metrics/cache report, and what workers that have exited had reported
+        self._reports = {}
+        self._retired = {'metrics': Metrics().snapshot(), 'cache': {}}
+        # Fork every worker before starting any thread
+        for index in range(len(self._workers)):
+            self._start_worker(index)
+        self._threads = [
+            threading.Thread(target=self._dispatch, name='prediction-pool-dispatch', daemon=True),
+            threading.Thread(target=self._collect, name='prediction-pool-collect', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _start_worker(self, index, idle=True):
+        parent_conn, child_conn = self._context.Pipe()
+        # The child closes its copies of the parent's ends, so it sees EOF when the server exits
+        inherited = [parent_conn] + [worker[1] for worker in self._workers if worker is not None]
+        process = self._context.Process(target=_worker_main, args=(child_conn, self.predictor, inherited),
+                                        name=f'prediction-worker-{index}', daemon=True)
+        process.start()
+        child_conn.close()
+        self._workers[index] = (process, parent_conn)
+        if idle:
+            self._idle.put(index)
+
+    def _next_batch(self):
+        """Block for one live request, then take whatever else arrives within batch_wait; None on close."""
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch:
+            try:
+                if deadline is None:
+                    item = self._requests.get()
+                elif self.batch_wait > 0:
+                    item = self._requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                else:
+                    item = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return None
+            # Requests whose caller already gave up were cancelled; skip them
+            if item[1].set_running_or_notify_cancel():
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.perf_counter() + self.batch_wait
+        return batch
+
+    def _dispatch(self):
+        while True:
+            index = self._idle.get()
+            batch = None if index is None else self._next_batch()
+            if batch is None or self._closed:
+                return
+            with self._lock:
+                self._in_flight[index] = batch
+            METRICS.increment('pool_batches_total')
+            METRICS.increment('pool_batched_requests_total', len(batch))
+            try:
+                self._workers[index][1].send([request for request, _ in batch])
+            except (OSError, ValueError) as e:
+                # Connection closed by a restart; the new worker takes the next batch
+                with self._lock:
+                    self._in_flight.pop(index, None)
+                for _, future in batch:
+                    future.set_exception(RuntimeError(f'Prediction worker {index} unavailable: {e}'))
+                self._idle.put(index)
+
+    def _collect(self):
+        while not self._closed:
+            connections = {worker[1]: index for index, worker in enumerate(self._workers)}
+            for conn in multiprocessing.connection.wait(list(connections), timeout=0.5):
+                index = connections[conn]
+                try:
+                    results, report = conn.recv()
+                except (EOFError, OSError):
+                    if not self._closed:
+                        self._restart_worker(index)
+                    continue
+                with self._lock:
+                    batch = self._in_flight.pop(index, [])
+                    self._reports[index] = report
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+                self._idle.put(index)
+
+    def _restart_worker(self, index):
+        METRICS.increment('pool_worker_restarts_total')
+        self.restarts += 1
+        process, conn = self._workers[index]
+        conn.close()
+        process.join(timeout=1.0)
+        with self._lock:
+            batch = self._in_flight.pop(index, None)
+            report = self._reports.pop(index, None)
+            if report is not None:
+                # Keep the exited worker's counts in the pool totals; its cache entries went with it
+                cache = {name: value for name, value in (report['cache'] or {}).items() if name not in ('size', 'maxsize')}
+                self._retired = {'metrics': _merged([self._retired['metrics'], report['metrics']]).snapshot(),
+                                 'cache': _cache_totals([self._retired['cache'], cache])}
+        for _, future in batch or []:
+            future.set_exception(RuntimeError(f'Prediction worker {index} exited with code {process.exitcode}'))
+        # An idle worker's index is already queued (or held by the dispatcher)
+        self._start_worker(index, idle=batch is not None)
+
+    def _request_done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def predict(self, request):
+        """The model's prediction for one request dict, or the degraded heuristic one."""
+        if self._closed:
+            raise RuntimeError('Prediction pool is closed')
+        METRICS.increment('pool_requests_total')
+        with self._lock:
+            if self._pending >= self.max_pending:
+                saturated = True
+            else:
+                saturated = False
+                self._pending += 1
+        if saturated:
+            return self._degraded(request, 'saturated')
+
+        future = Future()
+        future.add_done_callback(self._request_done)
+        self._requests.put((request, future))
+        try:
+            with METRICS.stage('pool_wait'):
+                return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Still queued: cancel so no worker spends time on it
+            future.cancel()
+            return self._degraded(request, 'timeout')
+        except RuntimeError:
+            return self._degraded(request, 'worker_failed')
+
+    @staticmethod
+    def _degraded(request, reason):
+        METRICS.increment(f'pool_fallback_{reason}_total')
+        return {**fallback_prediction(request.get('total_queue_length', 0)), 'degraded': True, 'fallback_reason': reason}
+
+    def stats(self):
+        with self._lock:
+            pending, busy = self._pending, len(self._in_flight)
+        return {
+            'workers': len(self._workers),
+            'alive': sum(worker[0].is_alive() for worker in self._workers),
+            'busy': busy,
+            'pending': pending,
+            'max_pending': self.max_pending,
+            'max_batch': self.max_batch,
+            'timeout': self.timeout,
+            'restarts': self.restarts,
+        }
+
+    def metrics(self, parent=METRICS):
+        """`parent`'s metrics plus every worker's, as one Metrics."""
+        with self._lock:
+            snapshots = [self._retired['metrics']] + [report['metrics'] for report in self._reports.values()]
+        combined = _merged([parent.snapshot()] + snapshots)
+        combined.namespace, combined.labels = parent.namespace, dict(parent.labels)
+        return combined
+
+    def cache_stats(self):
+        """The workers' prediction cache statistics, added up; None when they predict uncached."""
+        with self._lock:
+            reports = [self._retired['cache']] + [report['cache'] for report in self._reports.values()]
+        if not any(reports):
+            return None
+        return _cache_totals(reports)
+
+    def close(self):
+        self._closed = True
+        self._requests.put(None)
+        self._idle.put(None)
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        for process, conn in self._workers:
+            conn.close()
+        for process, _ in self._workers:
+            process.join(timeout=1.0)
+            if process.is_alive():
+                process.terminate()
+
+
+def _merged(snapshots):
+    metrics = Metrics()
+    for snapshot in snapshots:
+        metrics.merge(snapshot)
+    return metrics
+
+
+def _cache_totals(stats):
+    """Sum per-worker PredictionCache.stats(); sizes add up since each worker has its own cache."""
+    totals = Counter()
+    ttl = None
+    for worker_stats in stats:
+        if not worker_stats:
+            continue
+        ttl = worker_stats.get('ttl', ttl)
+        totals.update({name: value for name, value in worker_stats.items() if name not in ('ttl', 'hit_rate')})
+    lookups = totals['hits'] + totals['misses']
+    return {**totals, 'ttl': ttl, 'hit_rate': totals['hits'] / lookups if lookups else 0.0}
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The ML scripts are a flat directory of modules, imported the way the scripts import each other
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
@@ -0,0 +1,132 @@
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from anomaly_detector import (EWM_ALPHA, HUBER_K, MAD_TO_STD, MIN_OBSERVATIONS, DetectorState, RobustEWMA,
+                              run)
+
+NOW = datetime(2026, 1, 20, 17, 0)
+
+
+def test_warm_up_is_the_plain_mean_and_absolute_deviation():
+    values = np.random.default_rng(0).normal(15, 3, MIN_OBSERVATIONS)
+    stats = RobustEWMA()
+    assert [stats.update(value) for value in values] == [0.0] * MIN_OBSERVATIONS
+    assert stats.warm
+    assert stats.level == pytest.approx(values.mean())
+    # The deviation follows each value's distance from the level before it
+    levels = np.cumsum(values) / np.arange(1, len(values) + 1)
+    deviations = np.abs(values[1:] - levels[:-1])
+    expected = 0.0
+    for n, deviation in enumerate(deviations, start=2):
+        expected += (deviation - expected) / n
+    assert stats.deviation == pytest.approx(expected)
+
+
+def test_outliers_are_flagged_but_clipped():
+    stats = RobustEWMA()
+    for value in np.random.default_rng(1).normal(15, 3, 200):
+        stats.update(value)
+    level, deviation, std = stats.level, stats.deviation, stats.std
+    z = stats.update(level + 50 * std)
+    assert z == pytest.approx(50)
+    # The outlier moved the state only by the clipped residual's share
+    assert stats.level - level == pytest.approx(EWM_ALPHA * HUBER_K * std)
+    assert stats.deviation == pytest.approx(deviation + EWM_ALPHA * (HUBER_K * std - deviation))
+
+
+def test_level_follows_a_lasting_shift():
+    stats = RobustEWMA()
+    rng = np.random.default_rng(2)
+    for value in rng.normal(15, 2, 100):
+        stats.update(value)
+    for value in rng.normal(25, 2, 300):
+        stats.update(value)
+    assert stats.level == pytest.approx(25, abs=1.0)
+    assert stats.std == pytest.approx(2 * MAD_TO_STD / np.sqrt(np.pi / 2), rel=0.3)
+
+
+def test_state_round_trips(tmp_path):
+    path = str(tmp_path / 'state.json')
+    state = DetectorState(path)
+    state.durations['1'] = RobustEWMA()
+    for value in (10.0, 12.0, 11.0):
+        state.durations['1'].update(value)
+    state.pending['7'] = [1, 12.5, '2026-01-20T09:00:00']
+    assert state.report_once('wait_drift', '1', NOW)
+    assert not state.report_once('wait_drift', '1', NOW)
+    state.save()
+
+    loaded = DetectorState(path)
+    assert loaded.durations['1'].to_list() == state.durations['1'].to_list()
+    assert loaded.pending == state.pending
+    assert not loaded.report_once('wait_drift', '1', NOW)
+    assert loaded.report_once('wait_drift', '1', NOW + timedelta(days=1))
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE appointments (id INTEGER PRIMARY KEY, doctor_id INTEGER, appointment_time TEXT, "
+                 "actual_duration REAL, status TEXT)")
+    conn.execute("CREATE TABLE queue (id INTEGER PRIMARY KEY, doctor_id INTEGER, stage TEXT, estimated_wait REAL, "
+                 "check_in_time TEXT, created_at TEXT, stage_start_time TEXT)")
+    conn.execute("CREATE TABLE anomalies (id INTEGER PRIMARY KEY, doctor_id INTEGER, date TEXT, description TEXT, severity TEXT)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def anomalies(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT doctor_id, description, severity FROM anomalies ORDER BY id").fetchall()
+
+
+def test_unusual_consultation_is_recorded_once(db_path, tmp_path):
+    durations = np.random.default_rng(3).normal(15, 2, 60).tolist() + [90.0]
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany("INSERT INTO appointments VALUES (?, 1, ?, ?, 'completed')",
+                         [(i + 1, (NOW - timedelta(hours=61 - i)).isoformat(), d) for i, d in enumerate(durations)])
+    state = DetectorState(str(tmp_path / 'state.json'))
+    recorded, _ = run(db_path, state, str(tmp_path / 'signal.json'), NOW)
+    assert [(doctor, severity) for doctor, _, severity in anomalies(db_path)] == [(1, 'high')]
+    assert 'appointment 61' in anomalies(db_path)[0][1]
+    # Nothing new: nothing recorded again
+    assert run(db_path, DetectorState(str(tmp_path / 'state.json')), str(tmp_path / 'signal.json'), NOW)[0] == []
+
+
+def test_drift_raises_the_retrain_signal_until_a_retrain_consumes_it(db_path, tmp_path):
+    state_path, signal_path = str(tmp_path / 'state.json'), str(tmp_path / 'signal.json')
+    checked_in = NOW - timedelta(hours=2)
+    rows = [(i + 1, 1 + i % 2, 'waiting', 10.0, checked_in.isoformat(), checked_in.isoformat(), None)
+            for i in range(2 * (MIN_OBSERVATIONS + 5))]
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany("INSERT INTO queue VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    # First pass: the estimates patients were told
+    assert run(db_path, DetectorState(state_path), signal_path, NOW) == ([], [])
+    assert not os.path.exists(signal_path)
+
+    # Every consultation starts 30 minutes after check-in, 20 more than predicted
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE queue SET stage = 'consultation', stage_start_time = ?",
+                     ((checked_in + timedelta(minutes=30)).isoformat(),))
+    state = DetectorState(state_path)
+    recorded, reasons = run(db_path, state, signal_path, NOW)
+    assert state.wait_errors['all'].level == pytest.approx(20.0)
+    assert sorted(doctor for doctor, _, _, _ in recorded) == [1, 2]
+    assert any('across all doctors' in reason for reason in reasons)
+    with open(signal_path) as f:
+        assert json.load(f)['reasons'] == reasons
+    assert DetectorState(state_path).signalled
+
+    # retrain_model.py removes the signal once it has published new models: the errors start over
+    os.remove(signal_path)
+    state = DetectorState(state_path)
+    assert run(db_path, state, signal_path, NOW) == ([], [])
+    assert state.wait_errors == {} and not state.signalled
+    assert not os.path.exists(signal_path)
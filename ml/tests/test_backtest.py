@@ -0,0 +1,100 @@
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+from backtest import DayReplay, Scorecard, stream_history
+
+DAY = datetime(2026, 1, 12, 9, 0)
+
+
+def at(minutes):
+    return DAY + timedelta(minutes=minutes)
+
+
+def test_day_replay_serves_patients_in_arrival_order():
+    replay = DayReplay(DAY.date())
+    # Doctor idle: seen at once
+    assert replay.admit(at(0), 15) == (0, 0)
+    # Arrives while the first patient is in consultation
+    assert replay.admit(at(5), 10) == (1, 10)
+    # Two consultations still ahead, ending at 15 and 25
+    assert replay.admit(at(10), 20) == (2, 15)
+    # The first two have finished; the third runs until 45
+    assert replay.admit(at(30), 5) == (1, 15)
+    # Everyone has been seen: idle again
+    assert replay.admit(at(60), 10) == (0, 0)
+
+
+def test_day_replay_matches_a_brute_force_queue():
+    rng = np.random.default_rng(0)
+    arrivals = np.sort(rng.uniform(0, 240, 40))
+    durations = rng.uniform(5, 25, 40)
+    replay = DayReplay(DAY.date())
+    ends = []
+    for arrival, duration in zip(arrivals, durations):
+        start = max([arrival] + ends[-1:])
+        expected = (sum(end > arrival for end in ends), start - arrival)
+        ends.append(start + duration)
+        ahead, wait = replay.admit(at(arrival), duration)
+        assert ahead == expected[0]
+        assert wait == pytest.approx(expected[1], abs=1e-6)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE doctors (id INTEGER PRIMARY KEY, specialty TEXT, experience_years INTEGER)")
+    conn.execute("CREATE TABLE appointments (id INTEGER PRIMARY KEY, doctor_id INTEGER, appointment_time TEXT, "
+                 "check_in_time TEXT, actual_duration REAL)")
+    conn.execute("CREATE TABLE feedback (id INTEGER PRIMARY KEY, appointment_id INTEGER, actual_wait REAL)")
+    conn.executemany("INSERT INTO doctors VALUES (?, ?, ?)", [(1, 'Cardiology', 10), (2, None, None)])
+    conn.executemany("INSERT INTO appointments VALUES (?, ?, ?, ?, ?)", [
+        (1, 1, at(0).isoformat(), None, 20.0),
+        (2, 1, at(10).isoformat(), at(5).isoformat(), 10.0),
+        (3, 2, at(10).isoformat(), None, 15.0),
+        # Still open: not part of the history
+        (4, 2, at(30).isoformat(), None, None),
+        # The next day starts from an idle doctor
+        (5, 1, at(24 * 60).isoformat(), None, 10.0),
+    ])
+    conn.executemany("INSERT INTO feedback (appointment_id, actual_wait) VALUES (?, ?)", [(2, 12.0), (2, 16.0)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_stream_history_replays_each_doctors_day(db_path):
+    chunks = list(stream_history(db_path, '2026-01-01', '2026-02-01', chunksize=2))
+    assert [len(chunk['id']) for chunk in chunks] == [2, 2]
+    rows = {key: sum((chunk[key] for chunk in chunks), []) for key in chunks[0]}
+    assert rows['id'] == [1, 2, 3, 5]
+    assert rows['queue_length'] == [0, 1, 0, 0]
+    # Appointment 2 has reported waits (averaged, its replay says 15); the others are replayed
+    assert rows['observed_wait'] == [0.0, 14.0, 0.0, 0.0]
+    assert rows['reported'] == [False, True, False, False]
+    assert rows['specialty'] == ['Cardiology', 'Cardiology', 'General', 'Cardiology']
+    assert rows['doctor_experience'] == [10, 10, 0, 10]
+    assert rows['slot_time'][-1].date() == date(2026, 1, 13)
+
+
+def test_scorecard_accumulates_across_chunks():
+    observed = np.array([10.0, 20.0, 30.0, 40.0])
+    mean = np.array([12.0, 18.0, 30.0, 50.0])
+    low, high = mean - 5, mean + 5
+    tail_risk = np.array([0.05, 0.15, 0.95, 0.95])
+    card = Scorecard(threshold=25)
+    card.add(observed[:2], np.array([True, False]), mean[:2], low[:2], high[:2], tail_risk[:2])
+    card.add(observed[2:], np.array([False, False]), mean[2:], low[2:], high[2:], tail_risk[2:])
+    summary = card.summary(0.9)
+    assert summary['rows'] == 4 and summary['rows_with_reported_wait'] == 1
+    assert summary['mae'] == pytest.approx(3.5)
+    assert summary['rmse'] == pytest.approx(np.sqrt(27))
+    assert summary['bias'] == pytest.approx(2.5)
+    assert summary['interval']['coverage'] == pytest.approx(0.75)
+    exceeded = observed > 25
+    assert summary['tail_risk']['brier'] == pytest.approx(np.mean((tail_risk - exceeded) ** 2))
+    assert [row['count'] for row in summary['tail_risk']['reliability']] == [1, 1, 2]
+    assert Scorecard(25).summary(0.9) == {'rows': 0}
@@ -0,0 +1,43 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from columnar_store import export_query, load_columns, read_schema, rolling_std_by_group
+
+
+@pytest.mark.parametrize('window', [2, 3, 10])
+def test_rolling_std_matches_pandas(window):
+    rng = np.random.default_rng(window)
+    groups = rng.integers(0, 5, 500)
+    values = rng.normal(20, 6, 500) + 1000 * groups
+    data = pd.DataFrame({'group': groups, 'value': values})
+    expected = data.groupby('group')['value'].transform(lambda s: s.rolling(window).std()).fillna(1.0)
+    np.testing.assert_allclose(rolling_std_by_group(groups, values, window), expected.to_numpy(), rtol=1e-7, atol=1e-9)
+
+
+def test_rolling_std_edge_cases():
+    assert len(rolling_std_by_group(np.array([], dtype=int), np.array([]), 3)) == 0
+    # Groups shorter than the window keep the fill value; a constant run has zero spread
+    result = rolling_std_by_group(np.array([1, 2, 1, 1]), np.array([5.0, 7.0, 5.0, 5.0]), 3, fill_value=-1.0)
+    np.testing.assert_allclose(result, [-1.0, -1.0, -1.0, 0.0])
+
+
+def test_export_query_round_trips_in_chunks(tmp_path):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (id INTEGER, duration REAL)')
+    conn.executemany('INSERT INTO t VALUES (?, ?)', [(i, i / 4) for i in range(1, 251)])
+    schema = {'id': np.int32, 'duration': np.float32}
+
+    written = export_query(conn, 'SELECT id, duration FROM t WHERE id > ? ORDER BY id', str(tmp_path), schema,
+                           params=(50,), chunksize=64)
+    assert written == 200
+    assert read_schema(str(tmp_path))['columns'] == ['id', 'duration']
+
+    columns = load_columns(str(tmp_path))
+    assert isinstance(columns['id'], np.memmap)
+    assert columns['id'].dtype == np.int32 and columns['duration'].dtype == np.float32
+    np.testing.assert_array_equal(columns['id'], np.arange(51, 251))
+    np.testing.assert_allclose(columns['duration'], np.arange(51, 251) / 4)
+    assert list(load_columns(str(tmp_path), ['duration'])) == ['duration']
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+from compiled_forest import (LEAF_QUANTILE_POINTS, CompiledForest, CompiledWaitTimePredictor, export_bundle,
+                             flatten_forest, leaf_quantile_table, verify_bundle)
+from feature_pipeline import WAIT_TIME_FEATURES
+
+
+@pytest.fixture(scope='module')
+def training_data():
+    rng = np.random.default_rng(0)
+    n = 2000
+    features = np.column_stack([
+        rng.integers(0, 30, n),           # total_queue_length
+        rng.integers(0, 10, n),           # patients_at_current_stage
+        rng.integers(1, 5, n),            # staff_at_current_stage
+        rng.uniform(0, 1, n),             # hospital_occupancy
+        rng.integers(18, 90, n),          # patient_age
+        rng.integers(0, 10, n),           # traffic_level
+        rng.integers(0, 30, n),           # doctor_experience
+        rng.uniform(8, 18, n),            # time_of_day
+        rng.integers(0, 7, n),            # day_of_week
+        rng.integers(0, 3, n),            # time_slot_encoded
+    ]).astype(np.float64)
+    target = 2 * features[:, 0] + 10 * features[:, 3] + rng.normal(0, 3, n)
+    return features, target
+
+
+@pytest.fixture(scope='module')
+def fitted(training_data):
+    features, target = training_data
+    pipeline = WAIT_TIME_FEATURES.fit(features)
+    features_scaled = pipeline.transform(features)
+    model_mean = RandomForestRegressor(n_estimators=15, random_state=0).fit(features_scaled, target)
+    model_variance = RandomForestRegressor(n_estimators=10, random_state=1).fit(features_scaled, np.abs(target - target.mean()))
+    return pipeline, model_mean, model_variance
+
+
+def test_compiled_forest_matches_sklearn(training_data, fitted):
+    features, _ = training_data
+    pipeline, model_mean, _ = fitted
+    features_scaled = pipeline.transform(features)
+    forest = CompiledForest({f'mean_{key}': array for key, array in flatten_forest(model_mean).items()}, 'mean')
+    np.testing.assert_allclose(forest.predict(features_scaled), model_mean.predict(features_scaled), rtol=1e-9)
+    np.testing.assert_array_equal(forest.apply(features_scaled, trees=[3])[:, 0],
+                                  forest.apply(features_scaled)[:, 3])
+
+
+def test_bundle_with_variance_forest_round_trips(tmp_path, training_data, fitted):
+    features, _ = training_data
+    pipeline, model_mean, model_variance = fitted
+    path = str(tmp_path / 'bundle.npz')
+    export_bundle(path, model_mean, model_variance, pipeline)
+    assert verify_bundle(path, model_mean, model_variance, pipeline, features)
+
+    predictor = CompiledWaitTimePredictor(path, pipeline=WAIT_TIME_FEATURES)
+    assert not predictor.has_quantiles
+    mean, variance = predictor.predict(features[0])
+    features_scaled = pipeline.transform(features[:1])
+    assert mean == pytest.approx(model_mean.predict(features_scaled)[0])
+    assert variance == pytest.approx(model_variance.predict(features_scaled)[0])
+
+
+def test_verify_bundle_rejects_another_model(tmp_path, training_data, fitted):
+    features, target = training_data
+    pipeline, model_mean, _ = fitted
+    path = str(tmp_path / 'bundle.npz')
+    export_bundle(path, model_mean, None, pipeline, training_data=(features, target))
+    other = RandomForestRegressor(n_estimators=15, random_state=7).fit(pipeline.transform(features), target)
+    assert not verify_bundle(path, other, None, pipeline, features)
+
+
+def test_leaf_quantiles_bracket_the_targets(tmp_path, training_data, fitted):
+    features, target = training_data
+    pipeline, model_mean, _ = fitted
+    path = str(tmp_path / 'bundle.npz')
+    export_bundle(path, model_mean, None, pipeline, training_data=(features, target))
+    assert verify_bundle(path, model_mean, None, pipeline, features)
+
+    predictor = CompiledWaitTimePredictor(path, pipeline=WAIT_TIME_FEATURES)
+    assert predictor.has_quantiles
+    distribution = predictor.predict_distribution(features, thresholds=(20, 40))
+    quantiles = distribution['quantiles']
+    assert distribution['levels'] == (0.05, 0.5, 0.9, 0.95)
+    assert np.all(np.diff(quantiles, axis=1) >= 0)
+    # In-sample, the leaves hold the targets themselves: p5..p95 covers most of them
+    covered = (target >= quantiles[:, 0]) & (target <= quantiles[:, -1])
+    assert covered.mean() > 0.8
+    assert np.all(np.diff(distribution['exceedance'], axis=1) <= 0)
+    np.testing.assert_allclose(distribution['mean'], model_mean.predict(pipeline.transform(features)), rtol=1e-9)
+
+
+def test_leaf_quantile_table_summarises_each_leaf(training_data, fitted):
+    features, target = training_data
+    pipeline, model_mean, _ = fitted
+    features_scaled = pipeline.transform(features)
+    forest = CompiledForest({f'mean_{key}': array for key, array in flatten_forest(model_mean).items()}, 'mean')
+    leaf_slot, table = leaf_quantile_table(forest, features_scaled, target)
+
+    leaves = forest.apply(features_scaled, trees=[0])[:, 0]
+    leaf = np.bincount(leaves).argmax()
+    reached = np.sort(target[leaves == leaf])
+    levels = (np.arange(LEAF_QUANTILE_POINTS) + 0.5) / LEAF_QUANTILE_POINTS
+    np.testing.assert_allclose(table[leaf_slot[leaf]], np.quantile(reached, levels), rtol=1e-5)
+    assert np.all(leaf_slot[forest.left != np.arange(len(forest.left))] == -1)
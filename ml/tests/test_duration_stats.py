@@ -0,0 +1,128 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from appointment_feed import MAX_OPEN_AGE, fetch_new_appointments
+from duration_stats import EWM_ALPHA, DurationStats, DurationStatsStore, P2Quantile
+
+NOW = datetime(2026, 1, 20, 12, 0)
+
+
+@pytest.fixture(scope='module')
+def durations():
+    return np.random.default_rng(5).lognormal(np.log(14), 0.4, 20000)
+
+
+def test_welford_moments_match_numpy(durations):
+    stats = DurationStats()
+    for duration in durations:
+        stats.add(duration)
+    assert stats.count == len(durations)
+    assert stats.mean == pytest.approx(durations.mean(), rel=1e-12)
+    assert stats.variance == pytest.approx(durations.var(ddof=1), rel=1e-9)
+
+
+def test_exponentially_weighted_moments_match_pandas(durations):
+    stats = DurationStats()
+    for duration in durations[:500]:
+        stats.add(duration)
+    ewm = pd.Series(durations[:500]).ewm(alpha=EWM_ALPHA, adjust=False)
+    assert stats.ewm_mean == pytest.approx(ewm.mean().iloc[-1], rel=1e-9)
+    assert stats.ewm_var == pytest.approx(ewm.var(bias=True).iloc[-1], rel=1e-9)
+
+
+@pytest.mark.parametrize('p', [0.5, 0.9])
+def test_p_square_tracks_the_exact_quantile(durations, p):
+    estimate = P2Quantile(p)
+    for duration in durations:
+        estimate.add(duration)
+    exact = np.quantile(durations, p)
+    assert estimate.value() == pytest.approx(exact, rel=0.02)
+
+
+def test_p_square_is_exact_below_five_values():
+    estimate = P2Quantile(0.5)
+    assert estimate.value() is None
+    for value in (30.0, 10.0, 20.0):
+        estimate.add(value)
+    assert estimate.value() == 20.0
+
+
+def test_saved_state_resumes_the_same_stream(durations):
+    whole, first = DurationStats(), DurationStats()
+    for duration in durations[:1000]:
+        whole.add(duration)
+    for duration in durations[:400]:
+        first.add(duration)
+    resumed = DurationStats(first.to_dict())
+    for duration in durations[400:1000]:
+        resumed.add(duration)
+    assert resumed.summary() == pytest.approx(whole.summary(), rel=1e-9)
+
+
+def create_db(path, durations):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE doctors (id INTEGER PRIMARY KEY, specialty TEXT)")
+    conn.execute("CREATE TABLE appointments (id INTEGER PRIMARY KEY, doctor_id INTEGER, appointment_time TEXT, "
+                 "actual_duration REAL, status TEXT)")
+    conn.executemany("INSERT INTO doctors VALUES (?, ?)", [(1, 'General'), (2, 'General'), (3, 'Cardiology')])
+    conn.executemany("INSERT INTO appointments VALUES (?, ?, ?, ?, 'completed')",
+                     [(i + 1, 1 + i % 2, (NOW - timedelta(hours=i)).isoformat(), float(d)) for i, d in enumerate(durations)])
+    conn.commit()
+    return conn
+
+
+def test_incremental_ingestion_matches_a_rebuild(tmp_path, durations):
+    conn = create_db(str(tmp_path / 'queue.db'), durations[:60])
+    store = DurationStatsStore(str(tmp_path / 'stats.json'))
+    assert store.ingest(conn, NOW) == 60
+    store.save()
+
+    conn.executemany("INSERT INTO appointments VALUES (?, 1, ?, ?, 'completed')",
+                     [(61 + i, NOW.isoformat(), float(d)) for i, d in enumerate(durations[60:100])])
+    conn.commit()
+    reloaded = DurationStatsStore(str(tmp_path / 'stats.json'))
+    assert reloaded.ingest(conn, NOW) == 40
+    assert reloaded.ingest(conn, NOW) == 0
+
+    rebuilt = DurationStatsStore(str(tmp_path / 'missing.json'))
+    rebuilt.ingest(conn, NOW)
+    for key, stats in rebuilt.stats.items():
+        assert reloaded.stats[key].summary() == pytest.approx(stats.summary(), rel=1e-9)
+    assert reloaded.stats['specialty:General'].count == 100
+    doctor_1 = durations[:100][np.r_[0:60:2, 60:100]]
+    assert reloaded.get(doctor_id=1).mean == pytest.approx(doctor_1.mean())
+
+
+def test_lookup_falls_back_to_the_specialty(tmp_path, durations):
+    store = DurationStatsStore(str(tmp_path / 'stats.json'))
+    store.ingest(create_db(str(tmp_path / 'queue.db'), durations[:20]), NOW)
+    assert store.get(doctor_id=1) is store.stats['doctor:1']
+    assert store.get(doctor_id=9, specialty='General') is store.stats['specialty:General']
+    assert store.get(doctor_id=3, specialty='Cardiology') is None
+    assert store.average_duration(doctor_id=2) == store.stats['doctor:2'].ewm_mean
+
+
+def test_readers_pick_up_a_newer_file(tmp_path, durations):
+    path = str(tmp_path / 'stats.json')
+    reader = DurationStatsStore(path, check_interval=0)
+    assert reader.get(doctor_id=1) is None
+    writer = DurationStatsStore(path)
+    writer.ingest(create_db(str(tmp_path / 'queue.db'), durations[:10]), NOW)
+    writer.save()
+    assert reader.get(doctor_id=1).count == 5
+
+
+def test_stale_open_appointments_stop_holding_the_mark_back(tmp_path):
+    conn = create_db(str(tmp_path / 'queue.db'), [12.0, 15.0])
+    conn.execute("INSERT INTO appointments VALUES (3, 1, ?, NULL, 'booked')", ((NOW - MAX_OPEN_AGE - timedelta(hours=1)).isoformat(),))
+    conn.execute("INSERT INTO appointments VALUES (4, 1, ?, 9.0, 'completed')", (NOW.isoformat(),))
+    conn.commit()
+    store = DurationStatsStore(str(tmp_path / 'stats.json'))
+    assert [row[0] for row in fetch_new_appointments(conn, store, NOW)] == [1, 2, 4]
+    # Never completed and too old to: skipped for good
+    assert store.last_appointment_id == 4
+    assert store.processed_ids == set()
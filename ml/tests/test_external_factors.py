@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from external_factors import (SNAPSHOT_DTYPE, FactorIngestor, FileFactorSource, LatestFactors, SnapshotWriter,
+                              factors_at, load_snapshots)
+
+DAY = datetime(2026, 1, 17)
+
+
+def epoch(at):
+    return int(at.replace(tzinfo=timezone.utc).timestamp())
+
+
+def snapshots(*rows):
+    """(minutes after DAY, occupancy, traffic) rows as snapshot records"""
+    records = np.zeros(len(rows), dtype=SNAPSHOT_DTYPE)
+    for record, (minutes, occupancy, traffic) in zip(records, rows):
+        record['time'] = epoch(DAY + timedelta(minutes=minutes))
+        record['hospital_occupancy'] = occupancy
+        record['traffic_level'] = traffic
+    return records
+
+
+def test_factors_at_takes_the_latest_snapshot_at_or_before_each_time():
+    records = snapshots((0, 0.2, 1), (10, 0.4, 3), (20, 0.6, 5))
+    times = np.array([DAY - timedelta(minutes=1), DAY, DAY + timedelta(minutes=9, seconds=59),
+                      DAY + timedelta(minutes=10), DAY + timedelta(minutes=34)], dtype='datetime64[s]')
+    joined = factors_at(times, records)
+    np.testing.assert_allclose(joined['hospital_occupancy'], [np.nan, 0.2, 0.2, 0.4, 0.6], rtol=1e-6)
+    np.testing.assert_array_equal(joined['traffic_level'], [np.nan, 1, 1, 3, 5])
+    # Epoch seconds join the same way
+    np.testing.assert_array_equal(factors_at(times.astype(np.int64), records)['traffic_level'], joined['traffic_level'])
+
+
+def test_factors_at_ignores_stale_snapshots():
+    records = snapshots((0, 0.2, 1), (60, 0.4, 3))
+    times = np.array([DAY + timedelta(minutes=m) for m in (15, 16, 59, 75, 76)], dtype='datetime64[s]')
+    joined = factors_at(times, records, max_age=timedelta(minutes=15))
+    # A gap in ingestion must not carry an hour-old value forward
+    np.testing.assert_array_equal(joined['traffic_level'], [1, np.nan, np.nan, 3, np.nan])
+    assert np.isnan(factors_at(times, snapshots())['traffic_level']).all()
+
+
+def test_snapshots_round_trip_across_days(tmp_path):
+    writer = SnapshotWriter(str(tmp_path))
+    times = [DAY + timedelta(hours=23, minutes=50), DAY + timedelta(hours=23, minutes=55), DAY + timedelta(days=1, minutes=5)]
+    for i, at in enumerate(times):
+        writer.append({'hospital_occupancy': 0.1 * (i + 1), 'queued': i, 'traffic_level': 2.0, 'weather_condition': 'rain'}, at)
+    # A record still being appended is not read
+    with open(os.path.join(str(tmp_path), f'{times[-1]:%Y-%m-%d}.bin'), 'ab') as f:
+        f.write(b'\x00' * 7)
+
+    loaded = load_snapshots(DAY, DAY + timedelta(days=2), str(tmp_path))
+    assert loaded['time'].tolist() == [epoch(at) for at in times]
+    assert loaded['queued'].tolist() == [0, 1, 2]
+    assert set(loaded['weather_code']) == {2}
+    assert len(load_snapshots(DAY + timedelta(hours=23, minutes=52), DAY + timedelta(days=1), str(tmp_path))) == 1
+    assert len(load_snapshots(DAY + timedelta(days=5), DAY + timedelta(days=6), str(tmp_path))) == 0
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE doctors (id INTEGER PRIMARY KEY, is_active INTEGER)")
+    conn.execute("CREATE TABLE queue (id INTEGER PRIMARY KEY, stage TEXT)")
+    conn.execute("CREATE TABLE appointments (id INTEGER PRIMARY KEY, status TEXT, appointment_time TEXT)")
+    conn.execute("CREATE TABLE external_factors (id INTEGER PRIMARY KEY, date TEXT NOT NULL, weather_condition TEXT, "
+                 "traffic_level INTEGER DEFAULT 0, hospital_occupancy REAL DEFAULT 0.0)")
+    conn.executemany("INSERT INTO doctors (is_active) VALUES (?)", [(1,), (1,), (0,)])
+    conn.executemany("INSERT INTO queue (stage) VALUES (?)", [('waiting',), (None,), ('consultation',), ('payment',)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def daily_row(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT date, weather_condition, traffic_level, hospital_occupancy FROM external_factors").fetchall()
+
+
+def test_ingestion_without_a_source_keeps_traffic_and_weather(db_path, tmp_path):
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO external_factors (date, weather_condition, traffic_level) VALUES (?, 'snow', 7)", (today,))
+    ingestor = FactorIngestor(db_path, writer=SnapshotWriter(str(tmp_path / 'factors')))
+    asyncio.run(ingestor.run_once())
+    # 3 patients on site for 2 active doctors of 8 each
+    assert ingestor.latest['hospital_occupancy'] == pytest.approx(3 / 16)
+    assert daily_row(db_path) == [(today, 'snow', 7, round(3 / 16, 3))]
+
+
+def test_ingestion_with_a_source_writes_every_factor(db_path, tmp_path):
+    source_path = tmp_path / 'traffic.json'
+    source_path.write_text(json.dumps({'traffic_level': 14, 'weather_condition': 'fog'}))
+    factors_dir = str(tmp_path / 'factors')
+    ingestor = FactorIngestor(db_path, source=FileFactorSource(str(source_path)), writer=SnapshotWriter(factors_dir))
+    asyncio.run(ingestor.run_once())
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    # Traffic is clamped to 0-10
+    assert daily_row(db_path) == [(today, 'fog', 10, round(3 / 16, 3))]
+
+    latest = LatestFactors(factors_dir).get()
+    assert latest['traffic_level'] == 10.0 and latest['queued'] == 2 and latest['in_service'] == 1
+    stale = LatestFactors(factors_dir, max_age=timedelta(0))
+    assert stale.get() == {}
+
+
+def test_a_failing_tick_does_not_stop_the_poller(db_path, tmp_path):
+    ingestor = FactorIngestor(db_path, writer=SnapshotWriter(str(tmp_path / 'factors')))
+    calls = []
+
+    async def flaky():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise OSError('No space left on device')
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(ingestor._every(0.01, flaky), timeout=0.2)
+
+    asyncio.run(run())
+    assert len(calls) > 2
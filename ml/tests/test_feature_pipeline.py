@@ -0,0 +1,108 @@
+import json
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+
+from compiled_forest import CompiledWaitTimePredictor, export_bundle
+from feature_pipeline import HISTORY_FEATURES, WAIT_TIME_FEATURES, FeaturePipeline, load_pipeline
+
+REQUESTS = [
+    {'total_queue_length': 8, 'patients_at_current_stage': 3, 'staff_at_current_stage': 2, 'hospital_occupancy': 0.7,
+     'patient_age': 54, 'traffic_level': 4, 'doctor_experience': 12, 'slot_time': '2026-01-17T14:30:00Z'},
+    {'total_queue_length': 0, 'patients_at_current_stage': 0, 'staff_at_current_stage': 1, 'hospital_occupancy': 0.1,
+     'patient_age': 23, 'traffic_level': 0, 'doctor_experience': 3, 'slot_time': '2026-01-19T08:05:00+05:30'},
+    {'total_queue_length': 20, 'patients_at_current_stage': 9, 'staff_at_current_stage': 3, 'hospital_occupancy': 0.95,
+     'patient_age': 80, 'traffic_level': 9, 'doctor_experience': 30, 'slot_time': '2026-01-21T18:45:00'},
+]
+
+
+@pytest.fixture(scope='module')
+def training_matrix():
+    rng = np.random.default_rng(4)
+    frame = pd.DataFrame({
+        'total_queue_length': rng.integers(0, 30, 300), 'patients_at_current_stage': rng.integers(0, 10, 300),
+        'staff_at_current_stage': rng.integers(1, 5, 300), 'hospital_occupancy': rng.uniform(0, 1, 300),
+        'patient_age': rng.integers(18, 90, 300), 'traffic_level': rng.integers(0, 10, 300),
+        'doctor_experience': rng.integers(0, 30, 300), 'time_of_day': rng.uniform(8, 20, 300),
+        'day_of_week': rng.integers(0, 7, 300),
+    })
+    return WAIT_TIME_FEATURES.matrix(frame)
+
+
+def test_row_and_matrix_build_the_same_features():
+    rows = np.array([WAIT_TIME_FEATURES.row(request) for request in REQUESTS], dtype=float)
+    columns = {field: [request[field] for request in REQUESTS] for field in REQUESTS[0]}
+    np.testing.assert_array_equal(WAIT_TIME_FEATURES.matrix(columns), rows)
+    # Wall-clock time of the slot, whatever its offset; afternoon slot
+    assert rows[0, -3:].tolist() == [14.5, 5, 1]
+    assert rows[1, -3:].tolist() == [8 + 5 / 60, 0, 0]
+
+
+def test_unknown_category_is_rejected():
+    with pytest.raises(ValueError):
+        WAIT_TIME_FEATURES.row({**REQUESTS[0], 'time_of_day': 9.0, 'day_of_week': 1, 'time_slot': 'night'})
+
+
+def test_scaling_matches_standard_scaler(training_matrix):
+    pipeline = WAIT_TIME_FEATURES.fit(training_matrix)
+    scaler = StandardScaler().fit(training_matrix)
+    np.testing.assert_allclose(pipeline.transform(training_matrix), scaler.transform(training_matrix), rtol=1e-9, atol=1e-12)
+    assert pipeline.transform(training_matrix.astype(np.float32)).dtype == np.float32
+    with pytest.raises(ValueError):
+        WAIT_TIME_FEATURES.transform(training_matrix)
+
+
+def test_saved_pipeline_round_trips(tmp_path, training_matrix):
+    pipeline = WAIT_TIME_FEATURES.fit(training_matrix)
+    path = str(tmp_path / 'feature_pipeline.json')
+    pipeline.save(path)
+    loaded = load_pipeline(path)
+    WAIT_TIME_FEATURES.check(loaded)
+    np.testing.assert_array_equal(loaded.transform(training_matrix), pipeline.transform(training_matrix))
+
+
+def test_edited_schema_fails_its_hash(tmp_path, training_matrix):
+    path = str(tmp_path / 'feature_pipeline.json')
+    WAIT_TIME_FEATURES.fit(training_matrix).save(path)
+    with open(path) as f:
+        data = json.load(f)
+    data['columns'][0], data['columns'][1] = data['columns'][1], data['columns'][0]
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    with pytest.raises(ValueError, match='schema hash'):
+        load_pipeline(path)
+
+
+def test_other_schema_is_refused():
+    with pytest.raises(ValueError, match='wait_time_history'):
+        WAIT_TIME_FEATURES.check(HISTORY_FEATURES)
+    reordered = FeaturePipeline('wait_time', list(reversed(WAIT_TIME_FEATURES.columns)), WAIT_TIME_FEATURES.encodings)
+    with pytest.raises(ValueError):
+        WAIT_TIME_FEATURES.check(reordered)
+
+
+def test_legacy_scaler_pickle(tmp_path, training_matrix):
+    path = str(tmp_path / 'scaler.pkl')
+    joblib.dump(StandardScaler().fit(training_matrix), path)
+    pipeline = load_pipeline(path, default=WAIT_TIME_FEATURES)
+    assert pipeline.schema_hash == WAIT_TIME_FEATURES.schema_hash and pipeline.fitted
+    with pytest.raises(ValueError):
+        load_pipeline(path, default=HISTORY_FEATURES)
+    with pytest.raises(ValueError):
+        load_pipeline(path)
+
+
+def test_compiled_bundle_for_other_features_is_refused(tmp_path):
+    rng = np.random.default_rng(6)
+    features = rng.normal(size=(200, len(HISTORY_FEATURES.columns)))
+    pipeline = HISTORY_FEATURES.fit(features)
+    model = RandomForestRegressor(n_estimators=3, random_state=0).fit(pipeline.transform(features), features[:, 0])
+    path = str(tmp_path / 'bundle.npz')
+    export_bundle(path, model, model, pipeline)
+    assert CompiledWaitTimePredictor(path, pipeline=HISTORY_FEATURES).pipeline.schema_hash == HISTORY_FEATURES.schema_hash
+    with pytest.raises(ValueError):
+        CompiledWaitTimePredictor(path, pipeline=WAIT_TIME_FEATURES)
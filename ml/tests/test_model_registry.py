@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+from model_registry import ModelRegistry
+
+
+def publish(registry, content, **kwargs):
+    with registry.publish(source='test', **kwargs) as bundle:
+        with open(bundle.path('mean.pkl'), 'w') as f:
+            f.write(content)
+    return bundle.version
+
+
+def read_current(registry):
+    with open(registry.path('mean.pkl')) as f:
+        return f.read()
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry('wait_time', root=str(tmp_path))
+
+
+def test_empty_registry(registry):
+    assert registry.current_version() is None
+    assert registry.path('mean.pkl') is None
+    assert registry.versions() == []
+    with pytest.raises(ValueError):
+        registry.rollback()
+
+
+def test_publish_activates_and_records_manifest(registry):
+    first = publish(registry, 'v1', metrics={'rmse': 1.5})
+    assert registry.current_version() == first
+    assert read_current(registry) == 'v1'
+    manifest = registry.manifest()
+    assert manifest['metrics'] == {'rmse': 1.5}
+    assert manifest['previous'] is None
+    assert set(manifest['files']) == {'mean.pkl'}
+    assert registry.verify()
+
+    second = publish(registry, 'v2')
+    assert registry.manifest()['previous'] == first
+    assert read_current(registry) == 'v2'
+    assert registry.versions() == sorted([first, second])
+
+
+def test_failed_publish_leaves_nothing_behind(registry):
+    first = publish(registry, 'v1')
+    with pytest.raises(RuntimeError):
+        with registry.publish() as bundle:
+            with open(bundle.path('mean.pkl'), 'w') as f:
+                f.write('half written')
+            raise RuntimeError('training failed')
+    assert registry.versions() == [first]
+    assert registry.current_version() == first
+    assert not [name for name in os.listdir(registry.dir) if name.startswith('.staging-')]
+
+
+def test_publish_without_activation(registry):
+    first = publish(registry, 'v1')
+    staged = publish(registry, 'v2', activate=False)
+    assert registry.current_version() == first
+    registry.activate(staged)
+    assert read_current(registry) == 'v2'
+    with pytest.raises(ValueError):
+        registry.activate('no-such-version')
+
+
+def test_rollback_follows_activation_history(registry):
+    first = publish(registry, 'v1')
+    second = publish(registry, 'v2')
+    third = publish(registry, 'v3')
+    assert registry.rollback() == second
+    assert read_current(registry) == 'v2'
+    # Rolling back again keeps walking back instead of returning to the newest version
+    assert registry.rollback() == first
+    assert read_current(registry) == 'v1'
+    with pytest.raises(ValueError):
+        registry.rollback()
+    assert registry.rollback(third) == third
+    assert [entry['version'] for entry in registry.history()] == [first, second, third, second, first, third]
+
+
+def test_rollback_after_activating_an_older_version(registry):
+    first = publish(registry, 'v1')
+    second = publish(registry, 'v2')
+    registry.activate(first)
+    # The activation is undone, not the publish before it
+    assert registry.rollback() == second
+    assert registry.rollback() == first
+
+
+def test_verify_detects_modified_files(registry):
+    publish(registry, 'v1')
+    with open(registry.path('mean.pkl'), 'w') as f:
+        f.write('tampered')
+    assert not registry.verify()
+
+
+def test_prune_keeps_the_current_version(registry):
+    versions = [publish(registry, f'v{i}') for i in range(4)]
+    registry.activate(versions[0])
+    removed = registry.prune(keep=1)
+    remaining = registry.versions()
+    # The newest version, the current one and the one a rollback returns to
+    assert {versions[0], versions[3]} <= set(remaining) and len(remaining) <= 3
+    assert sorted(remaining + removed) == sorted(versions)
+
+
+def test_prune_keeps_the_rollback_target(registry):
+    versions = [publish(registry, f'v{i}') for i in range(5)]
+    registry.rollback()
+    assert registry.current_version() == versions[3]
+    registry.prune(keep=1)
+    remaining = registry.versions()
+    assert {versions[2], versions[3]} <= set(remaining) and len(remaining) <= 3
+    assert registry.rollback() == versions[2]
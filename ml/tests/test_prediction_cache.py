@@ -0,0 +1,75 @@
+from prediction_cache import PredictionCache, quantize
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_quantize_rounds_to_each_step():
+    assert quantize([0.512, 14.04, 3], [0.01, 5 / 60, None]) == (0.51, 14.0, 3)
+    assert quantize([0.514], [0.01]) == quantize([0.506], [0.01])
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = PredictionCache(ttl=10, clock=clock)
+    cache.put('a', 1)
+    clock.now = 9.9
+    assert cache.get('a') == 1
+    clock.now = 10.0
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PredictionCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_get_or_compute_computes_once():
+    cache = PredictionCache()
+    calls = []
+    for _ in range(3):
+        assert cache.get_or_compute('key', lambda: calls.append(1) or 42) == 42
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 2
+
+
+def test_changed_model_file_invalidates_and_runs_hooks(tmp_path):
+    model = tmp_path / 'model.npz'
+    model.write_bytes(b'v1')
+    clock = FakeClock()
+    cache = PredictionCache(watch_paths=[str(model)], check_interval=1.0, clock=clock)
+    reloads = []
+    cache.on_invalidate(lambda: reloads.append(1))
+    cache.put('a', 1)
+
+    model.write_bytes(b'version 2')
+    # Not rechecked within check_interval
+    assert cache.get('a') == 1
+    clock.now = 1.0
+    assert cache.get('a') is None
+    assert reloads == [1]
+    assert cache.stats()['invalidations'] == 1
+    assert not cache.check_sources(force=True)
+
+
+def test_clear_does_not_count_as_invalidation():
+    cache = PredictionCache()
+    reloads = []
+    cache.on_invalidate(lambda: reloads.append(1))
+    cache.put('a', 1)
+    cache.clear()
+    assert cache.get('a') is None
+    assert reloads == []
+    assert cache.stats()['invalidations'] == 0
@@ -0,0 +1,94 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from queue_forecast import TransferStats, forecast
+
+NOW = datetime(2026, 1, 17, 10, 0)
+
+
+def snapshot(rows):
+    """rows: (id, queue_type_id, doctor_id, position, stage, estimated_duration[, transferred_from])"""
+    rows = [row + (0,) * (7 - len(row)) for row in rows]
+    ids, types, doctors, positions, stages, durations, transferred_from = zip(*rows)
+    return {
+        'id': np.array(ids, dtype=np.int64),
+        'queue_type_id': np.array(types, dtype=np.int64),
+        'doctor_id': np.array(doctors, dtype=np.int64),
+        'position': np.array(positions, dtype=np.int64),
+        'stage': np.array(stages, dtype=object),
+        'estimated_duration': np.array(durations, dtype=np.float64),
+        'stage_start_time': np.array([None] * len(rows), dtype=object),
+        'transferred_from': np.array(transferred_from, dtype=np.int64),
+    }
+
+
+def test_waits_per_queue_in_position_order():
+    # Two doctors' consultation queues, rows out of order, plus a shared lab queue with two servers
+    rows = [
+        (1, 1, 7, 2, 'waiting', 10.0),
+        (2, 1, 7, 1, 'waiting', 15.0),
+        (3, 1, 8, 1, 'waiting', 20.0),
+        (4, 1, 7, 3, 'waiting', 5.0),
+        (5, 2, 0, 1, 'waiting', 6.0),
+        (6, 2, 0, 2, 'waiting', 6.0),
+        (7, 2, 0, 3, 'waiting', 6.0),
+        (8, 2, 0, 4, 'payment', 6.0),
+        (9, 2, 0, 5, 'waiting', 6.0),
+    ]
+    ids, waits, summaries = forecast(snapshot(rows), NOW, servers_by_type={2: 2})
+    by_id = dict(zip(ids.tolist(), waits.tolist()))
+    assert by_id[2] == 0 and by_id[1] == 15 and by_id[4] == 25
+    assert by_id[3] == 0
+    # Two lab servers: the first two start at once; finished rows add no work
+    assert by_id[5] == 0 and by_id[6] == 0
+    assert by_id[7] == pytest.approx(6.0)
+    assert by_id[9] == pytest.approx(9.0)
+
+    lab = next(summary for summary in summaries if summary['queue_type_id'] == 2)
+    assert lab['servers'] == 2 and lab['waiting'] == 4 and lab['doctor_id'] is None
+    assert lab['load_minutes'] == pytest.approx(24.0)
+    assert lab['next_wait_minutes'] == pytest.approx(12.0)
+    assert len(summaries) == 3
+
+
+def test_transfers_are_learned_and_projected():
+    stats = TransferStats(path=None)
+    stats.observe(snapshot([(1, 1, 7, 1, 'consultation', 10.0), (2, 1, 7, 2, 'waiting', 10.0)]))
+    # Row 1 left the consultation queue for the lab
+    gone, transferred = stats.observe(snapshot([(2, 1, 7, 1, 'waiting', 10.0), (3, 2, 0, 1, 'waiting', 6.0, 1)]))
+    assert (gone, transferred) == (1, 1)
+    matrix = stats.matrix([1, 2])
+    assert matrix[0, 1] == pytest.approx(1 / (1 + 1))
+    assert matrix[1].sum() == 0
+
+    current = snapshot([(4, 1, 7, 1, 'waiting', 10.0), (5, 1, 7, 2, 'waiting', 10.0)])
+    _, _, summaries = forecast(current, NOW, matrix, [1, 2], horizon=60.0)
+    lab = next(summary for summary in summaries if summary['queue_type_id'] == 2)
+    # Both consultations end within the hour, each moving on to the lab with odds 0.5
+    assert lab['expected_transfers_in'] == pytest.approx(1.0)
+    assert lab['waiting'] == 0
+
+
+def test_single_patient_waits_nothing():
+    ids, waits, summaries = forecast(snapshot([(1, 1, 7, 1, 'waiting', 10.0)]), NOW)
+    assert waits.tolist() == [0.0] and len(summaries) == 1
+
+
+def test_bulk_forecast_agrees_with_queue_forecaster():
+    import os
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backend', 'src', 'services'))
+    from ml_predictions import QueueForecaster
+
+    rows = [(1, 1, 7, 1, 'consultation', 12.0), (2, 1, 7, 2, 'payment', 8.0),
+            (3, 1, 7, 3, 'waiting', 15.0), (4, 1, 7, 4, 'waiting', 5.0)]
+    bulk = snapshot(rows)
+    bulk['stage_start_time'][0] = '2026-01-17 09:55:00'
+    ids, waits, _ = forecast(bulk, NOW)
+
+    queue = [{'id': row[0], 'stage': row[4], 'estimated_duration': row[5]} for row in rows]
+    queue[0]['stage_start_time'] = '2026-01-17 09:55:00'
+    single = QueueForecaster(queue, NOW)
+    assert waits.tolist() == pytest.approx([single.wait(queue_id)[0] for queue_id in ids.tolist()])
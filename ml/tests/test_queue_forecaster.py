@@ -0,0 +1,80 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+# QueueForecaster lives with the backend's ML service
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backend', 'src', 'services'))
+from ml_predictions import QueueForecaster  # noqa: E402
+from queue_stages import MIN_REMAINING_MINUTES  # noqa: E402
+
+NOW = datetime(2026, 1, 17, 10, 0)
+
+
+def rows(durations, stages=None):
+    stages = stages or ['waiting'] * len(durations)
+    return [{'id': i + 1, 'estimated_duration': d, 'stage': s} for i, (d, s) in enumerate(zip(durations, stages))]
+
+
+def waits(forecaster):
+    return {entry['id']: forecaster.wait(entry['id'])[0] for entry in forecaster.forecast()}
+
+
+def test_forecast_waits_are_exclusive_prefix_sums():
+    durations = [12.0, 8.0, 15.0, 5.0]
+    forecast = QueueForecaster(rows(durations), NOW).forecast()
+    assert [entry['predicted_wait_minutes'] for entry in forecast] == [0, 12, 20, 35]
+    assert [entry['position'] for entry in forecast] == [0, 1, 2, 3]
+    spread = QueueForecaster.DURATION_CV * np.array(durations)
+    assert forecast[3]['wait_std_minutes'] == pytest.approx(np.sqrt((spread[:3] ** 2).sum()), abs=0.05)
+    assert all(entry['min_wait_minutes'] <= entry['predicted_wait_minutes'] <= entry['max_wait_minutes'] for entry in forecast)
+
+
+def test_in_service_and_finished_rows():
+    queue = rows([10.0, 10.0, 10.0, 10.0], ['consultation', 'payment', 'waiting', 'waiting'])
+    queue[0]['stage_start_time'] = (NOW - timedelta(minutes=4)).isoformat() + 'Z'
+    forecaster = QueueForecaster(queue, NOW)
+    # 6 minutes left in consultation; the patient at payment no longer holds anyone up
+    assert forecaster.wait(3) == (pytest.approx(6.0), pytest.approx((QueueForecaster.DURATION_CV * 6) ** 2))
+    assert forecaster.wait(4)[0] == pytest.approx(16.0)
+
+    queue[0]['stage_start_time'] = (NOW - timedelta(minutes=30)).isoformat()
+    overrun = QueueForecaster(queue, NOW)
+    assert overrun.wait(3)[0] == pytest.approx(MIN_REMAINING_MINUTES)
+
+
+def test_incremental_updates_match_a_rebuild():
+    rng = np.random.default_rng(3)
+    durations = rng.uniform(5, 20, 40).round(1).tolist()
+    forecaster = QueueForecaster(rows(durations), NOW)
+    remaining = {i + 1: d for i, d in enumerate(durations)}
+
+    for _ in range(3):
+        forecaster.advance()
+        del remaining[min(remaining)]
+    for queue_id in (10, 25, 40):
+        forecaster.remove(queue_id)
+        del remaining[queue_id]
+    forecaster.update_remaining(12, 3.5)
+    remaining[12] = 3.5
+    forecaster.remove(min(remaining))
+    del remaining[min(remaining)]
+
+    rebuilt = QueueForecaster([{'id': queue_id, 'estimated_duration': d} for queue_id, d in remaining.items()], NOW)
+    assert waits(forecaster) == pytest.approx(waits(rebuilt))
+    assert [entry['id'] for entry in forecaster.forecast()] == list(remaining)
+    assert [entry['predicted_wait_minutes'] for entry in forecaster.forecast()] == \
+        [entry['predicted_wait_minutes'] for entry in rebuilt.forecast()]
+
+
+def test_fenwick_prefix_sums():
+    values = np.arange(1.0, 18.0)
+    tree = QueueForecaster._build_tree(values)
+    assert [QueueForecaster._tree_prefix(tree, i) for i in range(len(values) + 1)] == \
+        pytest.approx(np.r_[0.0, np.cumsum(values)].tolist())
+    QueueForecaster._tree_add(tree, 4, 10.0)
+    values[4] += 10.0
+    assert QueueForecaster._tree_prefix(tree, 17) == pytest.approx(values.sum())
+    assert QueueForecaster._tree_prefix(tree, 4) == pytest.approx(values[:4].sum())
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from generate_data import COLUMN_SCHEMA
+from queue_simulator import CONSULTATION, STAGES, ClinicConfig, QueueSimulator
+
+
+@pytest.fixture(scope='module')
+def simulator():
+    config = ClinicConfig(doctors=4, days=7, arrivals_per_doctor_day=30, staff={'checkin': 1, 'triage': 2, 'payment': 1})
+    return QueueSimulator(config, seed=7).run()
+
+
+def max_concurrent(starts, ends):
+    """Most intervals [start, end) open at once."""
+    events = sorted([(t, 1) for t in starts] + [(t, -1) for t in ends], key=lambda event: (event[0], event[1]))
+    return max(np.cumsum([delta for _, delta in events]))
+
+
+def test_every_patient_passes_every_stage_in_order(simulator):
+    assert simulator.open_days == 6  # the Sunday is closed
+    assert not np.isnan(simulator.service_start).any()
+    assert (simulator.service_start >= simulator.stage_arrival).all()
+    assert np.allclose(simulator.stage_arrival[0], simulator.arrival)
+    # Each stage is reached the moment the previous one's service ends
+    finished = simulator.service_start[:-1] + simulator.service[:-1]
+    assert np.allclose(simulator.stage_arrival[1:], finished)
+    assert (simulator.waits() >= 0).all()
+
+
+def test_stages_never_serve_more_patients_than_staff(simulator):
+    starts, ends = simulator.service_start, simulator.service_start + simulator.service
+    for stage, name in enumerate(STAGES):
+        if stage == CONSULTATION:
+            for doctor in range(simulator.config.doctors):
+                mine = simulator.doctor == doctor
+                assert max_concurrent(starts[stage, mine], ends[stage, mine]) <= simulator.config.consultation_staff_per_doctor
+        else:
+            assert max_concurrent(starts[stage], ends[stage]) == simulator.config.staff[name]
+
+
+def test_same_seed_same_run():
+    config = ClinicConfig(doctors=3, days=3, arrivals_per_doctor_day=20)
+    first = QueueSimulator(config, seed=11).run()
+    second = QueueSimulator(config, seed=11).run()
+    assert first.summary() == second.summary()
+    assert QueueSimulator(config, seed=12).run().summary() != first.summary()
+
+
+def test_more_staff_shortens_that_stage_queue(simulator):
+    baseline = simulator.summary()
+    more_triage = QueueSimulator(simulator.config.with_staff(triage=4), seed=7).run().summary()
+    assert more_triage['patients'] == baseline['patients']
+    assert more_triage['mean_stage_queue_minutes']['triage'] < baseline['mean_stage_queue_minutes']['triage']
+    assert more_triage['utilization']['triage'] == pytest.approx(baseline['utilization']['triage'] / 2)
+    # with_staff leaves the original configuration alone
+    assert simulator.config.staff['triage'] == 2
+
+
+def test_training_frame_matches_the_generated_data_schema(simulator):
+    frame = simulator.to_training_frame()
+    assert list(frame.columns) == list(COLUMN_SCHEMA)
+    assert len(frame) == simulator.n_patients
+    assert np.allclose(frame['actual_wait_time'], simulator.waits())
+    assert frame['hospital_occupancy'].between(0, 1).all()
@@ -0,0 +1,124 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+from appointment_feed import fetch_new_appointments
+from retrain_model import (HISTORY_FEATURES, VARIANCE_WINDOW, RetrainState, add_trees, bootstrap_state,
+                           build_training_rows, incremental_retrain, update_queue_counts)
+
+START = datetime(2026, 1, 12, 9, 0)
+
+
+def create_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE appointments (id INTEGER PRIMARY KEY, doctor_id INTEGER, appointment_time TEXT, "
+                 "actual_duration REAL, status TEXT)")
+    conn.execute("CREATE TABLE queue (id INTEGER PRIMARY KEY, doctor_id INTEGER, created_at TEXT)")
+    conn.commit()
+    return conn
+
+
+def add_appointments(conn, n, rng, status='completed'):
+    first_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM appointments").fetchone()[0] + 1
+    rows = []
+    for i in range(first_id, first_id + n):
+        when = START + timedelta(days=i // 8, minutes=20 * (i % 8))
+        duration = float(rng.uniform(5, 25)) if status == 'completed' else None
+        rows.append((i, 1 + i % 2, when.isoformat(), duration, status))
+    conn.executemany("INSERT INTO appointments VALUES (?, ?, ?, ?, ?)", rows)
+    conn.executemany("INSERT INTO queue (doctor_id, created_at) VALUES (?, ?)", [(row[1], row[2]) for row in rows])
+    conn.commit()
+    return [row[0] for row in rows]
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    conn = create_db(path)
+    yield path, conn
+    conn.close()
+
+
+def fit_and_save(tmp_path, state, conn):
+    """Small models trained on everything `state` has not consumed yet, saved the way a version holds them."""
+    update_queue_counts(conn, state)
+    data = build_training_rows(fetch_new_appointments(conn, state), state)
+    pipeline = HISTORY_FEATURES.fit(HISTORY_FEATURES.matrix(data))
+    features_scaled = pipeline.transform(HISTORY_FEATURES.matrix(data))
+    paths = {'mean': str(tmp_path / 'mean.pkl'), 'variance': str(tmp_path / 'variance.pkl'),
+             'pipeline': str(tmp_path / 'feature_pipeline.json'), 'state': str(tmp_path / 'retrain_state.json')}
+    joblib.dump(RandomForestRegressor(n_estimators=5, random_state=0).fit(features_scaled, data['actual_wait_time']), paths['mean'])
+    joblib.dump(RandomForestRegressor(n_estimators=5, random_state=0).fit(features_scaled, data['variance']), paths['variance'])
+    pipeline.save(paths['pipeline'])
+    state.save(paths['state'])
+    return paths
+
+
+def test_bootstrap_replays_the_whole_history(db):
+    path, conn = db
+    rng = np.random.default_rng(0)
+    completed = add_appointments(conn, 20, rng)
+    state = bootstrap_state(path)
+    assert state.last_appointment_id == completed[-1]
+    assert state.last_queue_id == 20
+    assert sum(count for _, count in state.daily_durations.values()) == 20
+    # Only the last VARIANCE_WINDOW - 1 durations per doctor are kept for the rolling std
+    assert all(len(window) == VARIANCE_WINDOW - 1 for window in state.recent_durations.values())
+
+
+def test_incremental_retrain_trains_on_new_rows_only(db, tmp_path):
+    path, conn = db
+    rng = np.random.default_rng(1)
+    add_appointments(conn, 40, rng)
+    paths = fit_and_save(tmp_path, RetrainState(), conn)
+
+    # Too few new rows: nothing is published and the saved state still has them ahead of it
+    add_appointments(conn, 3, rng)
+    assert incremental_retrain(path, RetrainState.load(paths['state']), paths, 2, 50, min_rows=5) is None
+
+    add_appointments(conn, 10, rng)
+    state = RetrainState.load(paths['state'])
+    mean_model, var_model, pipeline, n_rows = incremental_retrain(path, state, paths, 2, 50, min_rows=5)
+    assert n_rows == 13
+    assert len(mean_model.estimators_) == 7 and len(var_model.estimators_) == 7
+    assert state.last_appointment_id == 53
+    # The next run starts above everything this one trained on
+    assert incremental_retrain(path, state, paths, 2, 50, min_rows=1) is None
+
+
+def test_open_appointment_holds_back_the_mark(db):
+    path, conn = db
+    rng = np.random.default_rng(2)
+    add_appointments(conn, 10, rng)
+    (pending,) = add_appointments(conn, 1, rng, status='scheduled')
+    later = add_appointments(conn, 5, rng)
+    conn.execute("UPDATE appointments SET appointment_time = ? WHERE id = ?", (datetime.now().isoformat(), pending))
+    conn.commit()
+
+    state = bootstrap_state(path)
+    assert state.last_appointment_id == pending - 1
+    assert state.processed_ids == set(later)
+
+    # The held-back appointment completes: only it is new, the rows above the mark are not trained on twice
+    conn.execute("UPDATE appointments SET actual_duration = 12.0, status = 'completed' WHERE id = ?", (pending,))
+    conn.commit()
+    new_rows = fetch_new_appointments(conn, state)
+    assert [row[0] for row in new_rows] == [pending]
+    assert state.last_appointment_id == later[-1]
+    assert state.processed_ids == set()
+
+
+def test_add_trees_keeps_the_newest_trees():
+    rng = np.random.default_rng(3)
+    features = rng.normal(size=(200, len(HISTORY_FEATURES.columns)))
+    target = features[:, 0] + rng.normal(0, 0.1, 200)
+    model = RandomForestRegressor(n_estimators=4, random_state=0).fit(features, target)
+    original = list(model.estimators_)
+    add_trees(model, features[:50], target[:50], trees_per_update=3, max_trees=5)
+    assert len(model.estimators_) == 5 and model.n_estimators == 5
+    # The two oldest trees were dropped
+    assert model.estimators_[:2] == original[2:]
@@ -0,0 +1,106 @@
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+# SlotRecommender lives with the backend's ML service
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backend', 'src', 'services'))
+from ml_predictions import SlotRecommender, WaitTimePredictor  # noqa: E402
+
+# A Monday
+START = datetime(2026, 1, 19, 0, 0)
+
+
+def slots(days=7, hours=(9, 11, 13, 15, 17)):
+    return [(START + timedelta(days=day, hours=hour)).isoformat() for day in range(days) for hour in hours]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE doctors (id INTEGER PRIMARY KEY, specialty TEXT, available_slots TEXT, is_active INTEGER)")
+    conn.execute("CREATE TABLE appointments (id INTEGER PRIMARY KEY, doctor_id INTEGER, appointment_time TEXT, status TEXT)")
+    conn.executemany("INSERT INTO doctors VALUES (?, ?, ?, ?)", [
+        (1, 'General', json.dumps(slots()), 1),
+        (2, 'General', json.dumps(slots(hours=(10, 14))), 1),
+        (3, 'General', json.dumps(slots(hours=(8,))), 0),
+        (4, 'Cardiology', json.dumps(slots()), 1),
+    ])
+    # Monday 09:00 with doctor 1 is already busy
+    conn.executemany("INSERT INTO appointments (doctor_id, appointment_time, status) VALUES (?, ?, ?)",
+                     [(1, (START + timedelta(hours=9, minutes=10 * i)).isoformat(), 'booked') for i in range(4)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def recommender(db_path, tmp_path):
+    return SlotRecommender(WaitTimePredictor(), db_path=db_path, index_path=str(tmp_path / 'index' / 'slot_load.npz'))
+
+
+def brute_force_scores(predictor, doctor_id, booked):
+    """predict_slot_availability per slot, plus the days-ahead penalty"""
+    scores = {}
+    for slot in slots():
+        when = datetime.fromisoformat(slot)
+        result = predictor.predict_slot_availability(doctor_id, slot, booked.get(when.strftime('%Y-%m-%d %H'), 0))
+        if result['factors']['day_factor'] > 0:
+            days_ahead = (when - START).total_seconds() / 86400
+            scores[slot] = round(result['expected_wait_minutes'] + SlotRecommender.DAYS_AHEAD_PENALTY * days_ahead, 2)
+    return scores
+
+
+def test_recommendations_match_scoring_every_slot(db_path, tmp_path):
+    result = recommender(db_path, tmp_path).recommend(doctor_id=1, start=START.isoformat(), top_k=6)
+    assert result['candidates'] == 35
+    scores = brute_force_scores(WaitTimePredictor(), 1, {START.strftime('%Y-%m-%d') + ' 09': 4})
+    best = sorted(scores.values())[:6]
+    assert [slot['score'] for slot in result['slots']] == pytest.approx(best, abs=0.5)
+    for slot in result['slots']:
+        assert slot['score'] == pytest.approx(scores[slot['slot_time']], abs=0.5)
+        # Sundays are closed
+        assert datetime.fromisoformat(slot['slot_time']).weekday() != 6
+    assert START.replace(hour=9).isoformat() not in [slot['slot_time'] for slot in result['slots']]
+
+
+def test_specialty_covers_its_active_doctors(db_path, tmp_path):
+    result = recommender(db_path, tmp_path).recommend(specialty='General', start=START.isoformat(), top_k=100)
+    assert result['candidates'] == 35 + 14
+    assert {slot['doctor_id'] for slot in result['slots']} == {1, 2}
+    # Every open slot but Sunday's, best first
+    assert len(result['slots']) == 30 + 12
+    assert [slot['score'] for slot in result['slots']] == sorted(slot['score'] for slot in result['slots'])
+
+
+def test_load_index_raises_typically_busy_hours(db_path, tmp_path):
+    conn = sqlite3.connect(db_path)
+    # Wednesdays at 11:00 have been busy for the past four weeks
+    history = [(1, (START + timedelta(days=2 - 7 * week, hours=11, minutes=5 * i)).isoformat(), 'completed')
+               for week in range(1, 5) for i in range(3)]
+    conn.executemany("INSERT INTO appointments (doctor_id, appointment_time, status) VALUES (?, ?, ?)", history)
+    conn.commit()
+    conn.close()
+
+    engine = recommender(db_path, tmp_path)
+    wednesday = (START + timedelta(days=2, hours=11)).isoformat()
+    before = {slot['slot_time']: slot for slot in engine.recommend(doctor_id=1, start=START.isoformat(), top_k=100)['slots']}
+    assert engine.build_index()['doctors'] == 1
+    after = {slot['slot_time']: slot for slot in engine.recommend(doctor_id=1, start=START.isoformat(), top_k=100)['slots']}
+    assert before[wednesday]['factors']['typical_bookings'] == 0
+    # 12 bookings over the 5 weeks doctor 1 has appointments in, counting this week's
+    assert after[wednesday]['factors']['typical_bookings'] == pytest.approx(12 / 5)
+    assert after[wednesday]['score'] > before[wednesday]['score']
+
+    # A new recommender picks the saved index up
+    reloaded = recommender(db_path, tmp_path).recommend(doctor_id=1, start=START.isoformat(), top_k=100)
+    assert {slot['slot_time']: slot['score'] for slot in reloaded['slots']} == {key: slot['score'] for key, slot in after.items()}
+
+
+def test_doctor_or_specialty_is_required(db_path, tmp_path):
+    with pytest.raises(ValueError):
+        recommender(db_path, tmp_path).recommend()
+    assert recommender(db_path, tmp_path).recommend(specialty='Neurology') == {'slots': [], 'candidates': 0}
@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+
+import pytest
+
+# The heuristic WaitTimePredictor lives with the backend's ML service
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backend', 'src', 'services'))
+from ml_predictions import WaitTimePredictor  # noqa: E402
+from prediction_cache import PredictionCache  # noqa: E402
+
+ENTRIES = [
+    {'queue_length': 0, 'specialty': 'General', 'appointment_time': '2026-01-19T09:15:00'},
+    {'queue_length': 3, 'specialty': 'Cardiology', 'appointment_time': '2026-01-19T10:30:00Z'},
+    {'queue_length': 7, 'specialty': 'Pediatrics', 'appointment_time': '2026-01-20T12:45:00', 'doctor_avg_time': 22.5},
+    {'queue_length': 12, 'specialty': 'Unknown', 'appointment_time': '2026-01-23T15:05:00'},
+    {'queue_length': 20, 'specialty': 'Dermatology', 'appointment_time': '2026-01-24T17:30:00', 'doctor_avg_time': 9.0},
+    {'queue_length': 5, 'specialty': 'Orthopedics', 'appointment_time': '2026-01-25T11:00:00'},
+]
+
+
+@pytest.mark.parametrize('noise_mode', ['seeded', 'analytic'])
+def test_predict_many_matches_predict(noise_mode):
+    predictor = WaitTimePredictor(noise_mode=noise_mode)
+    assert predictor.predict_many(ENTRIES) == [predictor.predict(**entry) for entry in ENTRIES]
+
+
+def test_predict_many_random_mode_stays_in_the_noise_band():
+    predictor = WaitTimePredictor(noise_mode='random')
+    analytic = WaitTimePredictor(noise_mode='analytic').predict_many(ENTRIES)
+    low, high = WaitTimePredictor.NOISE_BAND
+    for result, reference in zip(predictor.predict_many(ENTRIES), analytic):
+        assert low * reference['predicted_wait_minutes'] - 1 <= result['predicted_wait_minutes'] <= high * reference['predicted_wait_minutes'] + 1
+        assert result['factors'] == reference['factors']
+
+
+def test_predict_many_of_nothing():
+    assert WaitTimePredictor().predict_many([]) == []
+
+
+def test_seeded_predictions_are_reproducible():
+    first = [json.dumps(WaitTimePredictor().predict(**entry), sort_keys=True) for entry in ENTRIES]
+    second = [json.dumps(WaitTimePredictor().predict(**entry), sort_keys=True) for entry in ENTRIES]
+    assert first == second
+    # Only the hour and weekday of the appointment time matter
+    entry = ENTRIES[1]
+    assert WaitTimePredictor().predict(**{**entry, 'appointment_time': '2026-01-19T10:59:00Z'}) == WaitTimePredictor().predict(**entry)
+
+
+def test_seeded_noise_stays_in_the_band_and_varies_with_inputs():
+    predictor = WaitTimePredictor()
+    low, high = WaitTimePredictor.NOISE_BAND
+    factors = {predictor._noise_factor(('General', queue_length)) for queue_length in range(50)}
+    assert all(low <= factor < high for factor in factors)
+    assert len(factors) == 50
+
+
+def test_analytic_range_covers_every_noisy_outcome():
+    analytic = WaitTimePredictor(noise_mode='analytic').predict_many(ENTRIES)
+    for noise_mode in ('seeded', 'random'):
+        for result, envelope in zip(WaitTimePredictor(noise_mode=noise_mode).predict_many(ENTRIES), analytic):
+            assert envelope['min_wait_minutes'] <= result['predicted_wait_minutes'] <= envelope['max_wait_minutes']
+
+
+def test_cache_is_keyed_by_noise_mode():
+    cache = PredictionCache()
+    entry = ENTRIES[3]
+    seeded = WaitTimePredictor(cache=cache).predict(**entry)
+    analytic = WaitTimePredictor(cache=cache, noise_mode='analytic').predict(**entry)
+    assert analytic == WaitTimePredictor(noise_mode='analytic').predict(**entry)
+    assert seeded == WaitTimePredictor().predict(**entry)
+
+
+def test_unknown_noise_mode_is_rejected():
+    with pytest.raises(ValueError):
+        WaitTimePredictor(noise_mode='gaussian')
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from instrumentation import METRICS
+from predict import CachedPredictor, fallback_prediction, predict_requests
+from prediction_cache import PredictionCache
+from prediction_server import metrics_response
+from worker_pool import PredictionPool
+
+REQUEST = {'total_queue_length': 6, 'patients_at_current_stage': 2, 'staff_at_current_stage': 2, 'hospital_occupancy': 0.5,
+           'patient_age': 40, 'traffic_level': 3, 'doctor_experience': 10, 'slot_time': '2026-01-17T14:00:00Z'}
+
+# traffic_level values the fake model reacts to
+SLOW, CRASH = 8, 9
+
+
+class FakeModel:
+    """Mean = queue length * 3; a SLOW row takes a second, a CRASH row kills the worker."""
+
+    def predict_batch(self, feature_matrix):
+        traffic = feature_matrix[:, 5]
+        if (traffic == CRASH).any():
+            os._exit(1)
+        if (traffic == SLOW).any():
+            time.sleep(1.0)
+        return feature_matrix[:, 0] * 3.0, np.full(len(feature_matrix), 4.0)
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(predictor=None, **kwargs):
+        pool = PredictionPool(predictor or FakeModel(), **{'workers': 1, 'timeout': 5.0, **kwargs})
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def test_pool_answers_like_the_server_process(make_pool):
+    pool = make_pool(workers=2)
+    requests = [{**REQUEST, 'total_queue_length': n} for n in range(6)]
+    assert [pool.predict(request) for request in requests] == predict_requests(FakeModel(), requests)
+    assert pool.stats()['alive'] == 2
+
+
+def test_requests_beyond_max_pending_get_the_fallback(make_pool):
+    pool = make_pool(max_pending=1)
+    slow = threading.Thread(target=pool.predict, args=({**REQUEST, 'traffic_level': SLOW},))
+    slow.start()
+    while pool.stats()['pending'] < 1:
+        time.sleep(0.01)
+    result = pool.predict(REQUEST)
+    slow.join()
+    assert result == {**fallback_prediction(REQUEST['total_queue_length']), 'degraded': True, 'fallback_reason': 'saturated'}
+    # Capacity comes back once the slow request is answered
+    assert pool.predict(REQUEST)['mean'] == 18.0
+
+
+def test_slow_answers_time_out_to_the_fallback(make_pool):
+    pool = make_pool(timeout=0.2)
+    result = pool.predict({**REQUEST, 'traffic_level': SLOW})
+    assert result['degraded'] and result['fallback_reason'] == 'timeout'
+    time.sleep(1.0)
+    assert pool.predict(REQUEST)['mean'] == 18.0
+
+
+def test_dead_worker_is_replaced(make_pool):
+    pool = make_pool()
+    result = pool.predict({**REQUEST, 'traffic_level': CRASH})
+    assert result['degraded'] and result['fallback_reason'] == 'worker_failed'
+    assert pool.predict(REQUEST)['mean'] == 18.0
+    assert pool.stats()['restarts'] == 1 and pool.stats()['alive'] == 1
+
+
+def test_worker_metrics_and_cache_statistics_reach_the_parent(make_pool):
+    METRICS.reset()
+    predictor = CachedPredictor(FakeModel, PredictionCache())
+    pool = make_pool(predictor, workers=2)
+    for n in (1, 2, 1, 2, 3):
+        pool.predict({**REQUEST, 'total_queue_length': n})
+    # A worker that dies keeps its counts in the totals
+    pool.predict({**REQUEST, 'traffic_level': CRASH})
+    pool.predict({**REQUEST, 'total_queue_length': 4})
+
+    metrics = pool.metrics()
+    # The crashed batch never reported back
+    assert metrics.counters['predictions_total'] == 6
+    assert metrics.counters['pool_requests_total'] == 7
+    assert metrics.timers['features']['count'] == 6
+    cache = pool.cache_stats()
+    assert cache['hits'] + cache['misses'] == 6
+    assert cache['hit_rate'] == cache['hits'] / 6
+    prometheus = metrics_response(predictor, 'prometheus', pool)['prometheus']
+    assert 'mediqueue_predictions_total 6' in prometheus
+    assert 'mediqueue_cache_misses' in prometheus